@@ -1,10 +1,26 @@
+import io
 import os
+import sys
+import base64
+import hashlib
+import json
 import re
+import atexit
+import sqlite3
 import enum
-from flask import Flask, request, jsonify
+import time
+import threading
+from functools import partial
+from flask import Flask, request, jsonify, g, Response
 from datetime import datetime, timedelta
 from flask_cors import CORS, cross_origin
 from flask_sqlalchemy import SQLAlchemy 
+from flask_migrate import Migrate, stamp as stamp_migrations, upgrade as upgrade_migrations
+from sqlalchemy import event, inspect
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy.engine import Engine
+import click
 import bcrypt as bcrypt_lib
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
@@ -46,83 +62,115 @@ except ImportError:
 
 import numpy as np
 
-# Defer ML imports to prevent startup issues
-def load_ml_models():
-    if torch is None:
-        print("ERROR: Cannot load ML models because PyTorch is not available")
-        return None, None, None
-        
-    try:
-        from transformers import AutoImageProcessor, AutoModelForImageClassification
-        
-        processor = AutoImageProcessor.from_pretrained("dima806/deepfake_vs_real_image_detection")
-        model = AutoModelForImageClassification.from_pretrained("dima806/deepfake_vs_real_image_detection")
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        model.to(device)
-        return processor, model, device
-    except Exception as e:
-        print(f"Error loading ML models: {str(e)}")
-        return None, None, None
+from metrics import (
+    metrics_enabled,
+    track_stage,
+    record_model_load,
+    request_started,
+    request_finished,
+    request_teardown,
+    render_metrics,
+    record_model_ready,
+    record_coalesced,
+    record_cancelled,
+    record_tier,
+    record_explanation_cache,
+    record_blocklist_hit,
+)
+from ml_models import (
+    load_ml_models,
+    load_audio_model,
+    load_text_model,
+    warmup_image_model,
+    warmup_audio_model,
+    warmup_text_model,
+    build_reduced_model,
+    image_inputs,
+    load_image_detector,
+)
+from singleflight import SingleFlight, analysis_key
+from scheduler import (
+    QueueFull,
+    Cancelled,
+    DeadlineExceeded,
+    ClientDisconnected,
+    Deadline,
+    ANONYMOUS,
+    BATCH,
+    INTERACTIVE,
+    build_queues,
+    default_deadline,
+    socket_disconnect_probe,
+    make_tenant,
+    tenant_plans,
+)
+from degradation import FULL, REDUCED, build_controllers
+from cascade import build_cascade
+from ensemble import Ensemble, Member, ensemble_settings
+from tiling import fit_to_budget, cut_tiles, aggregate, TooManyTiles
+import prnu
+import ela
+from explain import explanation, ExplanationCache
+from model_store import model_revision
+import embedding_index as embeddings
+from blocklist import Blocklist
+from media import MediaUnavailable, decode_audio, audio_windows, iter_video_frames
+import content_writer
+import content_export
+import blob_store
+from blob_store import BlobStore
+import rollups
 
-def load_audio_model():
-    if torch is None:
-        print("ERROR: Cannot load audio model because PyTorch is not available")
-        return None, None, None
-        
-    try:
-        print("Initializing audio model...")
-        from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
-        
-        processor = AutoFeatureExtractor.from_pretrained(
-            "MelodyMachine/Deepfake-audio-detection-V2",
-            trust_remote_code=True
-        )
-        model = AutoModelForAudioClassification.from_pretrained(
-            "MelodyMachine/Deepfake-audio-detection-V2",
-            trust_remote_code=True
-        )
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        print(f"Using device: {device}")
-        model.to(device)
-        print("Audio model loaded successfully")
-        return processor, model, device
-    except Exception as e:
-        print(f"Error loading audio model: {str(e)}")
-        return None, None, None
+# Image detectors combined by model=ensemble, as (name, weight); see ensemble.py
+ENSEMBLE_MEMBERS, ENSEMBLE_THRESHOLD, ENSEMBLE_EARLY_EXIT = ensemble_settings()
 
-def load_text_model():
-    if torch is None:
-        print("ERROR: Cannot load text model because PyTorch is not available")
-        return None, None, None
-        
+# Per-model lifecycle, reported by /api/health/ready:
+# pending -> loading -> loaded -> warming -> ready, or failed / disabled
+MODEL_STATUS = {
+    name: {'status': 'pending', 'load_ms': None, 'warmup_ms': None, 'latency_ms': None, 'error': None}
+    for name in ['dima', 'melody', 'mosko'] + [name for name, _ in ENSEMBLE_MEMBERS if name != 'dima']
+}
+# Models that must be ready before the worker reports itself ready
+REQUIRED_MODELS = [name.strip() for name in os.environ.get('REQUIRED_MODELS', 'dima,melody,mosko').split(',') if name.strip()]
+STARTED_AT = time.time()
+
+def timed_model_load(name, loader):
+    # Loaders swallow their own errors and return Nones, so check the model slot
+    status = MODEL_STATUS[name]
+    status.update(status='loading', error=None)
+    start = time.perf_counter()
+    loaded = loader()
+    elapsed = time.perf_counter() - start
+    record_model_load(name, elapsed, loaded[1] is not None)
+    status['load_ms'] = round(elapsed * 1000, 1)
+    if loaded[1] is None:
+        status.update(status='failed', error='Model failed to load')
+    else:
+        status['status'] = 'loaded'
+    record_model_ready(name, loaded[1] is not None)
+    return loaded
+
+def load_and_warm_model(name, loader, warmup):
+    loaded = timed_model_load(name, loader)
+    if loaded[1] is None:
+        return loaded
+
+    status = MODEL_STATUS[name]
+    status['status'] = 'warming'
+    record_model_ready(name, False)
+    start = time.perf_counter()
     try:
-        print("Initializing text analysis model...")
-        model_id = "mmosko/Bert_Fake_News_Classification"
-        
-        # Load tokenizer and model with proper error handling
-        try:
-            tokenizer = AutoTokenizer.from_pretrained("bert-base-cased")
-            model = AutoModelForSequenceClassification.from_pretrained(model_id)
-            
-            # Update label mapping
-            model.config.id2label = {
-                0: "Fake News",
-                1: "Real News",
-                2: "Undecided"
-            }
-            model.config.label2id = {v: k for k, v in model.config.id2label.items()}
-            
-            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            model.to(device)
-            print("Text analysis model loaded successfully")
-            return tokenizer, model, device
-        except Exception as e:
-            print(f"Failed to load model or tokenizer: {str(e)}")
-            raise
-            
+        status['latency_ms'] = round(warmup(*loaded), 1)
     except Exception as e:
-        print(f"Error in load_text_model: {str(e)}")
-        return None, None, None
+        # Keep the model: a failed warmup usually means real requests will fail too, but let them try
+        print(f"Warning: Warmup failed for {name}: {str(e)}")
+        status.update(status='failed', error=f'Warmup failed: {str(e)}')
+        return loaded
+    status['warmup_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    status['status'] = 'ready'
+    record_model_ready(name, True)
+    print(f"{name} model warm ({status['warmup_ms']}ms, last pass {status['latency_ms']}ms)")
+    return loaded
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -133,7 +181,25 @@ app.config['DEBUG'] = os.environ.get('FLASK_DEBUG', 'False').lower() in ('1', 't
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///iris.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Load tests (benchmarks/http_load.py) switch this off to measure the app rather than the limiter
+app.config['RATELIMIT_ENABLED'] = os.environ.get('RATELIMIT_ENABLED', 'True').lower() in ('1', 'true', 'yes')
 db = SQLAlchemy(app)
+# Schema changes live in migrations/ (`flask db upgrade`)
+migrate = Migrate(app, db)
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+@event.listens_for(Engine, 'connect')
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets requests keep reading while the content writer commits, and a
+    # busy timeout makes a second writer wait for the lock instead of failing
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}')
+        cursor.close()
+
 CORS(app, 
     resources={
         r"/api/*": {
@@ -143,7 +209,7 @@ CORS(app,
                 "https://your-netlify-app.netlify.app"
             ],  # Frontend URLs allowed
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type", "Authorization"],
+            "allow_headers": ["Content-Type", "Authorization", "X-Request-Timeout", "X-Request-Deadline", "X-API-Key", "X-Username", "X-Request-Class"],
             "supports_credentials": True
         }
     }
@@ -158,28 +224,95 @@ limiter = Limiter(
 
 # Load ML models after app initialization
 processor_dima, model, device = None, None, None
-if not app.debug:
+processor_melody, model_audio, device_audio = None, None, None
+tokenizer_text, model_text, device_text = None, None, None
+# Reduced-tier copies used while degraded (see degradation.py)
+model_reduced, model_text_reduced = None, None
+image_ensemble = None
+# Known-fake lookup over the image model's CLS embeddings; see embedding_index.py
+embedding_index = None
+
+def _detector_predict(processor, detector, detector_device):
+    fake_index = _label_index(detector.config, 'fake', 1)
+
+    def predict(image):
+        inputs = image_inputs(processor, image.resize((IMAGE_SIZE[FULL], IMAGE_SIZE[FULL])), IMAGE_SIZE[FULL], detector_device)
+        with torch.no_grad():
+            logits = detector(**inputs).logits
+        return torch.nn.functional.softmax(logits, dim=-1)[0, fake_index].item()
+
+    return predict
+
+def build_image_ensemble():
+    members = []
+    for name, weight in ENSEMBLE_MEMBERS:
+        if name == 'dima':
+            loaded = (processor_dima, model, device)
+        else:
+            loaded = load_and_warm_model(name, partial(load_image_detector, name), warmup_image_model)
+        if loaded[1] is not None:
+            members.append(Member(name, weight, _detector_predict(*loaded)))
+    if not members:
+        return None
+    print(f"Image ensemble: {', '.join(f'{m.name} ({m.weight:g})' for m in members)}")
+    return Ensemble(members, threshold=ENSEMBLE_THRESHOLD, early_exit=ENSEMBLE_EARLY_EXIT)
+
+def load_reduced_model(name, model, device):
     try:
-        processor_dima, model, device = load_ml_models()
+        start = time.perf_counter()
+        reduced = build_reduced_model(model, device)
+        print(f"{name}: reduced tier ready in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return reduced
+    except Exception as e:
+        # The reduced tier still shrinks the inputs, just on the full model
+        print(f"Warning: Failed to build reduced {name} model: {str(e)}")
+        return model
+
+def load_models():
+    global processor_dima, model, device
+    global processor_melody, model_audio, device_audio
+    global tokenizer_text, model_text, device_text
+    global model_reduced, model_text_reduced, image_ensemble, embedding_index
+
+    try:
+        processor_dima, model, device = load_and_warm_model('dima', load_ml_models, warmup_image_model)
+        if model is not None:
+            model_reduced = load_reduced_model('dima', model, device)
     except Exception as e:
         print(f"Warning: Failed to load image models: {str(e)}")
 
-# Initialize models
-processor_melody, model_audio, device_audio = None, None, None
-if not app.debug:
+    if embeddings.ENABLED and model is not None:
+        try:
+            embedding_index = embeddings.EmbeddingIndex(model.config.hidden_size)
+        except Exception as e:
+            print(f"Warning: Failed to open the embedding index: {str(e)}")
+
     try:
-        processor_melody, model_audio, device_audio = load_audio_model()
+        processor_melody, model_audio, device_audio = load_and_warm_model('melody', load_audio_model, warmup_audio_model)
     except Exception as e:
         print(f"Warning: Failed to load audio models: {str(e)}")
 
-# Add these as global variables with your other model initializations
-tokenizer_text, model_text, device_text = None, None, None
-if not app.debug:
     try:
-        tokenizer_text, model_text, device_text = load_text_model()
+        tokenizer_text, model_text, device_text = load_and_warm_model('mosko', load_text_model, warmup_text_model)
+        if model_text is not None:
+            model_text_reduced = load_reduced_model('mosko', model_text, device_text)
     except Exception as e:
         print(f"Warning: Failed to load text model: {str(e)}")
 
+    try:
+        image_ensemble = build_image_ensemble()
+    except Exception as e:
+        print(f"Warning: Failed to build image ensemble: {str(e)}")
+
+if app.debug:
+    for status in MODEL_STATUS.values():
+        status['status'] = 'disabled'
+elif os.environ.get('BACKGROUND_MODEL_LOAD', 'False').lower() in ('1', 'true', 'yes'):
+    # Lets /api/health/live answer straight away; /api/health/ready stays 503 until warm
+    threading.Thread(target=load_models, name='model-loader', daemon=True).start()
+else:
+    load_models()
+
 # Enums
 class UploadType(enum.Enum):
     image = 'image'
@@ -214,7 +347,9 @@ class User(db.Model):
 
 class Content(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Null for analyses by anonymous clients and API keys
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    # The upload's path inside the blob store (see blob_store.py), or its name when it wasn't stored
     file_path = db.Column(db.String(255), nullable=False)
     file_name = db.Column(db.String(255), nullable=False)
     file_size = db.Column(db.Integer, nullable=False)
@@ -224,13 +359,96 @@ class Content(db.Model):
     upload_type = db.Column(db.Enum(UploadType), nullable=False)
     upload_category = db.Column(db.String(50), nullable=False)
     model_applied = db.Column(db.Enum(ModelApplied), nullable=False)
+    # SHA-256 of the upload; the blob store's reference count and the key of its blob
+    file_hash = db.Column(db.String(64), nullable=True, index=True)
     user = db.relationship('User', backref=db.backref('contents', lazy=True))
 
+    # History pages (/api/history) seek on these instead of scanning: each
+    # starts with the user, ends with the page order, and the optional
+    # filters sit in between
+    __table_args__ = (
+        db.Index('ix_content_user_date', 'user_id', 'upload_date', 'id'),
+        db.Index('ix_content_user_type_date', 'user_id', 'upload_type', 'upload_date', 'id'),
+        db.Index('ix_content_user_model_date', 'user_id', 'model_applied', 'upload_date', 'id'),
+        db.Index('ix_content_user_fake_date', 'user_id', 'is_deepfake', 'upload_date', 'id'),
+    )
+
+class AnalysisRollup(db.Model):
+    # Daily counts of Content rows for /api/stats; maintained by the content writer, see rollups.py
+    __tablename__ = 'analysis_rollup'
+    day = db.Column(db.Date, primary_key=True)
+    upload_type = db.Column(db.Enum(UploadType), primary_key=True)
+    model_applied = db.Column(db.Enum(ModelApplied), primary_key=True)
+    is_deepfake = db.Column(db.Boolean, primary_key=True)
+    # Index into rollups.LATENCY_BUCKETS_MS, or rollups.UNTIMED
+    latency_bucket = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    analyses = db.Column(db.Integer, nullable=False, default=0)
+    latency_ms_sum = db.Column(db.Float, nullable=False, default=0.0)
+
+# Request instrumentation
+def _metrics_endpoint():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    request_started(_metrics_endpoint())
+
+@app.after_request
+def finish_request_metrics(response):
+    request_finished(_metrics_endpoint(), request.method, response.status_code,
+                     time.perf_counter() - g.request_start)
+    return response
+
+@app.teardown_request
+def teardown_request_metrics(exc):
+    if 'request_start' in g:
+        request_teardown(_metrics_endpoint())
+
 # Routes
 @app.route('/api/health', methods=['GET'])
 def health_check():
     return jsonify({"status": "ok", "message": "API is running", "version": "1.0.0"}), 200
 
+@app.route('/api/health/live', methods=['GET'])
+@limiter.exempt
+def liveness_check():
+    # Only says the process is serving requests; model state is /api/health/ready's job
+    return jsonify({
+        "status": "ok",
+        "pid": os.getpid(),
+        "uptime_s": round(time.time() - STARTED_AT, 1)
+    }), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+@limiter.exempt
+def readiness_check():
+    not_ready = [
+        name for name in REQUIRED_MODELS
+        if MODEL_STATUS.get(name, {}).get('status') not in ('ready', 'loaded', 'disabled')
+    ]
+    return jsonify({
+        "status": "ready" if not not_ready else "not_ready",
+        "waiting_for": not_ready,
+        "models": MODEL_STATUS,
+        "queues": {name: queue.stats() for name, queue in inference_queues.items()},
+        "tiers": {name: controller.state() for name, controller in tier_controllers.items()},
+        "cascade": image_cascade.stats(),
+        "blocklist": known_fakes.stats(),
+        "pid": os.getpid()
+    }), 200 if not not_ready else 503
+
+@app.route('/api/metrics', methods=['GET'])
+@limiter.exempt
+def prometheus_metrics():
+    if not metrics_enabled:
+        return jsonify({
+            'error': 'Metrics unavailable',
+            'message': 'The server is missing the prometheus_client library.'
+        }), 503
+    payload, content_type = render_metrics()
+    return Response(payload, headers={'Content-Type': content_type}), 200
+
 @app.route('/api/register', methods=['POST'])
 @limiter.limit("5 per minute")
 def register():
@@ -412,11 +630,13 @@ def upload_file():
         # Load models if not already loaded
         global processor_dima, model, device
         if processor_dima is None or model is None:
-            processor_dima, model, device = load_ml_models()
+            processor_dima, model, device = timed_model_load('dima', load_ml_models)
 
         # Process the image with proper error handling
         try:
-            image = Image.open(file).convert('RGB')  # Convert to RGB format
+            file_bytes = file.read()
+            image = Image.open(io.BytesIO(file_bytes)).convert('RGB')  # Convert to RGB format
+            features = _image_features(image, 'image', 'dima', FULL)
             image = image.resize((224, 224))  # Resize to expected dimensions
             
             inputs = processor_dima(images=image, return_tensors="pt").to(device)
@@ -434,8 +654,10 @@ def upload_file():
                 "real_confidence": real_confidence,
                 "fake_confidence": fake_confidence,
                 "filename": file.filename,
-                "reason": "PRNU camera tampered" if label == "LABEL_1" else None
+                "reason": _image_reason(label == "LABEL_1", features["prnu"]),
+                **features
             }
+            record_analysis(file_bytes, 'image', 'dima', 'upload', result)
 
             return jsonify(result), 200
 
@@ -447,6 +669,493 @@ def upload_file():
         print(f"Server error: {str(e)}")
         return jsonify({"error": "Server error occurred"}), 500
 
+# Shared between request threads; see singleflight.py for the cross-worker part.
+# A leader that gives up because of its own deadline doesn't fail its waiters.
+analysis_flight = SingleFlight(retry_on=(Cancelled,))
+# Bounded per-upload-type queues in front of the models; see scheduler.py
+inference_queues = build_queues()
+# Switch image/video/text to the cheaper tier under sustained overload; see degradation.py
+tier_controllers = build_controllers()
+# Cheap prefilter in front of the full image model; see cascade.py
+image_cascade = build_cascade()
+# Explained image results, so the same heatmap is never computed twice; see explain.py
+explanation_cache = ExplanationCache()
+explanation_revision = model_revision('dima')
+# Partner feeds of known fake media, rebuilt in the background when they change; see blocklist.py
+known_fakes = Blocklist()
+if known_fakes.feeds:
+    known_fakes.watch()
+
+def _db_engine():
+    with app.app_context():
+        return db.engine
+
+# Uploaded media, kept once per distinct file; see blob_store.py
+blobs = BlobStore() if blob_store.ENABLED else None
+
+def store_upload(data, digest=None):
+    """Puts uploaded media in the blob store; returns its digest, or None when it couldn't be kept."""
+    try:
+        return blobs.put(data, digest)
+    except OSError as e:
+        # The verdict still gets recorded, just without the media behind it
+        print(f"Blob store error: {str(e)}")
+        return None
+
+def store_uploads(rows):
+    """Content writer hook: stores the media behind queued rows before any of them is inserted."""
+    for row in rows:
+        upload = row.pop('upload', None)
+        if upload is None:
+            continue
+        file_hash = store_upload(*upload)
+        if file_hash:
+            row.update(file_hash=file_hash, file_path=BlobStore.relative_path(file_hash))
+
+# Every analysis becomes a Content row, written in batches off the request path; see content_writer.py.
+# The writer thread also stores the upload behind each row, so no request waits on a blob write either
+analysis_writer = content_writer.ContentWriter(Content.__table__, _db_engine, before_insert=store_uploads,
+                                               after_insert=partial(rollups.add, AnalysisRollup.__table__))
+atexit.register(analysis_writer.close)
+
+# Longest deadline a client may ask for
+MAX_DEADLINE_S = float(os.environ.get('DEADLINE_MAX_S', '600'))
+AUDIO_SAMPLING_RATE = 16000
+AUDIO_WINDOW_S = float(os.environ.get('AUDIO_WINDOW_S', '4'))
+VIDEO_SAMPLE_FPS = float(os.environ.get('VIDEO_SAMPLE_FPS', '1'))
+VIDEO_MAX_FRAMES = {
+    FULL: int(os.environ.get('VIDEO_MAX_FRAMES', '64')),
+    REDUCED: int(os.environ.get('VIDEO_MAX_FRAMES_REDUCED', '16')),
+}
+IMAGE_SIZE = {FULL: 224, REDUCED: int(os.environ.get('IMAGE_SIZE_REDUCED', '160'))}
+TEXT_MAX_LENGTH = {FULL: 512, REDUCED: int(os.environ.get('TEXT_MAX_LENGTH_REDUCED', '256'))}
+VIDEO_BATCH_FRAMES = int(os.environ.get('VIDEO_BATCH_FRAMES', '8'))
+
+def request_deadline(upload_type):
+    """Deadline from X-Request-Deadline (unix seconds) or X-Request-Timeout (seconds), else the default for the type."""
+    timeout = default_deadline(upload_type)
+    try:
+        if request.headers.get('X-Request-Deadline'):
+            timeout = float(request.headers['X-Request-Deadline']) - time.time()
+        elif request.headers.get('X-Request-Timeout'):
+            timeout = float(request.headers['X-Request-Timeout'])
+    except ValueError:
+        pass  # Malformed header: keep the default
+    return Deadline(min(timeout, MAX_DEADLINE_S), socket_disconnect_probe(request.environ))
+
+# Named API keys for machine clients, e.g. '{"<secret>": "crawler"}' -> tenant "key:crawler"
+API_KEYS = json.loads(os.environ.get('IRIS_API_KEYS', '{}'))
+_user_ids = {}
+
+def _user_id(username):
+    if username not in _user_ids:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            return None
+        _user_ids[username] = user.id
+    return _user_ids[username]
+
+def request_tenant():
+    """Who a request queues as: a known API key, then the user, then the client address."""
+    plans = tenant_plans()
+    key_name = API_KEYS.get(request.headers.get('X-API-Key', ''))
+    if key_name:
+        return make_tenant(f'key:{key_name}', plans=plans)
+    username = request.form.get('username') or request.headers.get('X-Username')
+    if username:
+        user_id = _user_id(username)
+        if user_id is not None:
+            return make_tenant(f'user:{user_id}', plans=plans)
+    # Addresses would blow up the metric labels, so they all report as 'anonymous'
+    return make_tenant(f'ip:{get_remote_address()}', label='anonymous', plans=plans)
+
+def request_lane():
+    # Crawlers and bulk jobs mark themselves so they queue behind people waiting on a page
+    request_class = request.headers.get('X-Request-Class') or request.form.get('request_class', '')
+    return BATCH if request_class.lower() == BATCH else INTERACTIVE
+
+def _request_user_id():
+    username = request.form.get('username') or request.headers.get('X-Username')
+    return _user_id(username) if username else None
+
+# Model behind each kind of verdict when the request named something else (e.g. an ensemble)
+APPLIED_MODELS = {'image': ModelApplied.dima, 'video': ModelApplied.dima, 'audio': ModelApplied.melody, 'text': ModelApplied.mosko}
+# Large and reproducible from the explanation cache, so not copied into every row
+UNSTORED_FIELDS = ('explanation',)
+
+def record_analysis(data, upload_type, model_type, category, result, digest=None):
+    """Queues a Content row for a finished analysis; the request never waits for the insert."""
+    if not content_writer.ENABLED:
+        return
+    kind = UploadType.__members__.get(upload_type, UploadType.text)
+    file_name = result.get('filename') or result.get('title') or ''
+    # Request time so far, for the latency percentiles in the daily rollups
+    latency_ms = round((time.perf_counter() - g.request_start) * 1000, 1) if 'request_start' in g else None
+    row = {
+        'user_id': _request_user_id(),
+        'file_path': file_name,
+        'file_name': file_name,
+        'file_size': len(data),
+        'is_deepfake': str(result.get('result', '')).lower() == 'fake',
+        'analysis': dict({name: value for name, value in result.items() if name not in UNSTORED_FIELDS},
+                         latency_ms=latency_ms),
+        'upload_date': datetime.utcnow(),
+        'upload_type': kind,
+        'upload_category': category,
+        'model_applied': ModelApplied.__members__.get(model_type, APPLIED_MODELS[kind.value]),
+        'file_hash': None,
+    }
+    if blobs is not None and kind is not UploadType.text and data:
+        # Stored by the writer thread, which fills in file_hash and file_path; see store_uploads
+        row['upload'] = (data, digest)
+    analysis_writer.submit(row)
+
+def current_tier(upload_type):
+    controller = tier_controllers.get(upload_type)
+    if controller is None:
+        return FULL
+    return controller.update(*inference_queues[upload_type].load())
+
+def run_queued(upload_type, fn, deadline=None, tenant=ANONYMOUS, lane=INTERACTIVE):
+    with inference_queues[upload_type].slot(deadline, tenant, lane):
+        return fn()
+
+def _label_index(config, name, default):
+    for index, label in config.id2label.items():
+        if name in label.lower():
+            return int(index)
+    return default
+
+def _image_inputs(images, tier):
+    return image_inputs(processor_dima, images, IMAGE_SIZE[tier], device)
+
+def _image_result(outputs):
+    predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
+    real_confidence, fake_confidence = predictions[0].tolist()
+    predicted_class = predictions.argmax().item()
+    label = model.config.id2label[predicted_class]
+
+    return {
+        "result": "real" if label == "LABEL_0" else "fake",
+        "real_confidence": real_confidence,
+        "fake_confidence": fake_confidence
+    }
+
+def _image_reason(is_fake, prnu_result):
+    # Only blame the sensor noise when the PRNU check actually found it inconsistent
+    if prnu_result and prnu_result["tampered"]:
+        return "PRNU camera tampered"
+    return "Deepfake detector flagged the image" if is_fake else None
+
+def _image_features(image, upload_type, model_type, tier, ela_heatmap=False):
+    # Model-independent signals, all computed from the one decoded image
+    pixels = np.asarray(image)
+    features = {"prnu": None, "ela": None}
+    if prnu.ENABLED and tier != REDUCED:
+        # The costlier of the two; skipped when the server is degrading to save time
+        with track_stage('prnu', upload_type, model_type):
+            features["prnu"] = prnu.analyze(pixels)
+    if ela.ENABLED:
+        with track_stage('ela', upload_type, model_type):
+            features["ela"] = ela.analyze(image, pixels, heatmap=ela_heatmap)
+    return features
+
+def _with_features(result, features):
+    return dict(result, reason=_image_reason(result["result"] == "fake", features["prnu"]), **features)
+
+def _known_fake(match, upload_type):
+    record_blocklist_hit(upload_type, match["match"])
+    return {
+        "result": "fake",
+        "real_confidence": 0.0,
+        "fake_confidence": 1.0,
+        "reason": f"Known fake media listed in {match['source']}",
+        "blocklist": match
+    }
+
+def _check_known_image(image, upload_type):
+    # Perceptual hashes survive re-encoding, so re-saved copies of listed images are caught too
+    match = known_fakes.check_image(image)
+    return _known_fake(match, upload_type) if match else None
+
+def prepare_image(file_bytes, upload_type, model_type, tier, options):
+    """Everything the image analyzers need that isn't a model: decoding, the blocklist, PRNU and ELA.
+
+    Runs before the request queues for an inference slot, so these CPU-bound
+    steps don't hold one. Returns (known fake result or None, keyword
+    arguments for the analyzer).
+    """
+    options = dict(options)
+    with track_stage('decode', upload_type, model_type):
+        image = Image.open(io.BytesIO(file_bytes)).convert('RGB')  # Convert to RGB format
+    known = _check_known_image(image, upload_type)
+    if known:
+        return known, None
+    features = _image_features(image, upload_type, model_type, tier, options.pop('ela_heatmap', False))
+    return None, dict(options, image=image, features=features)
+
+def _explanation(outputs, upload_type, model_type):
+    # Attention rollout over the attentions the verdict's own forward pass returned
+    with track_stage('explain', upload_type, model_type):
+        return explanation(outputs.attentions)
+
+def _similar_fakes(outputs, file_bytes, result, upload_type, model_type):
+    # The CLS embedding as the classifier head sees it: final layernorm over the last hidden state
+    with track_stage('similarity', upload_type, model_type):
+        with torch.no_grad():
+            embedding = model.vit.layernorm(outputs.hidden_states[-1][:, 0])[0].float().cpu().numpy()
+        matches = embedding_index.search(embedding)
+        label = embeddings.FAKE if result["result"] == "fake" else embeddings.REAL
+        embedding_index.add(embedding, hashlib.sha256(file_bytes).hexdigest(), result["fake_confidence"], label)
+        if embedding_index.needs_rebuild():
+            embedding_index.rebuild_in_background()
+    return matches
+
+def analyze_image(file_bytes, upload_type, model_type, deadline=None, tier=FULL, image=None, features=None,
+                  explain=False):
+    # At most two forward passes: the deadline was already checked when the queue slot was granted.
+    # image and features come from prepare_image
+    # Only full-model embeddings are comparable, so the reduced tier skips the index
+    embed = embedding_index is not None and tier == FULL
+    cascade = {}
+    if image_cascade.enabled and model_reduced is not None:
+        # Clear-cut images are answered by the prefilter alone
+        with track_stage('prefilter', upload_type, model_type):
+            size = image_cascade.prefilter_size
+            inputs = image_inputs(processor_dima, image.resize((size, size)), size, device)
+            with torch.no_grad():
+                outputs = model_reduced(**inputs, output_attentions=explain)
+            result = _image_result(outputs)
+        escalated = not image_cascade.is_decisive(result["fake_confidence"])
+        # Clear fakes still need the full pass's embedding, or the most confident fakes
+        # would never be added to or matched against the index; clear reals are never matches
+        escalated = escalated or (embed and result["result"] == "fake")
+        image_cascade.record(upload_type, escalated)
+        if not escalated:
+            if explain:
+                result["explanation"] = _explanation(outputs, upload_type, model_type)
+            return _with_features(dict(result, stage="prefilter"), features)
+        cascade = {"stage": "full", "prefilter_fake_confidence": result["fake_confidence"]}
+
+    with track_stage('preprocess', upload_type, model_type):
+        size = IMAGE_SIZE[tier]
+        image = image.resize((size, size))  # Resize to expected dimensions
+        inputs = _image_inputs(image, tier)
+
+    with track_stage('inference', upload_type, model_type):
+        with torch.no_grad():
+            outputs = (model_reduced if tier == REDUCED else model)(
+                **inputs, output_attentions=explain, output_hidden_states=embed
+            )
+
+    with track_stage('postprocess', upload_type, model_type):
+        result = dict(_image_result(outputs), **cascade)
+    if explain:
+        result["explanation"] = _explanation(outputs, upload_type, model_type)
+    if embed:
+        result["similar_fakes"] = _similar_fakes(outputs, file_bytes, result, upload_type, model_type)
+    return _with_features(result, features)
+
+def analyze_ensemble(file_bytes, upload_type, model_type, deadline=None, tier=FULL, image=None, features=None):
+    if tier == REDUCED or image_ensemble is None:
+        # Under overload the ensemble is the first thing to give up
+        return analyze_image(file_bytes, upload_type, model_type, deadline, tier, image, features)
+
+    with track_stage('inference', upload_type, model_type):
+        fake_confidence, details = image_ensemble.run(image, deadline)
+
+    is_fake = fake_confidence >= image_ensemble.threshold
+    return _with_features({
+        "result": "fake" if is_fake else "real",
+        "real_confidence": 1.0 - fake_confidence,
+        "fake_confidence": fake_confidence,
+        "ensemble": details
+    }, features)
+
+def analyze_tiled(file_bytes, upload_type, model_type, deadline=None, tier=FULL, image=None, features=None):
+    if tier == REDUCED:
+        # A batch of tiles is exactly what an overloaded server can't afford
+        return analyze_image(file_bytes, upload_type, model_type, deadline, tier, image, features)
+
+    with track_stage('preprocess', upload_type, model_type):
+        fitted, scale = fit_to_budget(image)
+        tiles, ys, xs = cut_tiles(fitted)
+        size = IMAGE_SIZE[FULL]
+        views = [image.resize((size, size))] + list(tiles)
+        inputs = image_inputs(processor_dima, views, size, device)
+
+    # Global view and every tile in one batched forward pass
+    with track_stage('inference', upload_type, model_type):
+        with torch.no_grad():
+            fakes = torch.nn.functional.softmax(model(**inputs).logits, dim=-1)[:, 1].tolist()
+
+    with track_stage('postprocess', upload_type, model_type):
+        global_fake, tile_fakes = fakes[0], fakes[1:]
+        fake_confidence = aggregate(global_fake, tile_fakes)
+        is_fake = fake_confidence > 0.5
+        return _with_features({
+            "result": "fake" if is_fake else "real",
+            "real_confidence": 1.0 - fake_confidence,
+            "fake_confidence": fake_confidence,
+            "tiles": {
+                "count": len(tile_fakes),
+                "rows": len(ys),
+                "cols": len(xs),
+                "scale": round(scale, 4),
+                "global_fake_confidence": global_fake,
+                # Row-major fake probability per tile, top-left first
+                "heatmap": np.round(np.array(tile_fakes).reshape(len(ys), len(xs)), 3).tolist()
+            }
+        }, features)
+
+def analyze_audio(file_bytes, upload_type, model_type, deadline, tier=FULL):
+    with track_stage('decode', upload_type, model_type):
+        waveform = decode_audio(file_bytes, AUDIO_SAMPLING_RATE)
+
+    fake_index = _label_index(model_audio.config, 'fake', 1)
+    window = int(AUDIO_WINDOW_S * AUDIO_SAMPLING_RATE)
+    fake_scores = []
+    for _, chunk in audio_windows(waveform, window):
+        # Long recordings are scored a window at a time; stop early if nobody is waiting
+        deadline.check()
+        with track_stage('preprocess', upload_type, model_type):
+            inputs = processor_melody(chunk, sampling_rate=AUDIO_SAMPLING_RATE, return_tensors="pt").to(device_audio)
+        with track_stage('inference', upload_type, model_type):
+            with torch.no_grad():
+                outputs = model_audio(**inputs)
+        fake_scores.append(torch.nn.functional.softmax(outputs.logits, dim=-1)[0, fake_index].item())
+
+    with track_stage('postprocess', upload_type, model_type):
+        fake_confidence = float(np.mean(fake_scores))
+        is_fake = fake_confidence > 0.5
+        return {
+            "result": "fake" if is_fake else "real",
+            "real_confidence": 1.0 - fake_confidence,
+            "fake_confidence": fake_confidence,
+            "segments": len(fake_scores),
+            "duration_s": round(len(waveform) / AUDIO_SAMPLING_RATE, 2),
+            "reason": "Voice pattern manipulation detected" if is_fake else None
+        }
+
+def analyze_video(file_bytes, upload_type, model_type, deadline, tier=FULL):
+    start = time.perf_counter()
+    frames = iter_video_frames(file_bytes, fps=VIDEO_SAMPLE_FPS, size=IMAGE_SIZE[tier], max_frames=VIDEO_MAX_FRAMES[tier])
+    fake_scores = []
+    try:
+        batch = []
+        # Frames are scored in small batches as ffmpeg produces them
+        for frame in frames:
+            batch.append(Image.fromarray(frame))
+            if len(batch) < VIDEO_BATCH_FRAMES:
+                continue
+            deadline.check()
+            fake_scores.extend(_score_frames(batch, upload_type, model_type, tier))
+            batch = []
+        if batch:
+            deadline.check()
+            fake_scores.extend(_score_frames(batch, upload_type, model_type, tier))
+    finally:
+        frames.close()  # Stops ffmpeg if we bailed out early
+
+    if not fake_scores:
+        raise ValueError("No frames could be decoded from the video")
+
+    fake_confidence = float(np.mean(fake_scores))
+    return {
+        "result": "Fake" if fake_confidence > 0.5 else "Real",
+        "real_confidence": 1.0 - fake_confidence,
+        "fake_confidence": fake_confidence,
+        "predictions": [
+            {"frame": index, "label": "Fake" if score > 0.5 else "Real", "fake_confidence": score}
+            for index, score in enumerate(fake_scores)
+        ],
+        "processingTime": f"{round((time.perf_counter() - start) * 1000)}ms"
+    }
+
+def _score_frames(images, upload_type, model_type, tier):
+    # Same convention as analyze_image: index 1 of the dima output is "fake"
+    with track_stage('preprocess', upload_type, model_type):
+        inputs = _image_inputs(images, tier)
+    with track_stage('inference', upload_type, model_type):
+        with torch.no_grad():
+            outputs = (model_reduced if tier == REDUCED else model)(**inputs)
+    return torch.nn.functional.softmax(outputs.logits, dim=-1)[:, 1].tolist()
+
+def analyze_text(text_bytes, upload_type, model_type, deadline=None, tier=FULL):
+    with track_stage('preprocess', upload_type, model_type):
+        inputs = tokenizer_text(
+            text_bytes.decode('utf-8'), return_tensors="pt", truncation=True, max_length=TEXT_MAX_LENGTH[tier]
+        ).to(device_text)
+
+    with track_stage('inference', upload_type, model_type):
+        with torch.no_grad():
+            outputs = (model_text_reduced if tier == REDUCED else model_text)(**inputs)
+
+    with track_stage('postprocess', upload_type, model_type):
+        fake_index = _label_index(model_text.config, 'fake', 1)
+        fake_confidence = torch.nn.functional.softmax(outputs.logits, dim=-1)[0, fake_index].item()
+        is_fake = fake_confidence > 0.5
+        return {
+            "result": "fake" if is_fake else "real",
+            "real_confidence": 1.0 - fake_confidence,
+            "fake_confidence": fake_confidence,
+            "label": "Fake News" if is_fake else "Real News",
+            "reason": "News analysis model detected patterns consistent with fake news" if is_fake else None
+        }
+
+def analyze_coalesced(data, upload_type, model_type, analyze, extra=None, options=None, prepare=None):
+    # Identical uploads arriving together share one model run
+    deadline = request_deadline(upload_type)
+    tenant, lane = request_tenant(), request_lane()
+    tier = current_tier(upload_type)
+    # Options change the answer, so they are part of the key too
+    options = options or {}
+    key = analysis_key(data, upload_type, model_type, analyze.__name__, tier,
+                       *(f'{name}={value}' for name, value in sorted(options.items())))
+    # Explained results are kept per model revision, so a repeat view is served without the model
+    explain = options.get('explain', False)
+    cache_key = f'{key}-{explanation_revision}'
+    cached = explanation_cache.get(cache_key) if explain else None
+    if explain:
+        record_explanation_cache(upload_type, cached is not None)
+
+    def compute():
+        known, arguments = None, options
+        if prepare is not None:
+            # Model-free work happens before queueing, so it doesn't hold an inference slot
+            known, arguments = prepare(data, upload_type, model_type, tier, options)
+        if known is not None:
+            return known
+        return run_queued(upload_type, lambda: analyze(data, upload_type, model_type, deadline, tier, **arguments),
+                          deadline, tenant, lane)
+
+    if cached is not None:
+        result, coalesced = cached, None
+    else:
+        result, coalesced = analysis_flight.do(key, compute, deadline)
+        record_coalesced(upload_type, coalesced)
+        if explain and coalesced is None:
+            explanation_cache.put(cache_key, result)
+    record_tier(upload_type, tier)
+    result = dict(result, tier=tier, **(extra or {}))
+    # The key starts with the content's SHA-256, which is also its blob's name
+    record_analysis(data, upload_type, model_type, analyze.__name__.replace('analyze_', ''), result,
+                    digest=key.split('-', 1)[0])
+
+    with track_stage('serialize', upload_type, model_type):
+        response = jsonify(result)
+    if coalesced:
+        response.headers['X-Iris-Coalesced'] = coalesced
+    if cached is not None:
+        response.headers['X-Iris-Cache'] = 'hit'
+    return response, 200
+
+def known_model(model_type):
+    """The requested model as one of a fixed set of names, since it labels metrics and keys the cache."""
+    if 'ensemble' in model_type.lower():
+        return 'ensemble'
+    return model_type if model_type in ModelApplied.__members__ else 'other'
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_file():
     # Declare ML models as global at the beginning of the function
@@ -454,12 +1163,27 @@ def analyze_file():
     global processor_melody, model_audio, device_audio
     global tokenizer_text, model_text, device_text
 
-    if not request.files or 'file' not in request.files:
-        return jsonify({'error': 'No file uploaded'}), 400
-    
-    file = request.files['file']
     upload_type = request.form.get('type', 'image')
-    model_type = request.form.get('model', 'dima')
+    model_type = known_model(request.form.get('model', 'dima'))
+    # The type picks the queue, tier and cache key below, so unknown ones stop here
+    if upload_type not in UploadType.__members__:
+        return jsonify({
+            'error': 'Invalid upload type',
+            'message': f"type must be one of {', '.join(UploadType.__members__)}"
+        }), 400
+    # Text comes in as form fields rather than a file
+    if upload_type != 'text' and (not request.files or 'file' not in request.files):
+        return jsonify({'error': 'No file uploaded'}), 400
+
+    file = request.files.get('file')
+    file_bytes = file.read() if file else b''
+
+    # Listed fakes are answered from the blocklist before anything is decoded or queued
+    match = known_fakes.check_bytes(file_bytes) if upload_type != 'text' and file_bytes else None
+    if match:
+        result = dict(_known_fake(match, upload_type), filename=file.filename)
+        record_analysis(file_bytes, upload_type, model_type, 'blocklist', result)
+        return jsonify(result), 200
     
     # Check if torch and models are available
     if torch is None:
@@ -469,7 +1193,7 @@ def analyze_file():
         }), 503
     
     # Check model availability *after* global declaration
-    if upload_type == 'image' and (processor_dima is None or model is None):
+    if upload_type in ('image', 'video') and (processor_dima is None or model is None):
         return jsonify({
             'error': 'Image analysis model unavailable',
             'message': 'The image analysis model failed to load. Please try again later.'
@@ -490,80 +1214,296 @@ def analyze_file():
     try:
         # Load models if not already loaded (already declared global)
         if processor_dima is None or model is None:
-            processor_dima, model, device = load_ml_models()
+            processor_dima, model, device = timed_model_load('dima', load_ml_models)
         # ... similar checks/loads for other models if needed ...
 
         # Process the file with the selected model
         if upload_type == 'image':
-            # Process image
-            image = Image.open(file).convert('RGB')  # Convert to RGB format
-            image = image.resize((224, 224))  # Resize to expected dimensions
-            
-            inputs = processor_dima(images=image, return_tensors="pt").to(device)
-
-            with torch.no_grad():
-                outputs = model(**inputs)
-            
-            predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
-            real_confidence, fake_confidence = predictions[0].tolist()
-            predicted_class = predictions.argmax().item()
-            label = model.config.id2label[predicted_class]
-
-            result = {
-                "result": "real" if label == "LABEL_0" else "fake",
-                "real_confidence": real_confidence,
-                "fake_confidence": fake_confidence,
-                "filename": file.filename,
-                "reason": "PRNU camera tampered" if label == "LABEL_1" else None
-            }
-
-            return jsonify(result), 200
+            if model_type == 'ensemble':
+                analyze = analyze_ensemble
+            elif request.form.get('tiled', '').lower() in ('1', 'true', 'yes'):
+                analyze = analyze_tiled
+            else:
+                analyze = analyze_image
+            options = {}
+            if request.form.get('ela_heatmap', '').lower() in ('1', 'true', 'yes'):
+                options['ela_heatmap'] = True
+            # Attention heatmaps come from the single-model pass only
+            if analyze is analyze_image and request.form.get('explain', '').lower() in ('1', 'true', 'yes'):
+                options['explain'] = True
+            return analyze_coalesced(file_bytes, upload_type, model_type, analyze, {'filename': file.filename}, options,
+                                     prepare=prepare_image)
 
         elif upload_type == 'audio':
-            # Process audio
-            # Mock audio analysis
-            return jsonify({
-                "result": "fake",
-                "real_confidence": 0.18,
-                "fake_confidence": 0.82,
-                "filename": file.filename,
-                "reason": "Voice pattern manipulation detected"
-            }), 200
-            
+            return analyze_coalesced(file_bytes, upload_type, model_type, analyze_audio, {'filename': file.filename})
+
         elif upload_type == 'video':
-            # Process video
-            # Mock video analysis
-            return jsonify({
-                "result": "Real",
-                "real_confidence": 0.75,
-                "fake_confidence": 0.25,
-                "filename": file.filename,
-                "processingTime": "500ms"
-            }), 200
+            return analyze_coalesced(file_bytes, upload_type, model_type, analyze_video, {'filename': file.filename})
             
         else:  # text
-            # Process text
-            title = request.form.get('title', 'Sample Title')
-            text = request.form.get('text', 'Sample text content')
-            
-            # Return mock text analysis
-            return jsonify({
-                "result": "fake",
-                "real_confidence": 0.15,
-                "fake_confidence": 0.85,
-                "label": "Fake News",
-                "title": title,
-                "text": text[:50] + "...",
-                "reason": "News analysis model detected patterns consistent with fake news"
-            }), 200
+            title = request.form.get('title', '')
+            text = request.form.get('text') or file_bytes.decode('utf-8', 'replace')
+            if not text.strip():
+                return jsonify({'error': 'No text provided'}), 400
+
+            # The model was trained on headline and body together
+            return analyze_coalesced(
+                f"{title}\n{text}".strip().encode('utf-8'), upload_type, model_type, analyze_text,
+                {'title': title, 'text': text[:50] + "..."}
+            )
             
         # Example return - replace with your actual processing logic return
         return jsonify({"message": "Analysis successful", "type": upload_type}), 200
             
+    except QueueFull as e:
+        response = jsonify({
+            'error': 'Server busy',
+            'message': f'The {e.queue_name} analysis queue is {e.reason}. Please retry shortly.',
+            'retry_after': e.retry_after
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+
+    except DeadlineExceeded as e:
+        record_cancelled(upload_type, e.reason)
+        return jsonify({
+            'error': 'Deadline exceeded',
+            'message': 'The analysis could not be completed before the request deadline.'
+        }), 504
+
+    except ClientDisconnected as e:
+        # Nobody will read this; 499 (nginx's "client closed request") keeps it apart in the logs
+        record_cancelled(upload_type, e.reason)
+        return jsonify({'error': 'Client closed request'}), 499
+
+    except MediaUnavailable as e:
+        return jsonify({
+            'error': f'{upload_type.capitalize()} analysis unavailable',
+            'message': str(e)
+        }), 503
+
+    except TooManyTiles as e:
+        return jsonify({'error': 'Image too large for tiled analysis', 'message': str(e)}), 413
+
     except Exception as e:
         print(f"Analysis error: {str(e)}")
         return jsonify({"error": "Server error occurred during analysis"}), 500
 
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '20'))
+HISTORY_MAX_PAGE_SIZE = int(os.environ.get('HISTORY_MAX_PAGE_SIZE', '100'))
+
+def _encode_cursor(content):
+    position = f'{content.upload_date.isoformat()}|{content.id}'
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    upload_date, content_id = position.rsplit('|', 1)
+    return datetime.fromisoformat(upload_date), int(content_id)
+
+def _parse_flag(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'Not a boolean: {value}')
+
+def _history_item(content):
+    analysis = content.analysis or {}
+    return {
+        "id": content.id,
+        "file_name": content.file_name,
+        "file_size": content.file_size,
+        "upload_date": content.upload_date.isoformat() + 'Z',
+        "upload_type": content.upload_type.value,
+        "upload_category": content.upload_category,
+        "model_applied": content.model_applied.value,
+        "is_deepfake": content.is_deepfake,
+        "fake_confidence": analysis.get("fake_confidence"),
+        "reason": analysis.get("reason"),
+    }
+
+@app.route('/api/history', methods=['GET'])
+def analysis_history():
+    """A user's analyses, newest first, a page at a time, for holders of an API key.
+
+    Pages are keyset-paginated: next_cursor encodes the (upload_date, id) of
+    the last item, and the next page seeks straight to it through the
+    ix_content_user_* indexes, so page 1000 costs the same as page 1.
+    """
+    # As with exports, a username only picks whose history; an API key authorises reading it
+    if not API_KEYS.get(request.headers.get('X-API-Key', '')):
+        return jsonify({'error': 'History not allowed', 'message': 'History needs an X-API-Key.'}), 403
+    username = request.args.get('username') or request.headers.get('X-Username')
+    if not username:
+        return jsonify({'error': 'No user given', 'message': 'Pass a username parameter or an X-Username header.'}), 400
+    user_id = _user_id(username)
+    if user_id is None:
+        return jsonify({'error': 'User not found'}), 404
+
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        query = Content.query.filter(Content.user_id == user_id)
+        if request.args.get('upload_type'):
+            query = query.filter(Content.upload_type == UploadType(request.args['upload_type']))
+        if request.args.get('model_applied'):
+            query = query.filter(Content.model_applied == ModelApplied(request.args['model_applied']))
+        if request.args.get('is_deepfake'):
+            query = query.filter(Content.is_deepfake == _parse_flag(request.args['is_deepfake']))
+        if request.args.get('cursor'):
+            upload_date, content_id = _decode_cursor(request.args['cursor'])
+            # The first condition bounds the index range; the second only breaks ties on the same timestamp
+            query = query.filter(
+                Content.upload_date <= upload_date,
+                db.or_(Content.upload_date < upload_date, Content.id < content_id)
+            )
+    except ValueError as e:
+        return jsonify({'error': 'Invalid history query', 'message': str(e)}), 400
+
+    # One extra row says whether there is a next page without a COUNT
+    rows = query.order_by(Content.upload_date.desc(), Content.id.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    return jsonify({
+        "items": [_history_item(content) for content in page],
+        "next_cursor": _encode_cursor(page[-1]) if len(rows) > limit else None,
+    }), 200
+
+def _parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+STATS_DEFAULT_DAYS = int(os.environ.get('STATS_DEFAULT_DAYS', '30'))
+STATS_MAX_DAYS = int(os.environ.get('STATS_MAX_DAYS', '366'))
+
+@app.route('/api/stats', methods=['GET'])
+def analysis_stats():
+    """Analyses per day by type, model and verdict, with latency percentiles.
+
+    Read only from the analysis_rollup table (see rollups.py), so a year of
+    dashboard costs a few thousand rows whatever the size of Content.
+    """
+    try:
+        end = _parse_day(request.args['to']) if request.args.get('to') else datetime.utcnow().date()
+        start = _parse_day(request.args['from']) if request.args.get('from') else end - timedelta(days=STATS_DEFAULT_DAYS - 1)
+        upload_type = UploadType(request.args['upload_type']) if request.args.get('upload_type') else None
+        model_applied = ModelApplied(request.args['model_applied']) if request.args.get('model_applied') else None
+        if start > end or (end - start).days >= STATS_MAX_DAYS:
+            raise ValueError(f'from..to must be between 1 and {STATS_MAX_DAYS} days')
+    except ValueError as e:
+        return jsonify({'error': 'Invalid stats query', 'message': str(e)}), 400
+
+    with db.engine.connect() as connection:
+        return jsonify(rollups.stats(connection, AnalysisRollup.__table__, start, end, upload_type, model_applied)), 200
+
+# Schema db.create_all() made before the app used migrations
+INITIAL_REVISION = 'e0a3dc3febf7'
+
+@app.cli.command('upgrade-db')
+def upgrade_db():
+    """Migrates the database to the latest schema; run on every deploy."""
+    with db.engine.connect() as connection:
+        tables = inspect(connection).get_table_names()
+        if 'content' in tables and 'alembic_version' not in tables:
+            # Made by db.create_all(): either already current or from before migrations
+            current = not compare_metadata(MigrationContext.configure(connection), db.metadata)
+            revision = 'head' if current else INITIAL_REVISION
+            print(f"Adopting an unversioned database at revision {revision}")
+            stamp_migrations(revision=revision)
+    upgrade_migrations()
+
+@app.cli.command('rebuild-rollups')
+@click.option('--since', default=None, help='First day to recompute (YYYY-MM-DD); everything when omitted.')
+def rebuild_rollups(since):
+    """Recomputes the daily analysis rollups from the Content table."""
+    since = _parse_day(since) if since else None
+    start = time.perf_counter()
+    with db.engine.begin() as connection:
+        scanned, rows = rollups.rebuild(connection, Content.__table__, AnalysisRollup.__table__, since)
+    print(f"Rebuilt {rows} rollup rows from {scanned} analyses in {time.perf_counter() - start:.1f}s")
+
+def _export_range(since, until):
+    # Whole days: from is inclusive, to is the last day included
+    since = datetime.combine(_parse_day(since), datetime.min.time()) if since else None
+    until = datetime.combine(_parse_day(until) + timedelta(days=1), datetime.min.time()) if until else None
+    return since, until
+
+@app.route('/api/export', methods=['GET'])
+def export_content():
+    """Streams analyses as NDJSON or CSV, optionally gzipped, for holders of an API key.
+
+    Everyone's analyses by default, or one user's with ?username=. Rows are
+    read and written a chunk at a time (see content_export.py), so the export
+    runs in constant memory whatever its size.
+    """
+    # A username is only a claim, so it narrows an export but never authorises one
+    if not API_KEYS.get(request.headers.get('X-API-Key', '')):
+        return jsonify({'error': 'Export not allowed', 'message': 'Exports need an X-API-Key.'}), 403
+    username = request.args.get('username') or request.headers.get('X-Username')
+    user_id = None
+    if username:
+        user_id = _user_id(username)
+        if user_id is None:
+            return jsonify({'error': 'User not found'}), 404
+
+    output_format = request.args.get('format', 'ndjson')
+    try:
+        if output_format not in content_export.FORMATS:
+            raise ValueError(f"format must be one of {', '.join(content_export.FORMATS)}")
+        since, until = _export_range(request.args.get('from'), request.args.get('to'))
+        compress = _parse_flag(request.args.get('gzip', 'false'))
+    except ValueError as e:
+        return jsonify({'error': 'Invalid export query', 'message': str(e)}), 400
+
+    filename = f"iris-{username or 'all'}.{output_format}" + ('.gz' if compress else '')
+    stream = content_export.export(db.engine, Content.__table__, output_format, compress,
+                                   user_id=user_id, since=since, until=until)
+    return Response(stream, mimetype='application/gzip' if compress else content_export.FORMATS[output_format],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.cli.command('export-content')
+@click.option('--username', default=None, help='Only this user\'s analyses; everyone\'s when omitted.')
+@click.option('--from', 'since', default=None, help='First day to include (YYYY-MM-DD).')
+@click.option('--to', 'until', default=None, help='Last day to include (YYYY-MM-DD).')
+@click.option('--format', 'output_format', type=click.Choice(sorted(content_export.FORMATS)), default='ndjson')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', default='-', help='File to write; stdout when omitted.')
+def export_content_command(username, since, until, output_format, compress, output):
+    """Streams analyses from the Content table to a file or stdout."""
+    user_id = None
+    if username:
+        user_id = _user_id(username)
+        if user_id is None:
+            raise click.ClickException(f'No user named {username}')
+    since, until = _export_range(since, until)
+    stream = content_export.export(db.engine, Content.__table__, output_format, compress,
+                                   user_id=user_id, since=since, until=until)
+    if output == '-':
+        for data in stream:
+            sys.stdout.buffer.write(data)
+        return
+
+    start = time.perf_counter()
+    written = 0
+    # Written next to the target and renamed into place, so a failed export leaves nothing behind
+    temp_path = f'{output}.tmp'
+    with open(temp_path, 'wb') as out:
+        for data in stream:
+            out.write(data)
+            written += len(data)
+    os.replace(temp_path, output)
+    print(f"Exported {written} bytes to {output} in {time.perf_counter() - start:.1f}s")
+
+@app.cli.command('gc-blobs')
+@click.option('--grace-s', default=blob_store.GRACE_S, show_default=True, help='Never collect blobs younger than this.')
+@click.option('--dry-run', is_flag=True, help='Only report what would be deleted.')
+def gc_blobs(grace_s, dry_run):
+    """Deletes stored uploads that no Content row references any more."""
+    if blobs is None:
+        raise click.ClickException('The blob store is disabled (BLOB_STORE_ENABLED)')
+    start = time.perf_counter()
+    scanned, deleted, reclaimed = blob_store.collect(blobs, db.engine, Content.__table__, grace_s, dry_run=dry_run)
+    print(f"{'Would delete' if dry_run else 'Deleted'} {deleted} of {scanned} blobs "
+          f"({reclaimed / 1e6:.1f} MB) in {time.perf_counter() - start:.1f}s")
+
 @app.route('/api/analyze-ai', methods=['POST'])
 def analyze_ai():
     try:
@@ -0,0 +1,181 @@
+"""Accuracy/throughput trade-off of the image cascade (cascade.py).
+
+Scores every labelled image once with the prefilter (int8 model at
+--prefilter-size) and once with the full model at 224px, timing each pass,
+then replays the cascade for each uncertainty band: images whose prefilter
+fake probability falls inside the band take the full model's answer, the
+rest keep the prefilter's. Images are read from a directory with `real/`
+and `fake/` subdirectories.
+
+    python -m benchmarks.cascade_eval --data ~/datasets/deepfake-val \\
+        --bands 0.05:0.95 0.1:0.9 0.2:0.8 --output bench_results/cascade.json
+
+Without cached weights (and without --allow-download) a randomly initialised
+ViT is used, as in model_bench.py: the timings still hold but the accuracy
+columns are meaningless.
+"""
+import argparse
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+
+from benchmarks.model_bench import git_revision, load_model
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp')
+LABELS = {'real': 0, 'fake': 1}
+
+
+def find_images(data_dir, limit):
+    """[(path, label)] for images under data_dir/real and data_dir/fake."""
+    items = []
+    for entry in sorted(os.listdir(data_dir)):
+        label = LABELS.get(entry.lower())
+        folder = os.path.join(data_dir, entry)
+        if label is None or not os.path.isdir(folder):
+            continue
+        paths = sorted(
+            os.path.join(folder, name) for name in os.listdir(folder)
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        items.extend((path, label) for path in paths[:limit])
+    if not items:
+        raise SystemExit(f"No images found under {data_dir}/real or {data_dir}/fake")
+    return items
+
+
+def load_processor(allow_download):
+    from transformers import AutoImageProcessor, ViTImageProcessor
+    from model_store import model_source
+    try:
+        source, options = model_source('dima')
+        return AutoImageProcessor.from_pretrained(source, **options)
+    except Exception:
+        if allow_download:
+            raise
+        return ViTImageProcessor()
+
+
+def score(model, processor, image, size):
+    """(fake probability, seconds) for one image at size x size."""
+    import torch
+    from ml_models import image_inputs
+    start = time.perf_counter()
+    inputs = image_inputs(processor, image.resize((size, size)), size, torch.device('cpu'))
+    with torch.inference_mode():
+        logits = model(**inputs).logits
+    fake = torch.softmax(logits, dim=-1)[0, 1].item()
+    return fake, time.perf_counter() - start
+
+
+def evaluate_band(scores, labels, low, high, prefilter_s, full_s):
+    correct = escalated = 0
+    for (pre, full), label in zip(scores, labels):
+        if low < pre < high:
+            escalated += 1
+            fake = full
+        else:
+            fake = pre
+        correct += int((fake > 0.5) == bool(label))
+    rate = escalated / len(labels)
+    per_image = prefilter_s + rate * full_s
+    return {
+        'band': [low, high],
+        'accuracy': correct / len(labels),
+        'escalation_rate': rate,
+        'per_image_ms': per_image * 1000,
+        'throughput': 1 / per_image,
+    }
+
+
+def parse_band(text):
+    low, high = (float(part) for part in text.split(':'))
+    return low, high
+
+
+def run(args):
+    import torch
+    from PIL import Image
+    from ml_models import build_reduced_model, IMAGE_SIZE
+
+    torch.set_num_threads(args.threads)
+    model, source = load_model('image', args.allow_download)
+    model.eval()
+    prefilter = build_reduced_model(model, torch.device('cpu'))
+    processor = load_processor(args.allow_download)
+
+    items = find_images(args.data, args.limit)
+    scores, labels, prefilter_times, full_times = [], [], [], []
+    for path, label in items:
+        image = Image.open(path).convert('RGB')
+        pre, pre_s = score(prefilter, processor, image, args.prefilter_size)
+        full, full_s = score(model, processor, image, IMAGE_SIZE)
+        scores.append((pre, full))
+        labels.append(label)
+        prefilter_times.append(pre_s)
+        full_times.append(full_s)
+
+    # Medians keep the first, cold passes from skewing the estimate
+    prefilter_s = statistics.median(prefilter_times)
+    full_s = statistics.median(full_times)
+    baselines = {
+        'full_only': evaluate_band(scores, labels, -1.0, 2.0, 0.0, full_s),
+        'prefilter_only': evaluate_band(scores, labels, 0.5, 0.5, prefilter_s, full_s),
+    }
+    bands = [evaluate_band(scores, labels, low, high, prefilter_s, full_s) for low, high in args.bands]
+    return source, len(items), prefilter_s, full_s, baselines, bands
+
+
+def print_row(name, row):
+    print(f"{name:<16} {row['accuracy'] * 100:>9.2f}% {row['escalation_rate'] * 100:>10.1f}% "
+          f"{row['per_image_ms']:>10.1f} {row['throughput']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate the image prefilter cascade')
+    parser.add_argument('--data', required=True, help='Directory with real/ and fake/ image folders')
+    parser.add_argument('--limit', type=int, default=None, help='At most this many images per class')
+    parser.add_argument('--bands', type=parse_band, nargs='+',
+                        default=[(0.02, 0.98), (0.05, 0.95), (0.1, 0.9), (0.2, 0.8), (0.3, 0.7)],
+                        help='Uncertain bands as low:high')
+    parser.add_argument('--prefilter-size', type=int, default=int(os.environ.get('CASCADE_PREFILTER_SIZE', '112')))
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--allow-download', action='store_true',
+                        help='Let the loaders fetch weights from the Hugging Face hub')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    source, count, prefilter_s, full_s, baselines, bands = run(args)
+    print(f"{count} images, {source} weights; prefilter {prefilter_s * 1000:.1f}ms, full {full_s * 1000:.1f}ms per image\n")
+    print(f"{'Band':<16} {'Accuracy':>10} {'Escalated':>11} {'ms/image':>10} {'images/s':>10}")
+    print('=' * 61)
+    for name, row in baselines.items():
+        print_row(name, row)
+    for row in bands:
+        print_row(f"{row['band'][0]:.2f}-{row['band'][1]:.2f}", row)
+
+    if args.output:
+        report = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'git_revision': git_revision(),
+                'source': source,
+                'images': count,
+                'prefilter_size': args.prefilter_size,
+                'threads': args.threads,
+                'prefilter_ms': prefilter_s * 1000,
+                'full_ms': full_s * 1000,
+            },
+            'baselines': baselines,
+            'bands': bands,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+    return baselines, bands
+
+
+if __name__ == '__main__':
+    main()
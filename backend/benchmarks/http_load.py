@@ -0,0 +1,411 @@
+"""HTTP load test for the analyze, upload and auth endpoints.
+
+Drives a locally running server with a weighted mix of synthetic requests at
+one or more concurrency levels and reports throughput, latency percentiles and
+error rates. Everything is generated locally, so no network access or sample
+media is needed. The video clip is rendered with ffmpeg's test pattern source,
+since the server decodes uploads with ffmpeg and random bytes would only time
+its error path; without ffmpeg the video scenario is left out of the mix.
+
+    # against a server you started yourself (use RATELIMIT_ENABLED=false)
+    python -m benchmarks.http_load --concurrency 1 4 16 --duration 30
+
+    # start a throwaway server, save results, compare with a previous run
+    python -m benchmarks.http_load --start-server gunicorn \\
+        --output bench_results/head.json --compare bench_results/main.json
+"""
+import argparse
+import io
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pyotp
+import requests
+from PIL import Image
+
+from media import FFMPEG
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MIX = 'analyze_image=6,analyze_audio=2,analyze_text=2,analyze_video=1,upload=2,login=1,verify_otp=1'
+
+
+def video_clip(seconds, size=320, fps=25):
+    """An H.264 MP4 of ffmpeg's moving test pattern, or None when ffmpeg isn't available."""
+    if shutil.which(FFMPEG) is None:
+        return None
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.mp4')
+        try:
+            subprocess.run([
+                FFMPEG, '-nostdin', '-loglevel', 'error', '-f', 'lavfi',
+                '-i', f'testsrc=duration={seconds}:size={size}x{size}:rate={fps}',
+                '-pix_fmt', 'yuv420p', '-movflags', '+faststart', path,
+            ], check=True, capture_output=True, timeout=120)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"WARNING: ffmpeg could not render the benchmark clip ({str(e)})")
+            return None
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+def build_payloads(seed, image_sizes, audio_seconds, video_seconds):
+    """Generate the synthetic media used by every request up front."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for size in image_sizes:
+        pixels = rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+        images.append((f'bench_{size}.jpg', buffer.getvalue()))
+
+    sample_rate = 16000
+    t = np.arange(int(sample_rate * audio_seconds)) / sample_rate
+    signal = 0.4 * np.sin(2 * np.pi * 220 * t) + 0.05 * rng.standard_normal(t.shape)
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(signal, -1, 1) * 32767).astype('<i2').tobytes())
+    audio = ('bench.wav', buffer.getvalue())
+
+    clip = video_clip(video_seconds)
+    video = ('bench.mp4', clip) if clip is not None else None
+
+    words = ['government', 'report', 'claims', 'officials', 'announced', 'sources', 'new', 'study',
+             'shows', 'the', 'a', 'of', 'in', 'and', 'that', 'breaking', 'exclusive', 'vaccine']
+    text = ' '.join(rng.choice(words, size=300))
+    return {'images': images, 'audio': audio, 'video': video, 'text': text}
+
+
+def create_account(base_url):
+    """Register a throwaway user so the login and OTP scenarios have someone to log in as."""
+    suffix = ''.join(random.choices('abcdefghijklmnopqrstuvwxyz0123456789', k=10))
+    account = {
+        'username': f'bench_{suffix}',
+        'email': f'bench_{suffix}@example.com',
+        'password': 'Bench@123456',
+    }
+    response = requests.post(f'{base_url}/register', json=account, timeout=30)
+    if response.status_code != 201:
+        raise RuntimeError(f'Could not register benchmark user: {response.status_code} {response.text}')
+    account['otp_secret'] = response.json()['otpSecret']
+    return account
+
+
+def analyze_image(session, base_url, payloads, account, rng):
+    name, data = rng.choice(payloads['images'])
+    return session.post(f'{base_url}/analyze', files={'file': (name, data)},
+                        data={'type': 'image', 'model': 'dima'})
+
+
+def analyze_audio(session, base_url, payloads, account, rng):
+    name, data = payloads['audio']
+    return session.post(f'{base_url}/analyze', files={'file': (name, data)},
+                        data={'type': 'audio', 'model': 'melody'})
+
+
+def analyze_video(session, base_url, payloads, account, rng):
+    name, data = payloads['video']
+    return session.post(f'{base_url}/analyze', files={'file': (name, data)},
+                        data={'type': 'video', 'model': 'dima'})
+
+
+def analyze_text(session, base_url, payloads, account, rng):
+    text = payloads['text']
+    return session.post(f'{base_url}/analyze', files={'file': ('article.txt', text.encode('utf-8'))},
+                        data={'type': 'text', 'model': 'mosko', 'title': 'Benchmark article', 'text': text})
+
+
+def upload(session, base_url, payloads, account, rng):
+    name, data = rng.choice(payloads['images'])
+    return session.post(f'{base_url}/upload', files={'file': (name, data)})
+
+
+def login(session, base_url, payloads, account, rng):
+    return session.post(f'{base_url}/login',
+                        json={'username': account['username'], 'password': account['password']})
+
+
+def verify_otp(session, base_url, payloads, account, rng):
+    code = pyotp.TOTP(account['otp_secret']).now()
+    return session.post(f'{base_url}/verify-otp', json={'username': account['username'], 'otp': code})
+
+
+SCENARIOS = {
+    'analyze_image': analyze_image,
+    'analyze_audio': analyze_audio,
+    'analyze_text': analyze_text,
+    'analyze_video': analyze_video,
+    'upload': upload,
+    'login': login,
+    'verify_otp': verify_otp,
+}
+
+
+def parse_mix(spec):
+    mix = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise ValueError(f"Unknown scenario '{name}'. Choose from: {', '.join(SCENARIOS)}")
+        mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * q
+    lower, upper = math.floor(position), math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarise(samples, elapsed):
+    """Turn (latency_seconds, ok) samples into the numbers we report."""
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    errors = sum(1 for _, ok in samples if not ok)
+    count = len(samples)
+    return {
+        'requests': count,
+        'errors': errors,
+        'error_rate': errors / count if count else 0.0,
+        'rps': count / elapsed if elapsed else 0.0,
+        'mean_ms': sum(latencies) / count if count else None,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1] if latencies else None,
+    }
+
+
+def run_level(base_url, concurrency, duration, warmup, mix, payloads, account, seed, timeout):
+    """Run the mix at one concurrency level and return per-scenario and overall stats."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    samples = {name: [] for name in names}
+    status_counts = {}
+    lock = threading.Lock()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    stop_at = measure_from + duration
+
+    def worker(index):
+        rng = random.Random(seed + index)
+        session = TimeoutSession(timeout)
+        while True:
+            now = time.perf_counter()
+            if now >= stop_at:
+                break
+            name = rng.choices(names, weights)[0]
+            began = time.perf_counter()
+            try:
+                response = SCENARIOS[name](session, base_url, payloads, account, rng)
+                status, ok = response.status_code, response.status_code < 400
+            except requests.RequestException as e:
+                status, ok = type(e).__name__, False
+            finished = time.perf_counter()
+            if began < measure_from:
+                continue
+            with lock:
+                samples[name].append((finished - began, ok))
+                key = f'{name}:{status}'
+                status_counts[key] = status_counts.get(key, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, i) for i in range(concurrency)]:
+            future.result()
+
+    elapsed = max(time.perf_counter() - measure_from, 1e-9)
+    all_samples = [sample for per_name in samples.values() for sample in per_name]
+    return {
+        'concurrency': concurrency,
+        'duration_s': elapsed,
+        'overall': summarise(all_samples, elapsed),
+        'scenarios': {name: summarise(per_name, elapsed) for name, per_name in samples.items()},
+        'status_counts': status_counts,
+    }
+
+
+class TimeoutSession(requests.Session):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super().request(*args, **kwargs)
+
+
+def start_server(kind, port, startup_timeout):
+    """Start a local server with rate limiting off and hub access disabled."""
+    workdir = tempfile.mkdtemp(prefix='iris-bench-')
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        RATELIMIT_ENABLED='false',
+        HF_HUB_OFFLINE='1',
+        TRANSFORMERS_OFFLINE='1',
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+    )
+    if kind == 'gunicorn':
+        command = ['gunicorn', 'app:app', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}']
+        # gunicorn never runs app.py as __main__, so create the tables first
+        subprocess.run([sys.executable, 'init_db.py'], cwd=BACKEND_DIR, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+    else:
+        command = [sys.executable, 'app.py']
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f'http://127.0.0.1:{port}/api'
+    deadline = time.time() + startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited during startup, see {log.name}')
+        try:
+            if requests.get(f'{base_url}/health', timeout=2).status_code == 200:
+                print(f'Server ready on {base_url} (log: {log.name})')
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(1)
+    process.terminate()
+    raise RuntimeError(f'Server did not become healthy within {startup_timeout}s, see {log.name}')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(level):
+    print(f"\nConcurrency {level['concurrency']} ({level['duration_s']:.1f}s)")
+    print(f"{'Scenario':<16} {'Reqs':>7} {'RPS':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'Errors':>8}")
+    print('=' * 72)
+    rows = list(level['scenarios'].items()) + [('overall', level['overall'])]
+    for name, stats in rows:
+        if not stats['requests']:
+            continue
+        print(f"{name:<16} {stats['requests']:>7} {stats['rps']:>8.1f} {stats['p50_ms']:>9.1f} "
+              f"{stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} {stats['error_rate']:>7.1%}")
+
+
+def print_comparison(current, baseline):
+    """Show how p50/p95/p99 and throughput moved relative to a saved run."""
+    baseline_levels = {level['concurrency']: level for level in baseline['levels']}
+    print(f"\nComparison against {baseline['meta'].get('git_revision') or 'baseline'}")
+    print(f"{'Conc':>4} {'Scenario':<16} {'RPS':>16} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18}")
+    print('=' * 94)
+    for level in current['levels']:
+        old_level = baseline_levels.get(level['concurrency'])
+        if not old_level:
+            continue
+        rows = list(level['scenarios'].items()) + [('overall', level['overall'])]
+        for name, stats in rows:
+            old = old_level['scenarios'].get(name) if name != 'overall' else old_level['overall']
+            if not old or not old['requests'] or not stats['requests']:
+                continue
+            cells = []
+            for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+                change = (stats[key] - old[key]) / old[key] if old[key] else 0.0
+                cells.append(f'{stats[key]:>8.1f} ({change:+.0%})')
+            print(f"{level['concurrency']:>4} {name:<16} " + ' '.join(f'{cell:>18}' for cell in cells))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test the Iris API')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000/api')
+    parser.add_argument('--start-server', choices=['flask', 'gunicorn'],
+                        help='Start a local server for the run instead of using --base-url')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--startup-timeout', type=float, default=600,
+                        help='Seconds to wait for models to load when starting a server')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--duration', type=float, default=20, help='Measured seconds per concurrency level')
+    parser.add_argument('--warmup', type=float, default=3, help='Unmeasured seconds before each level')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Weighted scenarios, e.g. analyze_image=5,login=1')
+    parser.add_argument('--image-sizes', type=int, nargs='+', default=[224, 512, 1024])
+    parser.add_argument('--audio-seconds', type=float, default=5)
+    parser.add_argument('--video-seconds', type=float, default=4)
+    parser.add_argument('--timeout', type=float, default=60, help='Per-request timeout in seconds')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--compare', help='Previous JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    payloads = build_payloads(args.seed, args.image_sizes, args.audio_seconds, args.video_seconds)
+    if payloads['video'] is None and mix.pop('analyze_video', None):
+        print("WARNING: ffmpeg is not installed; dropping analyze_video from the mix")
+        if not mix:
+            raise SystemExit('Nothing left to run: the mix only had analyze_video')
+
+    server = None
+    base_url = args.base_url.rstrip('/')
+    if args.start_server:
+        server, base_url = start_server(args.start_server, args.port, args.startup_timeout)
+
+    try:
+        account = create_account(base_url) if {'login', 'verify_otp'} & set(mix) else None
+        levels = []
+        for concurrency in args.concurrency:
+            level = run_level(base_url, concurrency, args.duration, args.warmup, mix, payloads,
+                              account, args.seed, args.timeout)
+            print_level(level)
+            levels.append(level)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'git_revision': git_revision(),
+            'base_url': base_url,
+            'mix': mix,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'image_sizes': args.image_sizes,
+            'audio_seconds': args.audio_seconds,
+            'video_seconds': args.video_seconds if payloads['video'] is not None else None,
+            'seed': args.seed,
+        },
+        'levels': levels,
+    }
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Forward-pass micro-benchmarks for the image, audio and text models.
+
+Times the raw models returned by the loaders in ml_models.py, without Flask
+or HTTP in the way, across batch sizes, thread counts, precisions and
+execution backends. Weights come from the local Hugging Face cache; when a
+model is not cached (and --allow-download is not given) a randomly
+initialised model of the same architecture is used instead, which gives the
+same compute cost but meaningless predictions.
+
+    python -m benchmarks.model_bench --models image text --batch-sizes 1 8 32 \\
+        --threads 1 4 --precisions fp32 bf16 int8 --output bench_results/models.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import time
+from datetime import datetime
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What one "item" in a batch is worth, for the throughput column
+UNITS = {'image': 'images/s', 'audio': 'audio-s/s', 'text': 'tokens/s'}
+
+
+def load_model(kind, allow_download):
+    """Return (model, source) using the app's loaders, or a random model of the same shape."""
+    if not allow_download:
+        os.environ.setdefault('HF_HUB_OFFLINE', '1')
+        os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+    from ml_models import load_ml_models, load_audio_model, load_text_model
+    loader = {'image': load_ml_models, 'audio': load_audio_model, 'text': load_text_model}[kind]
+    _, model, _ = loader()
+    if model is not None:
+        return model.cpu(), 'pretrained'
+
+    print(f"Pretrained {kind} model unavailable offline, using a randomly initialised one")
+    from transformers import (
+        BertConfig, BertForSequenceClassification,
+        ViTConfig, ViTForImageClassification,
+        Wav2Vec2Config, Wav2Vec2ForSequenceClassification,
+    )
+    if kind == 'image':
+        # dima806/deepfake_vs_real_image_detection is a ViT-B/16 at 224px
+        model = ViTForImageClassification(ViTConfig(image_size=224, patch_size=16, num_labels=2))
+    elif kind == 'audio':
+        # MelodyMachine/Deepfake-audio-detection-V2 is a wav2vec2-base classifier
+        model = Wav2Vec2ForSequenceClassification(Wav2Vec2Config(num_labels=2))
+    else:
+        # mmosko/Bert_Fake_News_Classification is bert-base-cased
+        model = BertForSequenceClassification(BertConfig(vocab_size=28996, num_labels=3))
+    return model, 'random-init'
+
+
+def make_inputs(kind, batch_size, audio_seconds, seq_len, seed):
+    """Build synthetic model inputs and the number of throughput units they represent."""
+    import torch
+    generator = torch.Generator().manual_seed(seed)
+    if kind == 'image':
+        pixel_values = torch.randn(batch_size, 3, 224, 224, generator=generator)
+        return {'pixel_values': pixel_values}, batch_size
+    if kind == 'audio':
+        samples = int(16000 * audio_seconds)
+        input_values = torch.randn(batch_size, samples, generator=generator)
+        return {'input_values': input_values}, batch_size * audio_seconds
+    input_ids = torch.randint(1000, 28000, (batch_size, seq_len), generator=generator)
+    attention_mask = torch.ones_like(input_ids)
+    return {'input_ids': input_ids, 'attention_mask': attention_mask}, batch_size * seq_len
+
+
+def prepare_variant(model, precision, backend):
+    """Apply a precision/backend combination. Returns (model, autocast_dtype)."""
+    import copy
+    import torch
+    variant = copy.deepcopy(model).eval()
+    autocast_dtype = None
+    if precision == 'int8':
+        variant = torch.ao.quantization.quantize_dynamic(variant, {torch.nn.Linear}, dtype=torch.qint8)
+    elif precision == 'bf16':
+        autocast_dtype = torch.bfloat16
+    if backend == 'compile':
+        variant = torch.compile(variant)
+    return variant, autocast_dtype
+
+
+def time_forward(model, inputs, autocast_dtype, warmup, iterations):
+    import torch
+    latencies = []
+    with torch.inference_mode(), torch.autocast('cpu', dtype=autocast_dtype or torch.bfloat16,
+                                                enabled=autocast_dtype is not None):
+        for _ in range(warmup):
+            model(**inputs)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model(**inputs)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def run(args):
+    import torch
+    results = []
+    for kind in args.models:
+        base_model, source = load_model(kind, args.allow_download)
+        for precision in args.precisions:
+            for backend in args.backends:
+                try:
+                    model, autocast_dtype = prepare_variant(base_model, precision, backend)
+                except Exception as e:
+                    print(f"Skipping {kind}/{precision}/{backend}: {e}")
+                    continue
+                for threads in args.threads:
+                    torch.set_num_threads(threads)
+                    for batch_size in args.batch_sizes:
+                        inputs, units = make_inputs(kind, batch_size, args.audio_seconds, args.seq_len, args.seed)
+                        try:
+                            latencies = time_forward(model, inputs, autocast_dtype, args.warmup, args.iterations)
+                        except Exception as e:
+                            print(f"Skipping {kind}/{precision}/{backend} batch {batch_size}: {e}")
+                            continue
+                        mean = statistics.fmean(latencies)
+                        row = {
+                            'model': kind,
+                            'source': source,
+                            'precision': precision,
+                            'backend': backend,
+                            'threads': threads,
+                            'batch_size': batch_size,
+                            'mean_ms': mean * 1000,
+                            'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+                            'p90_ms': float(np.percentile(latencies, 90)) * 1000,
+                            'per_item_ms': mean * 1000 / batch_size,
+                            'throughput': units / mean,
+                            'unit': UNITS[kind],
+                        }
+                        results.append(row)
+                        print_row(row)
+    return results
+
+
+def print_header():
+    print(f"{'Model':<6} {'Source':<12} {'Prec':<5} {'Backend':<8} {'Thr':>4} {'Batch':>6} "
+          f"{'p50 ms':>9} {'p90 ms':>9} {'ms/item':>9} {'Throughput':>14}")
+    print('=' * 90)
+
+
+def print_row(row):
+    print(f"{row['model']:<6} {row['source']:<12} {row['precision']:<5} {row['backend']:<8} "
+          f"{row['threads']:>4} {row['batch_size']:>6} {row['p50_ms']:>9.1f} {row['p90_ms']:>9.1f} "
+          f"{row['per_item_ms']:>9.2f} {row['throughput']:>9.1f} {row['unit']}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark model forward passes')
+    parser.add_argument('--models', nargs='+', choices=['image', 'audio', 'text'], default=['image', 'audio', 'text'])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1])
+    parser.add_argument('--precisions', nargs='+', choices=['fp32', 'bf16', 'int8'], default=['fp32', 'int8'])
+    parser.add_argument('--backends', nargs='+', choices=['eager', 'compile'], default=['eager'])
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=10)
+    parser.add_argument('--audio-seconds', type=float, default=4.0)
+    parser.add_argument('--seq-len', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--allow-download', action='store_true',
+                        help='Let the loaders fetch weights from the Hugging Face hub')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args(argv)
+
+    print_header()
+    results = run(args)
+
+    if args.output:
+        import torch
+        report = {
+            'meta': {
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'git_revision': git_revision(),
+                'torch_version': torch.__version__,
+                'cpu_count': os.cpu_count(),
+                'warmup': args.warmup,
+                'iterations': args.iterations,
+                'audio_seconds': args.audio_seconds,
+                'seq_len': args.seq_len,
+            },
+            'results': results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,546 @@
+"""Accuracy report for the image, audio or text model, computed from cached logits.
+
+Runs a labelled dataset through one model once and keeps every file's raw
+logits on disk, keyed by the file's SHA-256 under the model's revision
+(model_store.model_revision). Later runs over the same files only stat them:
+a path whose size and mtime haven't changed maps straight to its digest and
+cached logits, so accuracy, the confusion matrix, the classification report,
+ROC/PR curves, a threshold sweep and a temperature-scaling sweep are all
+recomputed in milliseconds without loading the model. A new model revision
+starts a new cache.
+
+The dataset is a directory with `real/` and `fake/` subdirectories, as for
+cascade_eval.py, or a CSV manifest of `path,label` lines (label real/fake or
+0/1). Audio files are scored window by window like /api/analyze, and the
+cached logits are the log of the mean window probabilities, so the usual
+softmax gives back the app's averaged score.
+
+    python -m benchmarks.model_eval --model image --data ~/datasets/deepfake-val \\
+        --output bench_results/dima_eval.json --plots bench_results/dima
+    python -m benchmarks.model_eval --model image --data ~/datasets/deepfake-val --threshold 0.7
+
+--plots draws the confusion matrix, classification report and curves the
+model pages show (needs matplotlib).
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from benchmarks.model_bench import BACKEND_DIR, git_revision
+from bulk_score import (
+    AUDIO_EXTENSIONS, IMAGE_EXTENSIONS, MODEL_NAMES, Models,
+    audio_logits, decoded, fake_index, image_logits, softmax,
+)
+from model_store import model_revision
+
+CACHE_DIR = os.environ.get('EVAL_CACHE_DIR', os.path.join(BACKEND_DIR, 'eval_cache'))
+EXTENSIONS = {'image': IMAGE_EXTENSIONS, 'audio': AUDIO_EXTENSIONS, 'text': ('.txt',)}
+LABELS = {'real': 0, 'fake': 1, '0': 0, '1': 1}
+TEXT_MAX_LENGTH = 512
+TEMPERATURES = np.geomspace(0.1, 10.0, 13)
+
+
+def find_items(data_dir, kind):
+    """[(path, label)] for files of this kind under data_dir/real and data_dir/fake."""
+    items = []
+    for entry in sorted(os.listdir(data_dir)):
+        label = LABELS.get(entry.lower())
+        folder = os.path.join(data_dir, entry)
+        if label is None or not os.path.isdir(folder):
+            continue
+        for directory, subdirs, names in os.walk(folder):
+            subdirs.sort()
+            items.extend((os.path.join(directory, name), label)
+                         for name in sorted(names) if name.lower().endswith(EXTENSIONS[kind]))
+    if not items:
+        raise SystemExit(f"No {kind} files found under {data_dir}/real or {data_dir}/fake")
+    return items
+
+
+def read_manifest(path):
+    """[(path, label)] from a CSV manifest; `#` comments and a leading header row such as `path,label` are skipped."""
+    base = os.path.dirname(os.path.abspath(path))
+    items = []
+    header = True
+    with open(path, newline='') as f:
+        for number, row in enumerate(csv.reader(f), 1):
+            if not row or row[0].startswith('#'):
+                continue
+            label = row[1].strip().lower() if len(row) > 1 else ''
+            if label not in LABELS:
+                # Only the first row may be something other than data
+                if header:
+                    header = False
+                    continue
+                raise SystemExit(f"{path}:{number}: expected path,label with a label of real/fake or 0/1")
+            header = False
+            items.append((os.path.join(base, row[0].strip()), LABELS[label]))
+    return items
+
+
+class LogitCache:
+    """Append-only SHA-256 -> logits store for one model revision.
+
+    digests.bin holds raw 32-byte digests and logits.f32 the matching float32
+    rows; meta.json records the class count and which class is "fake".
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.digests_path = os.path.join(directory, 'digests.bin')
+        self.logits_path = os.path.join(directory, 'logits.f32')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.meta = None
+        self._rows = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.meta = json.load(f)
+            self._load()
+
+    def _load(self):
+        classes = self.meta['classes']
+        digests = np.fromfile(self.digests_path, dtype='S32') if os.path.exists(self.digests_path) else np.empty(0, 'S32')
+        logits = np.fromfile(self.logits_path, dtype=np.float32) if os.path.exists(self.logits_path) else np.empty(0, np.float32)
+        logits = logits[:len(logits) // classes * classes].reshape(-1, classes)
+        # An interrupted append can leave one file a row ahead of the other; drop the unmatched tail
+        count = min(len(digests), len(logits))
+        for path, row_bytes in ((self.digests_path, 32), (self.logits_path, classes * 4)):
+            if os.path.exists(path) and os.path.getsize(path) != count * row_bytes:
+                with open(path, 'r+b') as f:
+                    f.truncate(count * row_bytes)
+        self._rows = dict(zip(digests[:count].tolist(), logits[:count]))
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, digest):
+        return bytes.fromhex(digest) in self._rows
+
+    def get(self, digests):
+        """(n, classes) logits for hex digests that are all in the cache."""
+        return np.stack([self._rows[bytes.fromhex(digest)] for digest in digests])
+
+    def put(self, digests, logits, fake):
+        logits = np.ascontiguousarray(logits, dtype=np.float32)
+        if self.meta is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.meta = {'classes': int(logits.shape[1]), 'fake_index': int(fake)}
+            with open(self.meta_path, 'w') as f:
+                json.dump(self.meta, f)
+        raw = [bytes.fromhex(digest) for digest in digests]
+        # Logits first: a digest on disk always has its row
+        with open(self.logits_path, 'ab') as f:
+            f.write(logits.tobytes())
+        with open(self.digests_path, 'ab') as f:
+            f.write(b''.join(raw))
+        self._rows.update(zip(raw, logits))
+
+
+class PathDigests:
+    """path -> SHA-256 memo keyed on size and mtime, so unchanged files are never read again."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, path):
+        entry = self._entries.get(path)
+        stat = os.stat(path)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def set(self, path, digest):
+        stat = os.stat(path)
+        self._entries[path] = [stat.st_size, stat.st_mtime_ns, digest]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def _text_rows(paths):
+    for path in paths:
+        row = {"path": path}
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            row["sha256"] = hashlib.sha256(data).hexdigest()
+            yield row, data.decode('utf-8')
+        except Exception as e:
+            row["error"] = str(e) or type(e).__name__
+            yield row, None
+
+
+def text_logits(models, texts):
+    import torch
+    tokenizer, model, device = models.get('text')
+    inputs = tokenizer(texts, return_tensors="pt", truncation=True, max_length=TEXT_MAX_LENGTH,
+                       padding=True).to(device)
+    with torch.inference_mode():
+        return model(**inputs).logits.float().cpu().numpy()
+
+
+def infer(kind, paths, models, cache, digests, workers, batch_size):
+    """Scores paths missing from the cache and stores their logits; returns the paths that failed."""
+    rows = _text_rows(paths) if kind == 'text' else decoded(paths, workers)
+    failed, batch = [], []
+
+    def flush():
+        if not batch:
+            return
+        items = [item for _, item in batch]
+        if kind == 'image':
+            logits = image_logits(models, items)
+        elif kind == 'text':
+            logits = text_logits(models, items)
+        else:
+            # Log of the mean window probability: its softmax is the app's averaged score
+            logits = np.stack([np.log(softmax(audio_logits(models, windows, batch_size)).mean(axis=0) + 1e-12)
+                               for windows in items])
+        cache.put([row["sha256"] for row, _ in batch], logits, fake_index(models.get(kind)[1].config))
+        for row, _ in batch:
+            digests.set(row["path"], row["sha256"])
+        batch.clear()
+
+    for row, item in rows:
+        if item is None:
+            failed.append((row["path"], row.get("error")))
+            continue
+        if row["sha256"] in cache:
+            # Same content under another path
+            digests.set(row["path"], row["sha256"])
+            continue
+        batch.append((row, item))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return failed
+
+
+def collect(kind, items, models=None, cache_dir=CACHE_DIR, workers=1, batch_size=32):
+    """(logits, labels, fake index, stats) for items, running the model only on files not cached yet."""
+    model_name = MODEL_NAMES[kind]
+    revision = model_revision(model_name)
+    cache = LogitCache(os.path.join(cache_dir, model_name, revision))
+    digests = PathDigests(os.path.join(cache_dir, 'paths.json'))
+
+    missing = [path for path, _ in items if (digests.get(path) or '') not in cache]
+    failed = []
+    if missing:
+        failed = infer(kind, missing, models or Models(), cache, digests, workers, batch_size)
+        digests.save()
+    bad = {path for path, _ in failed}
+    kept = [(path, label) for path, label in items if path not in bad]
+    if not kept:
+        raise SystemExit('No file could be scored')
+
+    logits = cache.get([digests.get(path) for path, _ in kept])
+    labels = np.array([label for _, label in kept], dtype=np.int8)
+    stats = {'model': model_name, 'revision': revision, 'items': len(kept), 'inferred': len(missing) - len(failed),
+             'cached': len(items) - len(missing), 'failed': failed}
+    return logits, labels, cache.meta['fake_index'], stats
+
+
+def fake_scores(logits, fake, temperature=1.0):
+    return softmax(logits / temperature)[:, fake]
+
+
+def confusion_matrix(labels, scores, threshold):
+    """[[real as real, real as fake], [fake as real, fake as fake]]; fake means score > threshold."""
+    predicted = scores > threshold
+    fake = labels == 1
+    return [[int((~fake & ~predicted).sum()), int((~fake & predicted).sum())],
+            [int((fake & ~predicted).sum()), int((fake & predicted).sum())]]
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+
+def classification_report(matrix):
+    """Per-class precision, recall, F1 and support from a 2x2 confusion matrix."""
+    matrix = np.array(matrix)
+    report = {}
+    for index, name in enumerate(('real', 'fake')):
+        true_positive = matrix[index, index]
+        precision = _ratio(true_positive, matrix[:, index].sum())
+        recall = _ratio(true_positive, matrix[index].sum())
+        report[name] = {'precision': precision, 'recall': recall,
+                        'f1': _ratio(2 * precision * recall, precision + recall), 'support': int(matrix[index].sum())}
+    report['accuracy'] = _ratio(np.trace(matrix), matrix.sum())
+    report['macro_f1'] = (report['real']['f1'] + report['fake']['f1']) / 2
+    return report
+
+
+def _counts_above(labels, scores):
+    """(thresholds, fakes above, reals above) at every distinct score, highest first."""
+    order = np.argsort(-scores, kind='stable')
+    scores, fake = scores[order], labels[order] == 1
+    # Last index of each run of equal scores
+    distinct = np.flatnonzero(np.diff(scores)).tolist() + [len(scores) - 1]
+    true_positives = np.cumsum(fake)[distinct]
+    false_positives = np.cumsum(~fake)[distinct]
+    return scores[distinct], true_positives, false_positives
+
+
+def roc_curve(labels, scores, counts=None):
+    """(fpr, tpr, thresholds), starting from (0, 0); thresholds are inclusive (score >= t)."""
+    thresholds, tp, fp = counts or _counts_above(labels, scores)
+    positives, negatives = max(tp[-1], 1), max(fp[-1], 1)
+    fpr = np.concatenate([[0.0], fp / negatives])
+    tpr = np.concatenate([[0.0], tp / positives])
+    return fpr, tpr, np.concatenate([[np.inf], thresholds])
+
+
+def pr_curve(labels, scores, counts=None):
+    """(precision, recall, thresholds, average precision); thresholds are inclusive (score >= t)."""
+    thresholds, tp, fp = counts or _counts_above(labels, scores)
+    precision = tp / (tp + fp)
+    recall = tp / max(tp[-1], 1)
+    average_precision = float(np.sum(np.diff(np.concatenate([[0.0], recall])) * precision))
+    return precision, recall, thresholds, average_precision
+
+
+def threshold_sweep(labels, scores, thresholds):
+    """Accuracy, precision, recall, F1 and false-positive rate at each threshold (fake = score > t)."""
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    fake_scores_sorted = np.sort(scores[labels == 1])
+    real_scores_sorted = np.sort(scores[labels == 0])
+    # Counts above each threshold by binary search instead of one pass over the data per threshold
+    tp = len(fake_scores_sorted) - np.searchsorted(fake_scores_sorted, thresholds, side='right')
+    fp = len(real_scores_sorted) - np.searchsorted(real_scores_sorted, thresholds, side='right')
+    positives, negatives = len(fake_scores_sorted), len(real_scores_sorted)
+    precision = np.divide(tp, tp + fp, out=np.zeros(len(thresholds)), where=tp + fp > 0)
+    recall = tp / max(positives, 1)
+    f1 = np.divide(2 * precision * recall, precision + recall, out=np.zeros(len(thresholds)),
+                   where=precision + recall > 0)
+    accuracy = (tp + negatives - fp) / max(positives + negatives, 1)
+    return [
+        {'threshold': round(float(t), 6), 'accuracy': float(a), 'precision': float(p), 'recall': float(r),
+         'f1': float(f), 'fpr': float(n / max(negatives, 1))}
+        for t, a, p, r, f, n in zip(thresholds, accuracy, precision, recall, f1, fp)
+    ]
+
+
+def expected_calibration_error(labels, scores, bins=10):
+    """ECE of the fake probability over equal-width bins, with the per-bin reliability table."""
+    edges = np.minimum((scores * bins).astype(int), bins - 1)
+    count = np.bincount(edges, minlength=bins)
+    confidence = np.bincount(edges, weights=scores, minlength=bins)
+    observed = np.bincount(edges, weights=labels.astype(np.float64), minlength=bins)
+    filled = count > 0
+    gap = np.abs(confidence[filled] - observed[filled]) / count[filled]
+    ece = float(np.sum(gap * count[filled]) / len(scores))
+    table = [{'bin': [i / bins, (i + 1) / bins], 'count': int(count[i]),
+              'mean_score': float(confidence[i] / count[i]), 'fake_rate': float(observed[i] / count[i])}
+             for i in np.flatnonzero(filled)]
+    return ece, table
+
+
+def _nll(labels, scores):
+    scores = np.clip(scores, 1e-12, 1 - 1e-12)
+    return float(-np.mean(np.where(labels == 1, np.log(scores), np.log(1 - scores))))
+
+
+def _tempered_nll(logits, labels, fake):
+    """NLL of the labels as a function of temperature, computed with log-softmax so it stays finite."""
+    if logits.shape[1] == 2:
+        # Two classes: only the signed logit margin matters, so each call is one logaddexp
+        margin = (logits[:, fake] - logits[:, 1 - fake]) * np.where(labels == 1, -1, 1).astype(np.float32)
+        return lambda temperature: float(np.mean(np.logaddexp(np.float32(0), margin / np.float32(temperature)),
+                                                 dtype=np.float64))
+    others = np.delete(logits, fake, axis=1)
+
+    def nll(temperature):
+        scaled, rest = logits / temperature, others / temperature
+        top, rest_top = scaled.max(axis=1), rest.max(axis=1)
+        total = top + np.log(np.exp(scaled - top[:, None]).sum(axis=1))
+        rest = rest_top + np.log(np.exp(rest - rest_top[:, None]).sum(axis=1))
+        return float(np.mean(total - np.where(labels == 1, scaled[:, fake], rest)))
+    return nll
+
+
+def temperature_sweep(logits, labels, fake, temperatures=TEMPERATURES):
+    """Negative log-likelihood at every temperature, and the temperature that minimises it.
+
+    NLL is convex in 1 / temperature, so a golden-section search between the
+    grid neighbours of the best grid point finds the optimum.
+    """
+    nll = _tempered_nll(logits, labels, fake)
+    sweep = [(float(t), nll(t)) for t in temperatures]
+    best = min(range(len(sweep)), key=lambda i: sweep[i][1])
+    low = np.log(temperatures[max(best - 1, 0)])
+    high = np.log(temperatures[min(best + 1, len(temperatures) - 1)])
+    ratio = (np.sqrt(5) - 1) / 2
+    left, right = high - ratio * (high - low), low + ratio * (high - low)
+    left_nll, right_nll = nll(np.exp(left)), nll(np.exp(right))
+    for _ in range(16):
+        if left_nll < right_nll:
+            high, right, right_nll = right, left, left_nll
+            left = high - ratio * (high - low)
+            left_nll = nll(np.exp(left))
+        else:
+            low, left, left_nll = left, right, right_nll
+            right = low + ratio * (high - low)
+            right_nll = nll(np.exp(right))
+    return float(np.exp((low + high) / 2)), [{'temperature': round(t, 4), 'nll': value} for t, value in sweep]
+
+
+def _thin(points, *arrays):
+    """At most `points` evenly spaced entries of each curve, always keeping both ends."""
+    if len(arrays[0]) <= points:
+        return [array.tolist() for array in arrays]
+    keep = np.unique(np.linspace(0, len(arrays[0]) - 1, points).round().astype(int))
+    return [array[keep].tolist() for array in arrays]
+
+
+def evaluate(logits, labels, fake, threshold=0.5, thresholds=None, curve_points=200):
+    """Full report for cached logits; takes milliseconds, so rerun it freely with other thresholds."""
+    scores = fake_scores(logits, fake)
+    matrix = confusion_matrix(labels, scores, threshold)
+    # One sort serves both curves
+    counts = _counts_above(labels, scores)
+    fpr, tpr, roc_thresholds = roc_curve(labels, scores, counts)
+    precision, recall, pr_thresholds, average_precision = pr_curve(labels, scores, counts)
+    sweep = threshold_sweep(labels, scores, np.linspace(0.05, 0.95, 19) if thresholds is None else thresholds)
+    ece, reliability = expected_calibration_error(labels, scores)
+    temperature, temperatures = temperature_sweep(logits, labels, fake)
+    calibrated_ece, _ = expected_calibration_error(labels, fake_scores(logits, fake, temperature))
+    auc = float(np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2))
+    fpr, tpr, roc_thresholds = _thin(curve_points, fpr, tpr, np.minimum(roc_thresholds, 1.0))
+    precision, recall, pr_thresholds = _thin(curve_points, precision, recall, pr_thresholds)
+    return {
+        'threshold': threshold,
+        'accuracy': classification_report(matrix)['accuracy'],
+        'confusion_matrix': matrix,
+        'classification_report': classification_report(matrix),
+        'roc': {'auc': auc, 'fpr': fpr, 'tpr': tpr, 'thresholds': roc_thresholds},
+        'pr': {'average_precision': average_precision, 'precision': precision, 'recall': recall,
+               'thresholds': pr_thresholds},
+        'threshold_sweep': sweep,
+        'best_f1': max(sweep, key=lambda row: row['f1']),
+        'calibration': {
+            'ece': ece,
+            'nll': _nll(labels, scores),
+            'reliability': reliability,
+            'best_temperature': temperature,
+            'calibrated_ece': calibrated_ece,
+            'temperature_sweep': temperatures,
+        },
+    }
+
+
+def plot(report, directory, title):
+    """Confusion matrix, classification report and ROC/PR curves as PNGs."""
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        raise SystemExit('--plots needs matplotlib (pip install matplotlib)')
+    os.makedirs(directory, exist_ok=True)
+
+    figure, axes = plt.subplots(figsize=(5, 4.5))
+    matrix = np.array(report['confusion_matrix'])
+    axes.imshow(matrix, cmap='Blues')
+    for (row, col), value in np.ndenumerate(matrix):
+        axes.text(col, row, str(value), ha='center', va='center',
+                  color='white' if value > matrix.max() / 2 else 'black')
+    axes.set(xticks=[0, 1], yticks=[0, 1], xticklabels=['Real', 'Fake'], yticklabels=['Real', 'Fake'],
+             xlabel='Predicted', ylabel='Actual', title=f'{title} confusion matrix')
+    figure.tight_layout()
+    figure.savefig(os.path.join(directory, 'confusion_matrix.png'), dpi=150)
+    plt.close(figure)
+
+    rows = report['classification_report']
+    cells = [[name.title()] + [f"{rows[name][key]:.4f}" for key in ('precision', 'recall', 'f1')] + [rows[name]['support']]
+             for name in ('real', 'fake')]
+    cells.append(['Accuracy', '', '', f"{rows['accuracy']:.4f}", sum(rows[name]['support'] for name in ('real', 'fake'))])
+    figure, axes = plt.subplots(figsize=(6, 1.8))
+    axes.axis('off')
+    axes.table(cellText=cells, colLabels=['', 'Precision', 'Recall', 'F1', 'Support'], loc='center')
+    axes.set_title(f'{title} classification report')
+    figure.savefig(os.path.join(directory, 'classification_report.png'), dpi=150, bbox_inches='tight')
+    plt.close(figure)
+
+    figure, (roc_axes, pr_axes) = plt.subplots(1, 2, figsize=(10, 4.5))
+    roc_axes.plot(report['roc']['fpr'], report['roc']['tpr'])
+    roc_axes.plot([0, 1], [0, 1], linestyle='--', color='grey')
+    roc_axes.set(xlabel='False positive rate', ylabel='True positive rate', title=f"ROC (AUC {report['roc']['auc']:.3f})")
+    pr_axes.plot(report['pr']['recall'], report['pr']['precision'])
+    pr_axes.set(xlabel='Recall', ylabel='Precision', title=f"PR (AP {report['pr']['average_precision']:.3f})")
+    figure.tight_layout()
+    figure.savefig(os.path.join(directory, 'curves.png'), dpi=150)
+    plt.close(figure)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate a model on a labelled dataset from cached logits')
+    parser.add_argument('--model', choices=sorted(MODEL_NAMES), required=True)
+    parser.add_argument('--data', help='Directory with real/ and fake/ folders')
+    parser.add_argument('--manifest', help='CSV of path,label lines instead of --data')
+    parser.add_argument('--threshold', type=float, default=0.5, help='Fake when the fake probability is above this')
+    parser.add_argument('--thresholds', type=float, nargs='+', help='Thresholds for the sweep (default 0.05-0.95)')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) - 1, 1), help='Decoder processes')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--output', help='Write the report as JSON to this path')
+    parser.add_argument('--plots', help='Directory for confusion matrix, report and curve PNGs')
+    args = parser.parse_args(argv)
+    if bool(args.data) == bool(args.manifest):
+        parser.error('give either --data or --manifest')
+
+    items = read_manifest(args.manifest) if args.manifest else find_items(args.data, args.model)
+    start = time.perf_counter()
+    logits, labels, fake, stats = collect(args.model, items, cache_dir=args.cache_dir,
+                                          workers=args.workers, batch_size=args.batch_size)
+    collected = time.perf_counter() - start
+    start = time.perf_counter()
+    report = evaluate(logits, labels, fake, args.threshold, args.thresholds)
+    evaluated = time.perf_counter() - start
+
+    print(f"{stats['items']} files ({stats['cached']} cached, {stats['inferred']} inferred, "
+          f"{len(stats['failed'])} failed) with {stats['model']}@{stats['revision'][:12]} in {collected:.1f}s; "
+          f"metrics in {evaluated * 1000:.1f}ms\n")
+    matrix = report['confusion_matrix']
+    print(f"Accuracy {report['accuracy'] * 100:.2f}% at threshold {args.threshold}, "
+          f"ROC AUC {report['roc']['auc']:.4f}, AP {report['pr']['average_precision']:.4f}")
+    print(f"Confusion matrix (rows actual real/fake): {matrix[0]} {matrix[1]}")
+    for name in ('real', 'fake'):
+        row = report['classification_report'][name]
+        print(f"  {name:<5} precision {row['precision']:.4f}  recall {row['recall']:.4f}  "
+              f"f1 {row['f1']:.4f}  support {row['support']}")
+    best = report['best_f1']
+    calibration = report['calibration']
+    print(f"Best F1 {best['f1']:.4f} at threshold {best['threshold']}; ECE {calibration['ece']:.4f}, "
+          f"{calibration['calibrated_ece']:.4f} at temperature {calibration['best_temperature']:.2f}")
+
+    if args.output:
+        report['meta'] = dict(stats, timestamp=datetime.utcnow().isoformat() + 'Z', git_revision=git_revision(),
+                              collect_s=collected, evaluate_ms=evaluated * 1000)
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+    if args.plots:
+        plot(report, args.plots, stats['model'].title())
+        print(f'Plots written to {args.plots}')
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import func, select
+
+from metrics import record_blob_collected, record_blob_write
+
+# Content-addressed store for uploaded media. Each distinct upload is kept once,
+# under the SHA-256 of its bytes, in a two-level sharded layout
+# (ab/cd/abcd...) so no directory grows past a few thousand entries; an upload
+# that is already stored costs one stat. Blobs are written to a temporary
+# file in their shard, fsynced and renamed into place, so a name only ever
+# refers to complete bytes and concurrent writers of the same upload simply
+# replace each other with identical files.
+#
+# Content rows reference blobs through file_hash (indexed), and that is the
+# reference count: there is no separate counter to drift. The collector walks
+# the store, asks the database which of a batch of digests are still
+# referenced, and deletes the rest. Rows reach the database through the
+# write-behind writer a moment after their blob is written, so blobs younger
+# than GRACE_S are never collected, and storing an existing blob again
+# refreshes its mtime for the same reason.
+
+BLOB_DIR = os.environ.get('BLOB_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blobs'))
+ENABLED = os.environ.get('BLOB_STORE_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+FSYNC = os.environ.get('BLOB_STORE_FSYNC', 'True').lower() in ('1', 'true', 'yes')
+GRACE_S = float(os.environ.get('BLOB_GC_GRACE_S', '3600'))
+GC_BATCH = int(os.environ.get('BLOB_GC_BATCH', '500'))
+
+
+class BlobStore:
+    """Uploads on disk keyed by SHA-256, stored once however often they are submitted."""
+
+    def __init__(self, directory=BLOB_DIR, fsync=FSYNC):
+        self.directory = directory
+        self.fsync = fsync
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def relative_path(digest):
+        return os.path.join(digest[:2], digest[2:4], digest)
+
+    def path(self, digest):
+        return os.path.join(self.directory, self.relative_path(digest))
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def put(self, data, digest=None):
+        """Stores data if it isn't stored yet; returns its digest."""
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        try:
+            # Already stored: only mark it as recently used, see GRACE_S
+            os.utime(path)
+            record_blob_write(False, len(data))
+            return digest
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        record_blob_write(True, len(data))
+        return digest
+
+    @contextmanager
+    def mapped(self, digest):
+        """The blob's bytes, memory-mapped read-only for as long as the block runs."""
+        with open(self.path(digest), 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b''  # Empty files can't be mapped
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield data
+
+    def read(self, digest):
+        with self.mapped(digest) as data:
+            return bytes(data)
+
+    def scan(self):
+        """Yields (digest, path, stat) for every blob, and stray temporary files with digest None."""
+        for first in _subdirectories(self.directory):
+            for second in _subdirectories(first.path):
+                with os.scandir(second.path) as entries:
+                    for entry in entries:
+                        if entry.is_file(follow_symlinks=False):
+                            digest = None if entry.name.endswith('.tmp') else entry.name
+                            yield digest, entry.path, entry.stat(follow_symlinks=False)
+
+
+def _subdirectories(path):
+    with os.scandir(path) as entries:
+        return sorted((entry for entry in entries if entry.is_dir(follow_symlinks=False)), key=lambda entry: entry.name)
+
+
+def references(connection, content, digests):
+    """How many Content rows point at each digest, for the digests that have any."""
+    query = select([content.c.file_hash, func.count()]).where(content.c.file_hash.in_(digests)) \
+        .group_by(content.c.file_hash)
+    return dict(connection.execute(query).fetchall())
+
+
+def collect(store, engine, content, grace_s=GRACE_S, batch_size=GC_BATCH, dry_run=False):
+    """Deletes blobs no Content row references; returns (blobs scanned, blobs deleted, bytes reclaimed)."""
+    scanned = deleted = reclaimed = 0
+    cutoff = time.time() - grace_s
+
+    def sweep(batch):
+        nonlocal deleted, reclaimed
+        # One short read per batch, served by ix_content_file_hash
+        with engine.connect() as connection:
+            referenced = references(connection, content, [digest for digest, _, _ in batch])
+        for digest, path, size in batch:
+            if digest in referenced:
+                continue
+            if not dry_run:
+                try:
+                    # Checked again at the last moment: a put since the scan refreshed the mtime
+                    if os.stat(path).st_mtime >= cutoff:
+                        continue
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                record_blob_collected(size)
+            deleted += 1
+            reclaimed += size
+
+    batch = []
+    for digest, path, stat in store.scan():
+        scanned += digest is not None
+        if stat.st_mtime >= cutoff:
+            continue
+        if digest is None:
+            # Left behind by a writer that died between write and rename
+            if not dry_run:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            continue
+        batch.append((digest, path, stat.st_size))
+        if len(batch) >= batch_size:
+            sweep(batch)
+            batch = []
+    if batch:
+        sweep(batch)
+    return scanned, deleted, reclaimed
@@ -0,0 +1,380 @@
+"""Blocklist of known fake media from partner hash feeds.
+
+A feed is a text file with one hash per line: `sha256:<64 hex>`,
+`phash:<16 hex>` or `dhash:<16 hex>` (a bare 64-hex line is a SHA-256;
+blank lines and `#` comments are skipped). IRIS_BLOCKLIST_FEED names one or
+more feed files, comma-separated; each entry's source is its file name.
+
+A build writes two memory-mapped structures:
+
+- bloom.bin, a Bloom filter sized for BLOCKLIST_FP_RATE. It is small enough
+  to stay in page cache and answers "definitely not listed" for almost
+  every upload with a handful of bit probes.
+- keys.bin, every entry as a fixed-width record sorted bytewise, with
+  sources.bin alongside. A filter hit is confirmed by binary search here, so
+  a false positive never turns into a wrong verdict.
+
+Uploads are checked by SHA-256 before anything is decoded, and images again
+by perceptual hash (the same dHash/pHash as the imagehash package) right
+after decoding. A watcher thread polls the feed files and rebuilds into a
+new directory when they change, then swaps the `current.json` pointer;
+requests keep using the previous build until then, and every worker picks
+up the new one on its next lookup. Every worker starts a watcher, but only
+the one holding the flock on watch.lock builds; the others take over if that
+worker exits. Builds hash and set bits BUILD_CHUNK keys at a time, so their
+memory is the sorted key table plus a fixed amount, not a multiple of the
+feed size.
+
+    python blocklist.py build [--feed feeds/partner.txt]
+    python blocklist.py check suspicious.jpg
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent builds from several workers aren't prevented
+    fcntl = None
+
+BLOCKLIST_DIR = os.environ.get('BLOCKLIST_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blocklist'))
+FEEDS = [path.strip() for path in os.environ.get('IRIS_BLOCKLIST_FEED', '').split(',') if path.strip()]
+FP_RATE = float(os.environ.get('BLOCKLIST_FP_RATE', '0.001'))
+POLL_INTERVAL = float(os.environ.get('BLOCKLIST_POLL_S', '60'))
+BUILD_CHUNK = int(os.environ.get('BLOCKLIST_BUILD_CHUNK', '65536'))
+
+# Record layout: one type byte, then the hash left-aligned in 32 bytes
+KINDS = {'sha256': 1, 'phash': 2, 'dhash': 3}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+KEY_WIDTH = 33
+KEY_DTYPE = f'S{KEY_WIDTH}'
+
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def make_key(kind, digest):
+    return bytes([KINDS[kind]]) + digest.ljust(KEY_WIDTH - 1, b'\0')
+
+
+def _mix(h):
+    # splitmix64 finaliser, so keys that differ in one byte land far apart
+    h = (h ^ (h >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return h ^ (h >> np.uint64(31))
+
+
+def _hash_pair(keys):
+    """Two 64-bit hashes per key (FNV-1a, then mixed two ways), vectorised over an array of keys."""
+    columns = np.frombuffer(keys.tobytes(), dtype=np.uint8).reshape(len(keys), KEY_WIDTH)
+    h = np.full(len(keys), _FNV_OFFSET, dtype=np.uint64)
+    # One byte column widened at a time rather than the whole table
+    for column in columns.T:
+        h = (h ^ column.astype(np.uint64)) * _FNV_PRIME
+    return _mix(h), _mix(h ^ np.uint64(0x9e3779b97f4a7c15)) | np.uint64(1)
+
+
+def _bit_positions(keys, bits, hashes):
+    """(hashes, n) Bloom bit positions by double hashing."""
+    h1, h2 = _hash_pair(keys)
+    return np.stack([(h1 + np.uint64(i) * h2) % np.uint64(bits) for i in range(hashes)])
+
+
+def _set_bits(bloom, positions):
+    """Sets bit positions in a little-endian packed bit array, without a bool per bit."""
+    positions = np.unique(positions)
+    index = positions >> np.uint64(3)
+    masks = (np.uint64(1) << (positions & np.uint64(7))).astype(np.uint8)
+    # Positions sharing a byte are ORed together first, so each byte is written once
+    starts = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    bloom[index[starts]] |= np.bitwise_or.reduceat(masks, starts)
+
+
+def bloom_size(entries, fp_rate):
+    """(bits, hashes) for a Bloom filter holding entries at the given false positive rate."""
+    bits = max(64, math.ceil(-entries * math.log(fp_rate) / math.log(2) ** 2))
+    bits = (bits + 7) // 8 * 8
+    hashes = max(1, round(bits / max(entries, 1) * math.log(2)))
+    return bits, hashes
+
+
+def parse_feed(path):
+    """Yield (kind, digest bytes) for every valid line of a feed file."""
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            kind, _, value = line.rpartition(':')
+            kind = (kind or 'sha256').lower()
+            try:
+                digest = bytes.fromhex(value)
+            except ValueError:
+                digest = b''
+            expected = 32 if kind == 'sha256' else 8
+            if kind not in KINDS or len(digest) != expected:
+                print(f"Blocklist: skipping malformed line {number} of {path}")
+                continue
+            yield kind, digest
+
+
+def _read_keys(feeds, chunk=BUILD_CHUNK):
+    """(keys, sources) arrays for every feed entry, converted from Python objects a chunk at a time."""
+    key_chunks, source_chunks, pending = [], [], []
+
+    def flush(source):
+        key_chunks.append(np.array(pending, dtype=KEY_DTYPE))
+        source_chunks.append(np.full(len(pending), source, dtype=np.uint16))
+        pending.clear()
+
+    for source, path in enumerate(feeds):
+        for kind, digest in parse_feed(path):
+            pending.append(make_key(kind, digest))
+            if len(pending) >= chunk:
+                flush(source)
+        if pending:
+            flush(source)
+    if not key_chunks:
+        return np.array([], dtype=KEY_DTYPE), np.array([], dtype=np.uint16)
+    return np.concatenate(key_chunks), np.concatenate(source_chunks)
+
+
+def build(feeds, directory=BLOCKLIST_DIR, fp_rate=FP_RATE, chunk=BUILD_CHUNK):
+    """Build filter and exact table from the feeds into a new version directory and switch to it."""
+    keys, sources = _read_keys(feeds, chunk)
+    # Sorted and deduplicated for binary search; the first feed listing a hash keeps the credit
+    keys, first = np.unique(keys, return_index=True)
+    sources = sources[first]
+    del first
+
+    bits, hashes = bloom_size(len(keys), fp_rate)
+    bloom = np.zeros(bits // 8, dtype=np.uint8)
+    for start in range(0, len(keys), chunk):
+        h1, h2 = _hash_pair(keys[start:start + chunk])
+        for i in range(hashes):
+            _set_bits(bloom, (h1 + np.uint64(i) * h2) % np.uint64(bits))
+
+    version = f'v{int(time.time() * 1000)}'
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    bloom.tofile(os.path.join(path, 'bloom.bin'))
+    keys.tofile(os.path.join(path, 'keys.bin'))
+    sources.tofile(os.path.join(path, 'sources.bin'))
+
+    info = {
+        'version': version,
+        'entries': len(keys),
+        'bits': bits,
+        'hashes': hashes,
+        'sources': [os.path.basename(feed) for feed in feeds],
+        'kinds': {name: int(np.count_nonzero(np.char.startswith(keys, bytes([code])))) for name, code in KINDS.items()},
+        'feeds': {feed: os.path.getmtime(feed) for feed in feeds},
+        'built_at': time.time(),
+    }
+    pointer = os.path.join(directory, 'current.json')
+    tmp_path = f'{pointer}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(info, f)
+    os.replace(tmp_path, pointer)
+    # Workers still mapping an older build keep reading it until they reload
+    for entry in os.listdir(directory):
+        if entry.startswith('v') and entry != version:
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+    return info
+
+
+def dhash(image):
+    """64-bit difference hash of a PIL image, as in imagehash.dhash."""
+    from PIL import Image
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.LANCZOS), dtype=np.int16)
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes()
+
+
+def phash(image):
+    """64-bit DCT perceptual hash of a PIL image, as in imagehash.phash."""
+    from PIL import Image
+    from scipy.fft import dct
+    pixels = np.asarray(image.convert('L').resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = dct(dct(pixels, axis=0), axis=1)[:8, :8]
+    return np.packbits(low > np.median(low)).tobytes()
+
+
+class Blocklist:
+    def __init__(self, directory=BLOCKLIST_DIR, feeds=None, poll_interval=POLL_INTERVAL):
+        self.directory = directory
+        self.feeds = FEEDS if feeds is None else feeds
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._build = None
+        self._checked_at = 0.0
+        self._watch_lock = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _current(self):
+        """The loaded build, re-reading the pointer at most once a second."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < 1.0:
+                return self._build
+            self._checked_at = now
+        try:
+            with open(os.path.join(self.directory, 'current.json')) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        loaded = self._build
+        if loaded is None or loaded['version'] != info['version']:
+            path = os.path.join(self.directory, info['version'])
+            loaded = dict(info, bloom=None, keys=None, source_ids=None)
+            try:
+                if info['entries']:
+                    loaded.update(
+                        bloom=np.memmap(os.path.join(path, 'bloom.bin'), dtype=np.uint8, mode='r'),
+                        keys=np.memmap(os.path.join(path, 'keys.bin'), dtype=KEY_DTYPE, mode='r'),
+                        source_ids=np.memmap(os.path.join(path, 'sources.bin'), dtype=np.uint16, mode='r'),
+                    )
+            except OSError:
+                # Swapped again while loading; the next lookup will pick up the newer build
+                return self._build
+            with self._lock:
+                self._build = loaded
+        return loaded
+
+    def lookup(self, kind, digest):
+        """{'match': kind, 'source': feed name} when the hash is listed, else None."""
+        build = self._current()
+        if not build or not build['entries']:
+            return None
+        key = np.array([make_key(kind, digest)], dtype=KEY_DTYPE)
+        bloom = build['bloom']
+        for position in _bit_positions(key, build['bits'], build['hashes'])[:, 0].tolist():
+            if not bloom[position >> 3] & (1 << (position & 7)):
+                return None
+        # Filter hit: confirm against the exact table
+        keys = build['keys']
+        index = int(np.searchsorted(keys, key[0]))
+        if index >= len(keys) or keys[index] != key[0]:
+            return None
+        return {'match': kind, 'source': build['sources'][int(build['source_ids'][index])]}
+
+    def check_bytes(self, data):
+        return self.lookup('sha256', hashlib.sha256(data).digest())
+
+    def check_image(self, image):
+        """Perceptual-hash lookup for a decoded PIL image; free when no feed lists perceptual hashes."""
+        build = self._current()
+        if not build:
+            return None
+        for kind, hasher in (('dhash', dhash), ('phash', phash)):
+            if build['kinds'].get(kind):
+                match = self.lookup(kind, hasher(image))
+                if match:
+                    return match
+        return None
+
+    def stats(self):
+        build = self._current()
+        if not build:
+            return {'entries': 0, 'version': None}
+        return {'entries': build['entries'], 'kinds': build['kinds'], 'version': build['version'], 'sources': build['sources']}
+
+    def _feeds_changed(self):
+        try:
+            with open(os.path.join(self.directory, 'current.json')) as f:
+                built = json.load(f).get('feeds', {})
+        except (OSError, ValueError):
+            built = {}
+        try:
+            current = {feed: os.path.getmtime(feed) for feed in self.feeds}
+        except OSError as e:
+            print(f"Blocklist feed unavailable: {str(e)}")
+            return False
+        return current != built
+
+    def refresh(self):
+        """Rebuild if the feeds changed since the current build; only one worker builds at a time."""
+        if not self.feeds or not self._feeds_changed():
+            return None
+        with open(os.path.join(self.directory, 'build.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return None
+            # Another worker may have finished the same build while we waited
+            if not self._feeds_changed():
+                return None
+            start = time.perf_counter()
+            info = build(self.feeds, self.directory)
+            print(f"Blocklist rebuilt with {info['entries']} entries in {time.perf_counter() - start:.1f}s")
+            return info
+
+    def claim_builder(self):
+        """Whether this process builds for the directory; held until the process exits."""
+        if self._watch_lock is not None or fcntl is None:
+            return True
+        lock_file = open(os.path.join(self.directory, 'watch.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._watch_lock = lock_file
+        return True
+
+    def watch(self):
+        """Keep the build in step with the feeds on a daemon thread; one worker builds, the rest only load."""
+        def loop():
+            while True:
+                try:
+                    if self.claim_builder():
+                        self.refresh()
+                except Exception as e:
+                    print(f"Blocklist rebuild failed: {str(e)}")
+                time.sleep(self.poll_interval)
+        threading.Thread(target=loop, daemon=True, name='blocklist-watcher').start()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query the known-fake blocklist')
+    parser.add_argument('--dir', default=BLOCKLIST_DIR, help='Blocklist directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='Build filter and exact table from the feed files')
+    build_parser.add_argument('--feed', action='append', help='Feed file (repeatable; default IRIS_BLOCKLIST_FEED)')
+    check_parser = commands.add_parser('check', help='Look a media file up by SHA-256 and, for images, perceptual hash')
+    check_parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        feeds = args.feed or FEEDS
+        if not feeds:
+            raise SystemExit('No feed given; pass --feed or set IRIS_BLOCKLIST_FEED')
+        start = time.perf_counter()
+        info = build(feeds, args.dir)
+        print(f"{info['entries']} entries, {info['bits'] // 8} byte filter with {info['hashes']} hashes "
+              f"in {time.perf_counter() - start:.1f}s")
+        return
+
+    blocklist = Blocklist(args.dir, feeds=[])
+    with open(args.path, 'rb') as f:
+        data = f.read()
+    match = blocklist.check_bytes(data)
+    if match is None:
+        try:
+            from PIL import Image
+            match = blocklist.check_image(Image.open(io.BytesIO(data)))
+        except Exception:
+            pass
+    print(json.dumps(match) if match else 'not listed')
+
+
+if __name__ == '__main__':
+    main()
@@ -14,5 +14,11 @@ pip install -r requirements.txt
 # Setup models directory if needed
 mkdir -p model_files
 
+# Download the pinned models so the app starts without hub access
+python model_store.py sync
+
+# Bring the database schema up to date
+flask --app app upgrade-db
+
 # Initialize database
 python init_db.py 
\ No newline at end of file
@@ -14,7 +14,12 @@ pip install transformers pydub
 
 echo "All dependencies installed successfully!"
 
-# Initialize the database
+# Download the pinned models so the app starts without hub access
+mkdir -p model_files
+python model_store.py sync
+
+# Bring the database schema up to date, then initialize it
+flask --app app upgrade-db
 python init_db.py
 
 echo "Build script completed successfully!" 
\ No newline at end of file
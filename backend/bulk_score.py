@@ -0,0 +1,412 @@
+"""Offline bulk scoring of images and audio on disk, without the Flask app.
+
+Files come from a directory walk or a manifest (one path per line, relative
+paths resolved against the manifest's directory). Worker processes read,
+hash and decode them in chunks, the parent runs the models on batches of
+decoded inputs, and every scored file is appended to a JSONL output as one
+row:
+
+    {"path": ..., "sha256": ..., "type": "image", "result": "fake",
+     "fake_confidence": 0.97, "real_confidence": 0.03, "model": "dima",
+     "revision": ...}
+
+Rows are flushed and fsynced after every batch, so the output doubles as the
+checkpoint: run the same command again after an interruption and files
+already in it are skipped (a row torn by the interruption is cut off first).
+Files that fail to decode get a row with an "error" instead and are only
+retried with --retry-errors, which first drops those rows from the output so
+a retried file is never listed twice.
+
+The models come from the same loaders app.py uses (ml_models.py), with the
+same label conventions, so the scores match /api/analyze without the
+PRNU/ELA features, cascade or ensemble. Bigger batches than the API's pay off
+here because nobody is waiting on a single file.
+
+    python bulk_score.py ~/archive --output scores.jsonl --workers 6
+    python bulk_score.py --manifest audit.txt --output scores.jsonl --parquet scores.parquet
+"""
+import argparse
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+
+import numpy as np
+from PIL import Image
+
+from media import decode_audio, audio_windows
+from model_store import model_revision
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a')
+IMAGE_SIZE = 224
+AUDIO_SAMPLING_RATE = 16000
+AUDIO_WINDOW_S = float(os.environ.get('AUDIO_WINDOW_S', '4'))
+MODEL_NAMES = {'image': 'dima', 'audio': 'melody', 'text': 'mosko'}
+
+BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '32'))
+# Files per task handed to a decoder process; bigger chunks mean less IPC
+CHUNK_FILES = int(os.environ.get('BULK_CHUNK_FILES', '16'))
+# Tasks queued per decoder process, which bounds decoded data held in memory
+PREFETCH = int(os.environ.get('BULK_PREFETCH', '4'))
+
+
+def media_type(path):
+    name = path.lower()
+    if name.endswith(IMAGE_EXTENSIONS):
+        return 'image'
+    if name.endswith(AUDIO_EXTENSIONS):
+        return 'audio'
+    return None
+
+
+def walk(root):
+    """Media files under root, in a stable order."""
+    for directory, subdirs, names in os.walk(root):
+        subdirs.sort()
+        for name in sorted(names):
+            if media_type(name):
+                yield os.path.join(directory, name)
+
+
+def read_manifest(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                yield os.path.join(base, line)
+
+
+def decode(path, image_size=IMAGE_SIZE):
+    """Row skeleton plus decoded input for one file: a uint8 image array or a list of audio windows."""
+    row = {"path": path, "type": media_type(path)}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        row["sha256"] = hashlib.sha256(data).hexdigest()
+        if row["type"] == 'image':
+            # Full-size decode, then resize, exactly as /api/analyze does; a reduced-scale JPEG
+            # decode (Image.draft) is faster but shifts the scores
+            image = Image.open(io.BytesIO(data)).convert('RGB')
+            pixels = np.asarray(image.resize((image_size, image_size)))
+            return row, pixels
+        if row["type"] == 'audio':
+            waveform = decode_audio(data, AUDIO_SAMPLING_RATE)
+            window = int(AUDIO_WINDOW_S * AUDIO_SAMPLING_RATE)
+            return row, [chunk for _, chunk in audio_windows(waveform, window)]
+        row["error"] = 'Unsupported file type'
+    except Exception as e:
+        row["error"] = str(e) or type(e).__name__
+    return row, None
+
+
+def decode_chunk(paths):
+    return [decode(path) for path in paths]
+
+
+def _chunks(paths, size):
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def decoded(paths, workers, chunk_files=CHUNK_FILES, prefetch=PREFETCH):
+    """(row, input) for every path, decoded by a process pool with a bounded number of chunks in flight."""
+    if workers <= 0:
+        for path in paths:
+            yield decode(path)
+        return
+    # Pool.imap would read the whole path list and queue every decoded result ahead of the model
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for chunk in _chunks(paths, chunk_files):
+            pending.append(pool.apply_async(decode_chunk, (chunk,)))
+            if len(pending) >= workers * prefetch:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def completed(output, retry_errors=False):
+    """Paths already in the output; a trailing partial row left by an interruption is truncated away.
+
+    With retry_errors, error rows are removed from the output (their files are
+    scored again and get a new row), so every path keeps a single row.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        if end < len(data):
+            f.truncate(end)
+    lines = data[:end].splitlines(keepends=True)
+    kept = []
+    for line in lines:
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue
+        if retry_errors and row.get("error"):
+            continue
+        done.add(row["path"])
+        kept.append(line)
+    if retry_errors and len(kept) < len(lines):
+        tmp_path = f'{output}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.writelines(kept)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output)
+    return done
+
+
+class Models:
+    """Image, audio and text models, loaded on first use by the ml_models loaders."""
+
+    def __init__(self, loaders=None):
+        from ml_models import load_ml_models, load_audio_model, load_text_model
+        defaults = {'image': load_ml_models, 'audio': load_audio_model, 'text': load_text_model}
+        self._loaders = dict(defaults, **(loaders or {}))
+        self._loaded = {}
+
+    def get(self, kind):
+        if kind not in self._loaded:
+            loaded = self._loaders[kind]()
+            if loaded[1] is None:
+                raise RuntimeError(f'The {MODEL_NAMES[kind]} model failed to load')
+            loaded[1].eval()
+            self._loaded[kind] = loaded
+        return self._loaded[kind]
+
+
+def fake_index(config):
+    # Same lookup as app._label_index
+    for index, label in config.id2label.items():
+        if 'fake' in label.lower():
+            return int(index)
+    return 1
+
+
+def image_logits(models, pixels):
+    """(batch, classes) float32 logits for a batch of (size, size, 3) arrays."""
+    import torch
+    from ml_models import image_inputs
+    processor, model, device = models.get('image')
+    inputs = image_inputs(processor, list(pixels), IMAGE_SIZE, device)
+    with torch.inference_mode():
+        return model(**inputs).logits.float().cpu().numpy()
+
+
+def audio_logits(models, windows, batch_size):
+    """(windows, classes) float32 logits, batch_size windows per forward pass."""
+    import torch
+    processor, model, device = models.get('audio')
+    logits = []
+    for start in range(0, len(windows), batch_size):
+        batch = windows[start:start + batch_size]
+        inputs = processor(batch, sampling_rate=AUDIO_SAMPLING_RATE, return_tensors="pt", padding=True).to(device)
+        with torch.inference_mode():
+            logits.append(model(**inputs).logits.float().cpu().numpy())
+    return np.concatenate(logits)
+
+
+def softmax(logits):
+    exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def score_images(models, pixels):
+    """Fake probability of each (size, size, 3) array; index 1 is "fake", as in app.analyze_image."""
+    return softmax(image_logits(models, pixels))[:, 1].tolist()
+
+
+def score_audio(models, windows, batch_size):
+    """Fake probability of each window."""
+    index = fake_index(models.get('audio')[1].config)
+    return softmax(audio_logits(models, windows, batch_size))[:, index].tolist()
+
+
+def _verdict(row, fake_confidence, revisions):
+    model = MODEL_NAMES[row["type"]]
+    return dict(
+        row,
+        result="fake" if fake_confidence > 0.5 else "real",
+        fake_confidence=fake_confidence,
+        real_confidence=1.0 - fake_confidence,
+        model=model,
+        revision=revisions.setdefault(model, model_revision(model)),
+    )
+
+
+class Batcher:
+    """Collects decoded files per type and scores them a batch at a time."""
+
+    def __init__(self, models, batch_size):
+        self.models = models
+        self.batch_size = batch_size
+        self.revisions = {}
+        self.images = []
+        self.audio = []
+        self.audio_windows = 0
+
+    def add(self, row, item):
+        """Rows ready to write: any that failed, plus a scored batch once one fills up."""
+        if item is None:
+            return [row]
+        if row["type"] == 'image':
+            self.images.append((row, item))
+            return self.flush_images() if len(self.images) >= self.batch_size else []
+        self.audio.append((row, item))
+        self.audio_windows += len(item)
+        return self.flush_audio() if self.audio_windows >= self.batch_size else []
+
+    def flush_images(self):
+        batch, self.images = self.images, []
+        if not batch:
+            return []
+        try:
+            scores = score_images(self.models, [pixels for _, pixels in batch])
+        except RuntimeError as e:
+            # A model that won't load fails its files, not the whole run; --retry-errors picks them up
+            return [dict(row, error=str(e)) for row, _ in batch]
+        return [_verdict(row, score, self.revisions) for (row, _), score in zip(batch, scores)]
+
+    def flush_audio(self):
+        batch, self.audio, self.audio_windows = self.audio, [], 0
+        if not batch:
+            return []
+        # Windows of several files share forward passes, then each file averages its own
+        try:
+            scores = score_audio(self.models, [window for _, windows in batch for window in windows], self.batch_size)
+        except RuntimeError as e:
+            return [dict(row, error=str(e)) for row, _ in batch]
+        rows, start = [], 0
+        for row, windows in batch:
+            mean = float(np.mean(scores[start:start + len(windows)]))
+            rows.append(dict(_verdict(row, mean, self.revisions), segments=len(windows)))
+            start += len(windows)
+        return rows
+
+    def flush(self):
+        return self.flush_images() + self.flush_audio()
+
+
+def _write(f, rows):
+    if rows:
+        f.write(''.join(json.dumps(row) + '\n' for row in rows))
+        f.flush()
+        os.fsync(f.fileno())
+    return len(rows)
+
+
+def score_files(paths, output, models=None, workers=1, batch_size=BATCH_SIZE, retry_errors=False, progress_s=30.0):
+    """Scores every path not already in output, appending rows to it; returns (scored, skipped)."""
+    done = completed(output, retry_errors)
+    skipped = 0
+
+    def todo():
+        nonlocal skipped
+        for path in paths:
+            if path in done:
+                skipped += 1
+            else:
+                done.add(path)  # A manifest that lists a file twice scores it once
+                yield path
+
+    batcher = Batcher(models or Models(), batch_size)
+    written = 0
+    start = last_report = time.perf_counter()
+    with open(output, 'a') as f:
+        for row, item in decoded(todo(), workers):
+            written += _write(f, batcher.add(row, item))
+            if progress_s and time.perf_counter() - last_report >= progress_s:
+                last_report = time.perf_counter()
+                print(f"{written} scored, {skipped} skipped, {written / (last_report - start):.1f} files/s")
+        written += _write(f, batcher.flush())
+    return written, skipped
+
+
+PARQUET_COLUMNS = [
+    ('path', 'string'), ('sha256', 'string'), ('type', 'string'), ('result', 'string'),
+    ('fake_confidence', 'float64'), ('real_confidence', 'float64'), ('segments', 'int32'),
+    ('model', 'string'), ('revision', 'string'), ('error', 'string'),
+]
+
+
+def _last_rows(output):
+    """Line number of the last row for each path, for outputs written before retries replaced error rows."""
+    last = {}
+    with open(output) as f:
+        for number, line in enumerate(f):
+            last[json.loads(line)["path"]] = number
+    return set(last.values())
+
+
+def to_parquet(output, parquet_path, rows_per_group=100000):
+    """Copies the JSONL output into a Parquet file, a row group at a time, one row per path (the latest)."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise SystemExit('Parquet output needs pyarrow (pip install pyarrow)')
+    schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in PARQUET_COLUMNS])
+    tmp_path = f'{parquet_path}.tmp'
+    with pq.ParquetWriter(tmp_path, schema) as writer, open(output) as f:
+        rows = []
+        latest = _last_rows(output)
+        for number, line in enumerate(f):
+            if number not in latest:
+                continue
+            row = json.loads(line)
+            rows.append({name: row.get(name) for name, _ in PARQUET_COLUMNS})
+            if len(rows) == rows_per_group:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+    os.replace(tmp_path, parquet_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score images and audio on disk with the Iris models')
+    parser.add_argument('root', nargs='?', help='Directory to walk for media files')
+    parser.add_argument('--manifest', help='File listing one media path per line, instead of a directory')
+    parser.add_argument('--output', required=True, help='JSONL output, appended to and used to resume')
+    parser.add_argument('--parquet', help='Also write the finished output as Parquet (needs pyarrow)')
+    parser.add_argument('--workers', type=int, default=max((os.cpu_count() or 2) - 1, 1),
+                        help='Decoder processes (0 decodes in the main process)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--threads', type=int, default=None, help='Torch threads for inference')
+    parser.add_argument('--retry-errors', action='store_true', help='Score files whose earlier row is an error again')
+    args = parser.parse_args(argv)
+    if bool(args.root) == bool(args.manifest):
+        parser.error('give either a directory or --manifest')
+
+    if args.threads:
+        import torch
+        torch.set_num_threads(args.threads)
+    paths = read_manifest(args.manifest) if args.manifest else walk(args.root)
+    start = time.perf_counter()
+    scored, skipped = score_files(paths, args.output, workers=args.workers, batch_size=args.batch_size,
+                                  retry_errors=args.retry_errors)
+    elapsed = time.perf_counter() - start
+    print(f"{scored} files scored in {elapsed:.1f}s ({scored / max(elapsed, 1e-9):.1f}/s), "
+          f"{skipped} already in {args.output}")
+    if args.parquet:
+        to_parquet(args.output, args.parquet)
+        print(f"Parquet written to {args.parquet}")
+
+
+if __name__ == '__main__':
+    main()
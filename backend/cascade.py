@@ -0,0 +1,59 @@
+import os
+import threading
+
+from metrics import record_cascade
+
+# Two-stage cascade for image analysis. Every image is first scored by a cheap
+# prefilter (the int8 image model at a low resolution). Only when the
+# prefilter's fake probability falls inside the uncertain band
+# (CASCADE_LOW, CASCADE_HIGH) is the image escalated to the full ViT pass.
+# With the embedding index on, clear fakes are escalated too: the index needs
+# the full model's embedding to store them and look up their near-duplicates.
+# benchmarks/cascade_eval.py shows the accuracy/throughput trade-off of a band
+# on labelled images.
+
+
+class Cascade:
+    def __init__(self, enabled, low, high, prefilter_size):
+        if not 0.0 <= low <= high <= 1.0:
+            raise ValueError(f"Cascade band must satisfy 0 <= low <= high <= 1, got ({low}, {high})")
+        self.enabled = enabled
+        self.low = low
+        self.high = high
+        self.prefilter_size = prefilter_size
+        self.decided = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def is_decisive(self, fake_confidence):
+        return fake_confidence <= self.low or fake_confidence >= self.high
+
+    def record(self, upload_type, escalated):
+        with self._lock:
+            if escalated:
+                self.escalated += 1
+            else:
+                self.decided += 1
+        record_cascade(upload_type, 'escalated' if escalated else 'decided')
+
+    def stats(self):
+        with self._lock:
+            total = self.decided + self.escalated
+            return {
+                'enabled': self.enabled,
+                'band': [self.low, self.high],
+                'prefilter_size': self.prefilter_size,
+                'decided': self.decided,
+                'escalated': self.escalated,
+                'escalation_rate': round(self.escalated / total, 4) if total else None,
+            }
+
+
+def build_cascade():
+    """Cascade for the image branch, from CASCADE_* environment variables."""
+    return Cascade(
+        enabled=os.environ.get('CASCADE_ENABLED', 'True').lower() in ('1', 'true', 'yes'),
+        low=float(os.environ.get('CASCADE_LOW', '0.05')),
+        high=float(os.environ.get('CASCADE_HIGH', '0.95')),
+        prefilter_size=int(os.environ.get('CASCADE_PREFILTER_SIZE', '112')),
+    )
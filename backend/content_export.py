@@ -0,0 +1,120 @@
+import csv
+import io
+import json
+import os
+import zlib
+
+from sqlalchemy import Text, or_, select, type_coerce
+
+# Streaming exports of the Content table (/api/export and `flask export-content`).
+#
+# Rows are read in keyset-ordered chunks of CHUNK_ROWS, each chunk in its own
+# short read transaction, and serialised as soon as it arrives, so memory
+# stays at one chunk however large the export is. A single cursor over the
+# whole table would keep one read transaction open for as long as the client
+# takes to download it: on SQLite that stops WAL checkpoints (the -wal file
+# grows until the export ends), on Postgres it holds back vacuum. Between
+# chunks the writer and checkpointer run freely; the keyset (id, or
+# (upload_date, id) for one user, which ix_content_user_date serves) means
+# each chunk seeks to where the last one stopped instead of re-reading it.
+
+CHUNK_ROWS = int(os.environ.get('EXPORT_CHUNK_ROWS', '5000'))
+GZIP_LEVEL = int(os.environ.get('EXPORT_GZIP_LEVEL', '6'))
+COLUMNS = ('id', 'user_id', 'file_name', 'file_path', 'file_size', 'upload_date', 'upload_type',
+           'upload_category', 'model_applied', 'is_deepfake', 'analysis')
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def iter_chunks(engine, content, user_id=None, since=None, until=None, chunk_rows=CHUNK_ROWS):
+    """Yields lists of Content rows, oldest first, filtered by user and upload_date in [since, until)."""
+    conditions = []
+    if user_id is not None:
+        keys = (content.c.upload_date, content.c.id)
+        conditions.append(content.c.user_id == user_id)
+    else:
+        keys = (content.c.id,)
+    if since is not None:
+        conditions.append(content.c.upload_date >= since)
+    if until is not None:
+        conditions.append(content.c.upload_date < until)
+
+    # The analysis comes back as the stored JSON text: it is written out as it is, not decoded and re-encoded
+    columns = [content.c[name] for name in COLUMNS[:-1]] + [type_coerce(content.c.analysis, Text).label('analysis')]
+    query = select(columns).where(*conditions).order_by(*keys).limit(chunk_rows)
+    last = None
+    while True:
+        chunk_query = query
+        if last is not None and len(keys) == 1:
+            chunk_query = query.where(content.c.id > last.id)
+        elif last is not None:
+            # Same shape as the history cursor: the first condition bounds the index range
+            chunk_query = query.where(
+                content.c.upload_date >= last.upload_date,
+                or_(content.c.upload_date > last.upload_date, content.c.id > last.id)
+            )
+        with engine.connect() as connection:
+            rows = connection.execute(chunk_query).fetchall()
+        if rows:
+            yield rows
+        if len(rows) < chunk_rows:
+            return
+        last = rows[-1]
+
+
+def record(row):
+    """Everything but the analysis as a dict, and the analysis as JSON text."""
+    (content_id, user_id, file_name, file_path, file_size, upload_date, upload_type,
+     upload_category, model_applied, is_deepfake, analysis) = row
+    return {
+        'id': content_id,
+        'user_id': user_id,
+        'file_name': file_name,
+        'file_path': file_path,
+        'file_size': file_size,
+        'upload_date': upload_date.isoformat() + 'Z' if upload_date else None,
+        'upload_type': upload_type.value,
+        'upload_category': upload_category,
+        'model_applied': model_applied.value,
+        'is_deepfake': is_deepfake,
+    }, analysis or 'null'
+
+
+def ndjson(chunks):
+    for rows in chunks:
+        lines = []
+        for row in rows:
+            fields, analysis = record(row)
+            lines.append(f'{json.dumps(fields, separators=(",", ":"))[:-1]},"analysis":{analysis}}}\n')
+        yield ''.join(lines).encode()
+
+
+def csv_rows(chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    yield buffer.getvalue().encode()
+    for rows in chunks:
+        buffer.seek(0)
+        buffer.truncate()
+        for row in rows:
+            fields, analysis = record(row)
+            # The analysis stays one JSON cell rather than an open-ended set of columns
+            writer.writerow([*fields.values(), analysis])
+        yield buffer.getvalue().encode()
+
+
+def gzipped(stream, level=GZIP_LEVEL):
+    """Compresses a byte stream as it goes; the output is a single gzip member."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for data in stream:
+        compressed = compressor.compress(data)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export(engine, content, output_format='ndjson', compress=False, **filters):
+    """The whole export as a stream of byte strings, ready for a Response or a file."""
+    serialise = ndjson if output_format == 'ndjson' else csv_rows
+    stream = serialise(iter_chunks(engine, content, **filters))
+    return gzipped(stream) if compress else stream
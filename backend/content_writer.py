@@ -0,0 +1,177 @@
+import os
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import DBAPIError
+
+from metrics import record_content_dropped, record_content_flush
+
+# Write-behind persistence of analysis results. Request threads only append a
+# row to an in-memory buffer; one background thread per worker process takes
+# whatever has accumulated and inserts it in a single transaction with one
+# executemany, once BATCH_ROWS rows are waiting or FLUSH_MS has passed since
+# the oldest of them arrived. A burst of requests therefore turns into a few
+# large commits from one connection instead of many small ones competing for
+# SQLite's single write lock.
+#
+# The buffer is bounded: when the database falls that far behind, new rows are
+# dropped (and counted) rather than letting memory grow without limit. A
+# transient error (a lock timeout, a Postgres serialization failure or a
+# dropped connection) puts the batch back at the front of the buffer for the
+# next attempt. Anything else, such as a missing table or column on a
+# database that hasn't been migrated, would fail the same way forever, so
+# the batch is dropped and counted instead.
+#
+# after_insert runs inside the same transaction as the insert (the app uses
+# it to keep the daily rollups in step, see rollups.py), so a batch and
+# everything derived from it commit or roll back together. before_insert runs
+# on the writer thread on each batch just before it is inserted (again for a
+# batch that was put back, so it must be idempotent): the app uses it to
+# write the uploads behind the rows to the blob store, so a row never names a
+# blob that isn't there yet and the request thread never waits for disk.
+
+BATCH_ROWS = int(os.environ.get('CONTENT_BATCH_ROWS', '100'))
+FLUSH_MS = float(os.environ.get('CONTENT_FLUSH_MS', '250'))
+MAX_PENDING = int(os.environ.get('CONTENT_MAX_PENDING', '10000'))
+ENABLED = os.environ.get('CONTENT_WRITER_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+# SQLite reports lock contention only in the message
+TRANSIENT_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+# Postgres serialization_failure and deadlock_detected
+TRANSIENT_PGCODES = ('40001', '40P01')
+
+
+def transient(error):
+    """Whether a database error is worth retrying the same batch for."""
+    if error.connection_invalidated:
+        return True
+    if getattr(error.orig, 'pgcode', None) in TRANSIENT_PGCODES:
+        return True
+    message = str(error.orig).lower()
+    return any(text in message for text in TRANSIENT_MESSAGES)
+
+
+class ContentWriter:
+    """Buffers rows for a table and inserts them in batches from a background thread."""
+
+    def __init__(self, table, engine, batch_rows=BATCH_ROWS, flush_ms=FLUSH_MS, max_pending=MAX_PENDING,
+                 before_insert=None, after_insert=None):
+        # engine is a zero-argument callable, so the app's engine can be created lazily
+        self.table = table
+        self._engine = engine
+        self.before_insert = before_insert
+        self.after_insert = after_insert
+        self.batch_rows = batch_rows
+        self.flush_s = flush_ms / 1000.0
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def submit(self, row):
+        """Queues one row; never waits for the database."""
+        with self._condition:
+            if len(self._pending) >= self.max_pending:
+                record_content_dropped('full')
+                return False
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append(row)
+            if len(self._pending) >= self.batch_rows:
+                self._condition.notify()
+        self._ensure_started()
+        return True
+
+    def pending(self):
+        with self._condition:
+            return len(self._pending)
+
+    def _ensure_started(self):
+        # Threads don't survive a fork, so each gunicorn worker starts its own
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._condition:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='content-writer', daemon=True)
+                self._thread.start()
+
+    def _take(self):
+        with self._condition:
+            batch = [self._pending.popleft() for _ in range(min(self.batch_rows, len(self._pending)))]
+            self._oldest = time.monotonic() if self._pending else None
+            return batch
+
+    def _requeue(self, batch):
+        with self._condition:
+            room = self.max_pending - len(self._pending)
+            if room < len(batch):
+                record_content_dropped('full', len(batch) - max(room, 0))
+                batch = batch[:max(room, 0)]
+            self._pending.extendleft(reversed(batch))
+            self._oldest = time.monotonic()
+
+    def _write(self, batch):
+        start = time.perf_counter()
+        try:
+            if self.before_insert is not None:
+                self.before_insert(batch)
+            with self._engine().begin() as connection:
+                # A list of parameter sets runs as a single executemany
+                connection.execute(self.table.insert(), batch)
+                if self.after_insert is not None:
+                    self.after_insert(connection, batch)
+        except DBAPIError as e:
+            if not transient(e):
+                print(f"Content writer: {len(batch)} rows dropped: {str(e)}")
+                record_content_flush(len(batch), time.perf_counter() - start, 'failed')
+                return True
+            print(f"Content writer: {len(batch)} rows deferred: {str(e)}")
+            record_content_flush(len(batch), time.perf_counter() - start, 'retried')
+            self._requeue(batch)
+            return False
+        except Exception as e:
+            print(f"Content writer: {len(batch)} rows dropped: {str(e)}")
+            record_content_flush(len(batch), time.perf_counter() - start, 'failed')
+            return True
+        record_content_flush(len(batch), time.perf_counter() - start, 'written')
+        return True
+
+    def flush(self):
+        """Writes everything buffered so far; returns False if a batch had to be put back."""
+        with self._flush_lock:
+            while True:
+                batch = self._take()
+                if not batch:
+                    return True
+                if not self._write(batch):
+                    return False
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._pending) >= self.batch_rows:
+                        break
+                    if self._pending and time.monotonic() - self._oldest >= self.flush_s:
+                        break
+                    timeout = self.flush_s - (time.monotonic() - self._oldest) if self._pending else None
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+            if not self.flush():
+                # The database is busy; let it recover before trying again
+                time.sleep(self.flush_s)
+
+    def close(self):
+        """Stops the thread and writes what is left; registered with atexit by the app."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join(timeout=5)
+        self.flush()
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+
+from metrics import record_tier_switch
+
+# Graceful degradation under sustained overload. Each degradable upload type
+# has a controller that looks at its inference queue (depth and recent queue
+# wait) on every request. When the queue has been overloaded for
+# DEGRADE_ENTER_AFTER_S it switches that type to the reduced tier: int8
+# weights, a smaller input resolution, shorter text or fewer video frames.
+# It only switches back once the queue has been calm for DEGRADE_EXIT_AFTER_S,
+# and the calm thresholds sit well below the overload ones, so the tier
+# doesn't flap while load hovers around a single threshold.
+
+FULL = 'full'
+REDUCED = 'reduced'
+TIERS = (FULL, REDUCED)
+
+# Audio has no cheaper model to fall back to
+DEGRADABLE_TYPES = ('image', 'video', 'text')
+
+
+def _env_float(name, default):
+    return float(os.environ.get(name, default))
+
+
+class TierController:
+    def __init__(self, name, enter_depth, exit_depth, enter_wait, exit_wait, enter_after, exit_after, forced=None):
+        self.name = name
+        self.enter_depth = enter_depth
+        self.exit_depth = exit_depth
+        self.enter_wait = enter_wait
+        self.exit_wait = exit_wait
+        self.enter_after = enter_after
+        self.exit_after = exit_after
+        self.forced = forced
+        self.tier = FULL
+        self.switches = 0
+        self._pending_since = None
+        self._lock = threading.Lock()
+
+    def update(self, depth, wait):
+        """Feed the current queue depth and recent queue wait (s); returns the tier to use."""
+        if self.forced:
+            return self.forced
+        now = time.monotonic()
+        with self._lock:
+            if self.tier == FULL:
+                want_switch = depth >= self.enter_depth or wait >= self.enter_wait
+                hold = self.enter_after
+            else:
+                want_switch = depth <= self.exit_depth and wait <= self.exit_wait
+                hold = self.exit_after
+
+            if not want_switch:
+                self._pending_since = None
+            elif self._pending_since is None:
+                self._pending_since = now
+            if self._pending_since is not None and now - self._pending_since >= hold:
+                self.tier = REDUCED if self.tier == FULL else FULL
+                self.switches += 1
+                self._pending_since = None
+                print(f"{self.name}: switched to {self.tier} tier (queue depth {depth}, wait {wait * 1000:.0f}ms)")
+                record_tier_switch(self.name, self.tier)
+            return self.tier
+
+    def state(self):
+        with self._lock:
+            return {'tier': self.forced or self.tier, 'forced': bool(self.forced), 'switches': self.switches}
+
+
+def build_controllers():
+    """One controller per degradable upload type, tuned with DEGRADE_* environment variables."""
+    forced = os.environ.get('DEGRADE_FORCE_TIER') or None
+    if os.environ.get('DEGRADE_ENABLED', 'True').lower() not in ('1', 'true', 'yes'):
+        forced = FULL
+    if forced not in (None,) + TIERS:
+        raise ValueError(f"DEGRADE_FORCE_TIER must be one of {TIERS}, got {forced!r}")
+    return {
+        upload_type: TierController(
+            upload_type,
+            enter_depth=_env_float('DEGRADE_ENTER_DEPTH', 4),
+            exit_depth=_env_float('DEGRADE_EXIT_DEPTH', 1),
+            enter_wait=_env_float('DEGRADE_ENTER_WAIT_S', 2.0),
+            exit_wait=_env_float('DEGRADE_EXIT_WAIT_S', 0.5),
+            enter_after=_env_float('DEGRADE_ENTER_AFTER_S', 5),
+            exit_after=_env_float('DEGRADE_EXIT_AFTER_S', 30),
+            forced=forced,
+        )
+        for upload_type in DEGRADABLE_TYPES
+    }
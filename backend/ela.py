@@ -0,0 +1,79 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+# Error Level Analysis for the image path. The decoded image is saved again
+# as JPEG at a fixed quality, in memory, and compared with itself pixel by
+# pixel. Regions that were already compressed at that quality barely change;
+# pasted or retouched regions with a different compression history stand
+# out with a higher error level than the rest of the picture.
+
+QUALITY = int(os.environ.get('ELA_QUALITY', '90'))
+# Regional statistics are taken over a REGIONS x REGIONS grid
+REGIONS = int(os.environ.get('ELA_REGIONS', '8'))
+# Longest side of the optional heatmap, in cells
+HEATMAP_SIZE = int(os.environ.get('ELA_HEATMAP_SIZE', '64'))
+# A region this many robust deviations above the median region is suspicious
+Z_LIMIT = float(os.environ.get('ELA_Z_LIMIT', '3.5'))
+ENABLED = os.environ.get('ELA_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+
+
+def error_levels(image, pixels=None, quality=QUALITY):
+    """Per-pixel error level (max over channels) between an RGB image and its JPEG re-save, as uint8."""
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    buffer.seek(0)
+    # Callers that already hold the pixels as an array pass them in to skip a copy
+    original = np.asarray(image) if pixels is None else pixels
+    resaved = Image.open(buffer)
+    resaved = np.asarray(resaved if resaved.mode == 'RGB' else resaved.convert('RGB'))
+    # uint8 |a - b| without widening: the larger minus the smaller never wraps
+    diff = np.maximum(original, resaved) - np.minimum(original, resaved)
+    return np.maximum(np.maximum(diff[:, :, 0], diff[:, :, 1]), diff[:, :, 2])
+
+
+def _cell_means(levels, rows, cols):
+    """Mean of levels over a rows x cols grid (edges that don't divide evenly are dropped)."""
+    height, width = levels.shape[0] // rows, levels.shape[1] // cols
+    cropped = levels[:rows * height, :cols * width]
+    # Integer sums are several times faster than a float mean over the same axes
+    return cropped.reshape(rows, height, cols, width).sum(axis=(1, 3), dtype=np.uint64) / (height * width)
+
+
+def _percentile(histogram, total, q):
+    return int(np.searchsorted(np.cumsum(histogram), total * q))
+
+
+def analyze(image, pixels=None, heatmap=False, quality=QUALITY, regions=REGIONS, heatmap_size=HEATMAP_SIZE, z_limit=Z_LIMIT):
+    """ELA summary of a decoded PIL RGB image; heatmap=True adds a downsampled error-level grid."""
+    levels = error_levels(image, pixels, quality)
+    # Exact percentiles from a 256-bin histogram, much cheaper than sorting every pixel
+    histogram = np.bincount(levels.ravel(), minlength=256)
+    total = levels.size
+    mean = float(np.dot(histogram, np.arange(256)) / total)
+
+    rows, cols = min(regions, levels.shape[0]), min(regions, levels.shape[1])
+    region_means = _cell_means(levels, rows, cols)
+    median = float(np.median(region_means))
+    mad = float(np.median(np.abs(region_means - median))) * 1.4826
+    # Re-saving at the original quality leaves almost no error, so keep at least one level of spread
+    suspicious = region_means > median + z_limit * max(mad, 1.0)
+
+    result = {
+        "quality": quality,
+        "mean_error": round(mean, 3),
+        "p99_error": _percentile(histogram, total, 0.99),
+        "max_error": int(np.flatnonzero(histogram)[-1]),
+        # Brightest region against the typical one; untouched images stay close to 1
+        "region_contrast": round(float(region_means.max()) / max(median, 1.0), 3),
+        "suspicious_regions": int(suspicious.sum()),
+        "regions": np.round(region_means, 2).tolist(),
+    }
+    if heatmap:
+        scale = heatmap_size / max(levels.shape)
+        size = (max(1, min(levels.shape[0], round(levels.shape[0] * scale))),
+                max(1, min(levels.shape[1], round(levels.shape[1] * scale))))
+        result["heatmap"] = np.round(_cell_means(levels, *size), 1).tolist()
+    return result
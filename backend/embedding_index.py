@@ -0,0 +1,334 @@
+"""Nearest-neighbour index over the image model's CLS embeddings.
+
+Every fully analysed image appends its L2-normalised CLS embedding (float16)
+to vectors.f16 and a fixed-size record (content SHA-256, verdict, fake
+probability, time) to records.bin. Both files are append-only and read
+through np.memmap, so the index costs page cache rather than process memory
+and every gunicorn worker shares it. Appends from different workers are
+serialised with an flock.
+
+Lookups use an inverted file (IVF): spherical k-means centroids split the
+vectors into lists, and a query only scans the lists of its `nprobe`
+closest centroids. The lists are stored as one id array sorted by list
+(order.npy) plus list offsets, so scanning a list is a single slice.
+Vectors appended since the last build (the tail) are scanned brute force;
+once the tail outgrows EMBEDDING_TAIL_LIMIT a background rebuild assigns it
+to the existing centroids. The centroids themselves are retrained whenever
+the index has doubled since they were trained; past
+EMBEDDING_AUTO_RETRAIN_MAX vectors that is too much work to do next to
+live traffic, so big indexes are retrained offline with `rebuild`.
+
+    python embedding_index.py stats
+    python embedding_index.py rebuild [--retrain]
+"""
+import argparse
+import collections
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are only serialised within a process
+    fcntl = None
+
+INDEX_DIR = os.environ.get('EMBEDDING_INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_index'))
+ENABLED = os.environ.get('EMBEDDING_INDEX_ENABLED', 'True').lower() in ('1', 'true', 'yes')
+# Centroid lists scanned per query; more is slower but misses fewer neighbours
+NPROBE = int(os.environ.get('EMBEDDING_NPROBE', '16'))
+# Unindexed vectors scanned brute force before a rebuild is started
+TAIL_LIMIT = int(os.environ.get('EMBEDDING_TAIL_LIMIT', '20000'))
+TOP_K = int(os.environ.get('EMBEDDING_TOP_K', '5'))
+MIN_SIMILARITY = float(os.environ.get('EMBEDDING_MIN_SIMILARITY', '0.9'))
+AUTO_RETRAIN_MAX = int(os.environ.get('EMBEDDING_AUTO_RETRAIN_MAX', '1000000'))
+
+RECORD = np.dtype([('digest', 'S32'), ('fake_confidence', '<f4'), ('label', 'u1'), ('created', '<f8')])
+FAKE, REAL = 1, 0
+
+# Scratch memory for one chunk of vector x centroid similarities; at 65536 lists a
+# fixed row count would need gigabytes, so the rows per chunk follow from this
+ASSIGN_BUDGET = int(os.environ.get('EMBEDDING_ASSIGN_BUDGET_MB', '64')) * 1024 * 1024
+
+
+def _normalise(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def _assign(vectors, centroids):
+    """Closest centroid (by cosine) for each row, in chunks so memory stays flat."""
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    rows = max(1, ASSIGN_BUDGET // (4 * (len(centroids) + centroids.shape[1])))
+    for start in range(0, len(vectors), rows):
+        chunk = np.asarray(vectors[start:start + rows], dtype=np.float32)
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def train_centroids(vectors, lists, iterations=10, seed=0):
+    """Spherical k-means on (a sample of) the vectors; returns (lists, dim) unit centroids."""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), lists * 32)
+    sample = _normalise(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=lists)
+        # Empty lists restart from a random sample point
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+        centroids = _normalise(sums)
+    return centroids
+
+
+def default_lists(count):
+    return int(np.clip(4 * np.sqrt(count), 16, 65536))
+
+
+class EmbeddingIndex:
+    def __init__(self, dim, directory=INDEX_DIR, nprobe=NPROBE, tail_limit=TAIL_LIMIT):
+        self.dim = dim
+        self.directory = directory
+        self.nprobe = nprobe
+        self.tail_limit = tail_limit
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, 'vectors.f16')
+        self._records_path = os.path.join(directory, 'records.bin')
+        self._lock_path = os.path.join(directory, 'append.lock')
+        self._lock = threading.Lock()
+        self._views = (0, None, None)
+        self._ivf = (None, None)
+        self._rebuilding = False
+        # Digests this process added lately; repeat uploads of the same file aren't stored twice
+        self._recent = collections.OrderedDict()
+
+        meta_path = os.path.join(directory, 'index.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = json.load(f)['dim']
+            if stored != dim:
+                raise ValueError(f"Embedding index at {directory} holds {stored}-d vectors, the model gives {dim}-d")
+        else:
+            with open(meta_path, 'w') as f:
+                json.dump({'dim': dim}, f)
+
+    def __len__(self):
+        row = self.dim * 2
+        try:
+            vectors = os.path.getsize(self._vectors_path) // row
+            records = os.path.getsize(self._records_path) // RECORD.itemsize
+        except OSError:
+            return 0
+        # Records are written second, so a half-finished append is never visible
+        return min(vectors, records)
+
+    def _open(self):
+        """(count, vectors memmap, records memmap), remapped only when other appends have grown the files."""
+        count = len(self)
+        with self._lock:
+            if count != self._views[0]:
+                if count:
+                    vectors = np.memmap(self._vectors_path, dtype=np.float16, mode='r', shape=(count, self.dim))
+                    records = np.memmap(self._records_path, dtype=RECORD, mode='r', shape=(count,))
+                else:
+                    vectors = records = None
+                self._views = (count, vectors, records)
+            return self._views
+
+    def _load_ivf(self):
+        """Current IVF build as a dict of arrays, or None before the first build."""
+        pointer = os.path.join(self.directory, 'ivf.json')
+        try:
+            with open(pointer) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            if self._ivf[0] != info['version']:
+                path = os.path.join(self.directory, info['version'])
+                try:
+                    ivf = dict(info, **{
+                        name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                        for name in ('centroids', 'assign', 'order', 'offsets')
+                    })
+                except OSError:
+                    # A newer rebuild deleted this build between reading the pointer and
+                    # opening it; the mapping already held is still valid, keep serving it
+                    return self._ivf[1]
+                ivf['centroids'] = np.asarray(ivf['centroids'], dtype=np.float32)
+                self._ivf = (info['version'], ivf)
+            return self._ivf[1]
+
+    def add(self, vector, digest, fake_confidence, label):
+        """Append one embedding; returns its id, or None if this digest was added recently."""
+        with self._lock:
+            if digest in self._recent:
+                self._recent.move_to_end(digest)
+                return None
+            self._recent[digest] = True
+            if len(self._recent) > 10000:
+                self._recent.popitem(last=False)
+        vector = _normalise(vector).astype(np.float16).reshape(self.dim)
+        record = np.array([(bytes.fromhex(digest), fake_confidence, label, time.time())], dtype=RECORD)
+        with open(self._lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Trim anything a crashed writer left half-written so rows stay aligned
+                count = len(self)
+                with open(self._vectors_path, 'ab') as f:
+                    f.truncate(count * self.dim * 2)
+                    f.write(vector.tobytes())
+                with open(self._records_path, 'ab') as f:
+                    f.truncate(count * RECORD.itemsize)
+                    f.write(record.tobytes())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return count
+
+    def search(self, vector, k=TOP_K, min_similarity=MIN_SIMILARITY, label=FAKE):
+        """Up to k most similar stored images with the given label, as dicts for the response."""
+        count, vectors, records = self._open()
+        if not count:
+            return []
+        query = _normalise(vector).reshape(self.dim)
+        ivf = self._load_ivf()
+
+        sealed = 0
+        candidates = []
+        if ivf is not None:
+            sealed = min(ivf['sealed'], count)
+            probes = min(self.nprobe, len(ivf['centroids']))
+            closest = np.argpartition(-(ivf['centroids'] @ query), probes - 1)[:probes]
+            offsets = ivf['offsets']
+            candidates = [ivf['order'][offsets[c]:offsets[c + 1]] for c in closest]
+        candidates.append(np.arange(sealed, count))
+        # Sorted ids turn the gather into forward reads through the memmap
+        ids = np.sort(np.concatenate(candidates))
+        ids = ids[records['label'][ids] == label]
+        if not len(ids):
+            return []
+
+        similarity = np.asarray(vectors[ids], dtype=np.float32) @ query
+        best = np.argsort(-similarity)[:k]
+        return [
+            {
+                'sha256': records[i]['digest'].hex(),
+                'similarity': round(float(s), 4),
+                'fake_confidence': round(float(records[i]['fake_confidence']), 4),
+                'analyzed_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(float(records[i]['created']))),
+            }
+            for i, s in zip(ids[best], similarity[best]) if s >= min_similarity
+        ]
+
+    def needs_rebuild(self):
+        ivf = self._load_ivf()
+        return len(self) - (ivf['sealed'] if ivf else 0) > self.tail_limit
+
+    def rebuild(self, retrain=False, lists=None, retrain_max=None):
+        """Fold the tail into the IVF lists; retrain the centroids when asked or the index has doubled."""
+        count, vectors, _ = self._open()
+        if not count:
+            return None
+        ivf = self._load_ivf()
+        lists = lists or default_lists(count)
+        doubled = ivf is not None and count >= 2 * ivf['trained_on'] and (retrain_max is None or count <= retrain_max)
+        if ivf is None or retrain or doubled:
+            centroids = train_centroids(vectors, min(lists, count))
+            assignment = _assign(vectors, centroids)
+            trained_on = count
+        else:
+            # Only the new vectors need a list; existing assignments stay valid
+            centroids, sealed = ivf['centroids'], ivf['sealed']
+            assignment = np.concatenate([np.asarray(ivf['assign'][:sealed]), _assign(vectors[sealed:count], centroids)])
+            trained_on = ivf['trained_on']
+
+        order = np.argsort(assignment, kind='stable').astype(np.int64)
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))]).astype(np.int64)
+        version = f'ivf-{count}-{int(time.time() * 1000)}'
+        path = os.path.join(self.directory, version)
+        os.makedirs(path)
+        for name, array in (('centroids', centroids), ('assign', assignment), ('order', order), ('offsets', offsets)):
+            np.save(os.path.join(path, f'{name}.npy'), array)
+
+        # Swap the pointer atomically; readers still holding the old build keep their mappings
+        pointer = os.path.join(self.directory, 'ivf.json')
+        tmp_path = f'{pointer}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'version': version, 'sealed': count, 'trained_on': trained_on}, f)
+        os.replace(tmp_path, pointer)
+        for entry in os.listdir(self.directory):
+            if entry.startswith('ivf-') and entry != version:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+        return {'vectors': count, 'lists': len(centroids), 'retrained': trained_on == count}
+
+    def rebuild_in_background(self):
+        """Start a rebuild on a daemon thread unless one is already running here or in another worker."""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_exclusive, daemon=True, name='embedding-rebuild').start()
+
+    def _rebuild_exclusive(self):
+        try:
+            with open(os.path.join(self.directory, 'rebuild.lock'), 'a') as lock_file:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        return
+                if self.needs_rebuild():
+                    start = time.perf_counter()
+                    outcome = self.rebuild(retrain_max=AUTO_RETRAIN_MAX)
+                    print(f"Embedding index rebuilt in {time.perf_counter() - start:.1f}s: {outcome}")
+        except Exception as e:
+            print(f"Embedding index rebuild failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def stats(self):
+        count, _, records = self._open()
+        ivf = self._load_ivf()
+        return {
+            'vectors': count,
+            'fakes': int(np.count_nonzero(records['label'] == FAKE)) if count else 0,
+            'lists': len(ivf['centroids']) if ivf else 0,
+            'indexed': min(ivf['sealed'], count) if ivf else 0,
+            'nprobe': self.nprobe,
+        }
+
+
+def _open_existing(directory):
+    with open(os.path.join(directory, 'index.json')) as f:
+        return EmbeddingIndex(json.load(f)['dim'], directory)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Maintain the image embedding index')
+    parser.add_argument('--dir', default=INDEX_DIR, help='Index directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('stats', help='Show index size and IVF state')
+    rebuild = commands.add_parser('rebuild', help='Fold new vectors into the IVF lists')
+    rebuild.add_argument('--retrain', action='store_true', help='Retrain the centroids from scratch')
+    rebuild.add_argument('--lists', type=int, help='Number of IVF lists (default 4 * sqrt(vectors))')
+    args = parser.parse_args(argv)
+
+    index = _open_existing(args.dir)
+    if args.command == 'rebuild':
+        start = time.perf_counter()
+        print(index.rebuild(retrain=args.retrain, lists=args.lists))
+        print(f"Done in {time.perf_counter() - start:.1f}s")
+    print(json.dumps(index.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
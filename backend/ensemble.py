@@ -0,0 +1,117 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeout
+from typing import Callable, NamedTuple
+
+from scheduler import DeadlineExceeded
+
+# Image ensemble: several detectors score the same image on a thread pool
+# (torch releases the GIL inside forward passes, so they really do overlap)
+# and their fake probabilities are combined as a weighted average.
+#
+# Results are folded in as they arrive. Once the weights still outstanding
+# could no longer move the average across the decision threshold, the answer
+# can't change, so the remaining runs are cancelled and the request returns.
+# A cancelled run that has already started finishes in the background; only
+# runs still waiting for a pool thread are actually skipped.
+
+
+class Member(NamedTuple):
+    name: str
+    weight: float
+    predict: Callable  # PIL image -> fake probability
+
+
+def parse_members(spec):
+    """'dima:1,other:0.5' -> [('dima', 1.0), ('other', 0.5)]; a missing weight means 1."""
+    members = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition(':')
+        members.append((name.strip(), float(weight) if weight else 1.0))
+    return members
+
+
+class Ensemble:
+    def __init__(self, members, threshold=0.5, early_exit=True):
+        if not members:
+            raise ValueError("An ensemble needs at least one member")
+        self.members = list(members)
+        self.threshold = threshold
+        self.early_exit = early_exit
+        self._pool = ThreadPoolExecutor(max_workers=len(self.members), thread_name_prefix='ensemble')
+
+    def _decided(self, weighted, done_weight, remaining_weight):
+        # Bounds on the final average if every outstanding member said 0 or 1
+        total = done_weight + remaining_weight
+        lowest = weighted / total
+        highest = (weighted + remaining_weight) / total
+        return lowest >= self.threshold or highest < self.threshold
+
+    @staticmethod
+    def _timed(predict, image):
+        start = time.perf_counter()
+        fake = predict(image)
+        return fake, (time.perf_counter() - start) * 1000
+
+    def run(self, image, deadline=None):
+        """Score an image with every member; returns (fake probability, details for the response)."""
+        start = time.perf_counter()
+        futures = {self._pool.submit(self._timed, member.predict, image): member for member in self.members}
+        remaining_weight = sum(member.weight for member in self.members)
+        weighted = done_weight = 0.0
+        outcomes = {member.name: {'model': member.name, 'weight': member.weight, 'status': 'cancelled'}
+                    for member in self.members}
+        early_exit = False
+
+        pending = set(futures)
+        try:
+            timeout = max(0.0, deadline.remaining()) if deadline else None
+            for future in as_completed(futures, timeout=timeout):
+                pending.discard(future)
+                member = futures[future]
+                remaining_weight -= member.weight
+                outcome = outcomes[member.name]
+                try:
+                    fake, latency_ms = future.result()
+                except Exception as e:
+                    # One broken detector shouldn't sink the others
+                    print(f"Ensemble member {member.name} failed: {str(e)}")
+                    outcome.update(status='failed', error=str(e))
+                    continue
+                weighted += member.weight * fake
+                done_weight += member.weight
+                outcome.update(status='done', fake_confidence=fake, latency_ms=round(latency_ms, 1))
+
+                if self.early_exit and pending and self._decided(weighted, done_weight, remaining_weight):
+                    early_exit = True
+                    break
+        except FutureTimeout:
+            raise DeadlineExceeded('Request deadline passed during ensemble analysis')
+        finally:
+            for future in pending:
+                future.cancel()
+
+        if not done_weight:
+            raise RuntimeError("Every ensemble member failed")
+        fake_confidence = weighted / done_weight
+        for outcome in outcomes.values():
+            if outcome['status'] == 'done':
+                # Share of the final probability; the contributions sum to fake_confidence
+                outcome['contribution'] = outcome['weight'] * outcome['fake_confidence'] / done_weight
+        return fake_confidence, {
+            'members': list(outcomes.values()),
+            'early_exit': early_exit,
+            'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+        }
+
+
+def ensemble_settings():
+    """(members as [(name, weight)], threshold, early_exit) from ENSEMBLE_* environment variables."""
+    return (
+        parse_members(os.environ.get('ENSEMBLE_MODELS', 'dima:1')),
+        float(os.environ.get('ENSEMBLE_THRESHOLD', '0.5')),
+        os.environ.get('ENSEMBLE_EARLY_EXIT', 'True').lower() in ('1', 'true', 'yes'),
+    )
@@ -0,0 +1,114 @@
+import base64
+import io
+import json
+import os
+import threading
+
+import numpy as np
+from PIL import Image
+
+# Explainability heatmaps for the image ViT from attention rollout (Abnar &
+# Zuidema, 2020). The attention maps come out of the same forward pass that
+# produced the verdict (output_attentions=True), so unlike Grad-CAM there is
+# no second, backward pass. Each layer's head-averaged attention has the
+# residual connection added back in (0.5 * A + 0.5 * I), the layers are
+# multiplied together, and the CLS token's row says how much every patch fed
+# into the classification.
+#
+# Explained results are kept on disk, keyed by the content hash, the analysis
+# options and the model revision, so viewing the same image again returns
+# the stored heatmap without running the model at all.
+
+# Side of the PNG heatmap sent to the client, in pixels
+PNG_SIZE = int(os.environ.get('EXPLAIN_PNG_SIZE', '112'))
+CACHE_DIR = os.environ.get('EXPLAIN_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'explain_cache'))
+CACHE_MAX_ENTRIES = int(os.environ.get('EXPLAIN_CACHE_MAX_ENTRIES', '5000'))
+
+
+def attention_rollout(attentions):
+    """(grid, grid) patch relevance in [0, 1] for the first image, from per-layer (batch, heads, T, T) attentions."""
+    layers = np.stack([layer[0].float().mean(dim=0).cpu().numpy() for layer in attentions])
+    tokens = layers.shape[-1]
+    rollout = np.eye(tokens, dtype=np.float32)
+    for attention in layers:
+        attention = 0.5 * attention + 0.5 * np.eye(tokens, dtype=np.float32)
+        attention /= attention.sum(axis=-1, keepdims=True)
+        rollout = attention @ rollout
+    # CLS row without the CLS column; the remaining tokens are a square patch grid
+    relevance = rollout[0, 1:]
+    grid = int(round(np.sqrt(relevance.size)))
+    relevance = relevance[:grid * grid].reshape(grid, grid)
+    relevance -= relevance.min()
+    return relevance / max(float(relevance.max()), 1e-12)
+
+
+def heatmap_png(relevance, size=PNG_SIZE):
+    """Greyscale PNG data URI of a [0, 1] relevance grid, scaled up to size x size."""
+    image = Image.fromarray(np.uint8(np.round(relevance * 255)), 'L').resize((size, size), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def explanation(attentions, size=PNG_SIZE):
+    relevance = attention_rollout(attentions)
+    return {
+        "method": "attention_rollout",
+        "grid": np.round(relevance, 3).tolist(),
+        "png": heatmap_png(relevance, size),
+    }
+
+
+class ExplanationCache:
+    """Explained results as JSON files, shared by every worker on the host; oldest entries are pruned."""
+
+    def __init__(self, directory=CACHE_DIR, max_entries=CACHE_MAX_ENTRIES):
+        self.directory = directory
+        self.max_entries = max_entries
+        self._writes = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                result = json.load(f)
+        except (OSError, ValueError):
+            return None
+        try:
+            # Reads count as use, so pruning drops what nobody has looked at for longest
+            os.utime(path)
+        except OSError:
+            pass
+        return result
+
+    def put(self, key, result):
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        if prune:
+            self._prune()
+
+    def _prune(self):
+        try:
+            with os.scandir(self.directory) as entries:
+                files = [(entry.stat().st_mtime, entry.path) for entry in entries if entry.name.endswith('.json')]
+        except OSError:
+            return
+        if len(files) <= self.max_entries:
+            return
+        files.sort()
+        for _, path in files[:len(files) - self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
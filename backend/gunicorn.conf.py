@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+
+# Picked up automatically by `gunicorn app:app` (Procfile, render.yaml).
+# Workers share a Prometheus multiprocess directory so /api/metrics reports
+# totals for the whole server instead of a single worker.
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+# Threaded workers let requests reach the in-app inference queues (scheduler.py),
+# where they can be shed with Retry-After, instead of waiting in the listen backlog
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# Must be set before prometheus_client is imported by the app
+prometheus_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'iris-prometheus'),
+)
+
+
+def on_starting(server):
+    # Samples left over from a previous run would be merged into the new totals
+    shutil.rmtree(prometheus_dir, ignore_errors=True)
+    os.makedirs(prometheus_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+    except ImportError:
+        pass
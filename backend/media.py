@@ -0,0 +1,93 @@
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+
+import numpy as np
+
+# Decoding for the audio and video branches of /api/analyze. Both hand back
+# data in pieces so the caller can stop between pieces (see scheduler.Deadline).
+try:
+    from pydub import AudioSegment
+except ImportError:  # app.py already warns about this; WAV still works
+    AudioSegment = None
+
+FFMPEG = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+
+
+class MediaUnavailable(Exception):
+    """The tool needed to decode this kind of media isn't installed."""
+
+
+def _decode_wav(file_bytes, sampling_rate):
+    with wave.open(io.BytesIO(file_bytes)) as wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+    if width != 2:
+        raise ValueError(f'Unsupported WAV sample width: {width * 8} bit')
+    samples = np.frombuffer(raw, dtype='<i2').reshape(-1, channels).mean(axis=1) / 32768.0
+    if rate != sampling_rate:
+        positions = np.arange(0, len(samples), rate / sampling_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return samples.astype(np.float32)
+
+
+def decode_audio(file_bytes, sampling_rate=16000):
+    """Mono float32 waveform in [-1, 1] at sampling_rate."""
+    if AudioSegment is None:
+        return _decode_wav(file_bytes, sampling_rate)
+    segment = AudioSegment.from_file(io.BytesIO(file_bytes))
+    segment = segment.set_channels(1).set_frame_rate(sampling_rate).set_sample_width(2)
+    return np.array(segment.get_array_of_samples(), dtype=np.float32) / 32768.0
+
+
+def audio_windows(waveform, window, hop=None):
+    """Yields (start, chunk) windows of `window` samples; a short clip is one window."""
+    hop = hop or window
+    if len(waveform) <= window:
+        yield 0, waveform
+        return
+    for start in range(0, len(waveform), hop):
+        chunk = waveform[start:start + window]
+        # Skip a tail too short to say anything about
+        if start and len(chunk) < window // 4:
+            return
+        yield start, chunk
+
+
+def iter_video_frames(file_bytes, fps=1.0, size=224, max_frames=None):
+    """Yields RGB frames (size x size x 3, uint8) sampled at `fps` using ffmpeg.
+
+    ffmpeg runs as a subprocess and frames are read from its stdout as they are
+    produced, so closing the generator early stops the decode as well.
+    """
+    if shutil.which(FFMPEG) is None:
+        raise MediaUnavailable('ffmpeg is not installed')
+
+    # Containers like MP4 keep their index at the end, so ffmpeg needs a seekable file
+    with tempfile.NamedTemporaryFile(suffix='.video') as source:
+        source.write(file_bytes)
+        source.flush()
+        command = [
+            FFMPEG, '-nostdin', '-loglevel', 'error', '-i', source.name,
+            '-vf', f'fps={fps},scale={size}:{size}',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+        ]
+        if max_frames:
+            command += ['-frames:v', str(max_frames)]
+        command.append('pipe:1')
+
+        frame_bytes = size * size * 3
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            while True:
+                data = process.stdout.read(frame_bytes)
+                if len(data) < frame_bytes:
+                    break
+                yield np.frombuffer(data, dtype=np.uint8).reshape(size, size, 3)
+        finally:
+            process.kill()
+            process.stdout.close()
+            process.wait()
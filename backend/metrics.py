@@ -0,0 +1,298 @@
+import os
+import time
+import resource
+from contextlib import contextmanager
+
+# Prometheus metrics for the API. When PROMETHEUS_MULTIPROC_DIR is set (see
+# gunicorn.conf.py) every worker writes its samples to files in that directory
+# and /api/metrics merges them, so a scrape sees the whole server rather than
+# whichever worker happened to answer.
+metrics_enabled = False
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        Counter,
+        Gauge,
+        Histogram,
+        generate_latest,
+        multiprocess,
+    )
+    metrics_enabled = True
+    print("Prometheus client successfully imported!")
+except ImportError:
+    print("WARNING: prometheus_client import failed. /api/metrics will be disabled.")
+
+# Pipeline stages are mostly sub-second, model loads take tens of seconds
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MODEL_LOAD_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+if metrics_enabled:
+    STAGE_LATENCY = Histogram(
+        'iris_stage_duration_seconds',
+        'Time spent in each analysis pipeline stage',
+        ['stage', 'upload_type', 'model'],
+        buckets=STAGE_BUCKETS,
+    )
+    REQUEST_COUNT = Counter(
+        'iris_requests_total',
+        'HTTP requests by endpoint and response status',
+        ['endpoint', 'method', 'status'],
+    )
+    REQUEST_LATENCY = Histogram(
+        'iris_request_duration_seconds',
+        'End-to-end HTTP request latency',
+        ['endpoint', 'method'],
+        buckets=REQUEST_BUCKETS,
+    )
+    IN_FLIGHT = Gauge(
+        'iris_requests_in_flight',
+        'Requests currently being handled',
+        ['endpoint'],
+        multiprocess_mode='livesum',
+    )
+    MODEL_LOAD_LATENCY = Histogram(
+        'iris_model_load_duration_seconds',
+        'Time taken to load each model',
+        ['model', 'outcome'],
+        buckets=MODEL_LOAD_BUCKETS,
+    )
+    COALESCED = Counter(
+        'iris_singleflight_requests_total',
+        'Analyses by whether they ran the model or shared a concurrent identical run',
+        ['upload_type', 'outcome'],
+    )
+    QUEUE_DEPTH = Gauge(
+        'iris_queue_depth',
+        'Requests waiting for a model slot',
+        ['upload_type'],
+        multiprocess_mode='livesum',
+    )
+    QUEUE_WAIT = Histogram(
+        'iris_queue_wait_seconds',
+        'Time requests spent waiting for a model slot',
+        ['upload_type'],
+        buckets=STAGE_BUCKETS,
+    )
+    TENANT_QUEUE_WAIT = Histogram(
+        'iris_tenant_queue_wait_seconds',
+        'Time requests spent waiting for a model slot, per tenant and lane',
+        ['upload_type', 'tenant', 'lane'],
+        buckets=STAGE_BUCKETS,
+    )
+    QUEUE_SHED = Counter(
+        'iris_queue_shed_total',
+        'Requests dropped by admission control before reaching a model',
+        ['upload_type', 'reason'],
+    )
+    CANCELLED = Counter(
+        'iris_analysis_cancelled_total',
+        'Analyses abandoned because their deadline passed or the client disconnected',
+        ['upload_type', 'reason'],
+    )
+    TIER_REQUESTS = Counter(
+        'iris_analysis_tier_total',
+        'Analyses by the model tier that served them',
+        ['upload_type', 'tier'],
+    )
+    CASCADE = Counter(
+        'iris_cascade_total',
+        'Images decided by the prefilter or escalated to the full model',
+        ['upload_type', 'outcome'],
+    )
+    EXPLANATION_CACHE = Counter(
+        'iris_explanation_cache_total',
+        'Explained analyses served from the explanation cache or computed',
+        ['upload_type', 'outcome'],
+    )
+    BLOCKLIST_HITS = Counter(
+        'iris_blocklist_hits_total',
+        'Uploads answered from the known-fake blocklist, by the hash that matched',
+        ['upload_type', 'match'],
+    )
+    CONTENT_ROWS = Counter(
+        'iris_content_rows_total',
+        'Analysis rows handled by the write-behind content writer, by outcome',
+        ['outcome'],
+    )
+    CONTENT_FLUSH_LATENCY = Histogram(
+        'iris_content_flush_duration_seconds',
+        'Time taken to insert one batch of analysis rows',
+        buckets=STAGE_BUCKETS,
+    )
+    BLOB_WRITES = Counter(
+        'iris_blob_writes_total',
+        'Uploads put in the blob store, by whether the bytes were new or already stored',
+        ['outcome'],
+    )
+    BLOB_BYTES = Counter(
+        'iris_blob_bytes_total',
+        'Bytes written to or reclaimed from the blob store',
+        ['outcome'],
+    )
+    TIER_SWITCHES = Counter(
+        'iris_tier_switches_total',
+        'Times the degradation controller changed tier',
+        ['upload_type', 'tier'],
+    )
+    # livemax: the server-wide value is 1 while any live worker is degraded
+    DEGRADED = Gauge(
+        'iris_degraded',
+        'Whether an upload type is being served by the reduced tier (1) or not (0)',
+        ['upload_type'],
+        multiprocess_mode='livemax',
+    )
+    # livemin: the server-wide value is 0 while any live worker is still cold
+    MODEL_READY = Gauge(
+        'iris_model_ready',
+        'Whether a model is loaded and warmed up (1) or not (0)',
+        ['model'],
+        multiprocess_mode='livemin',
+    )
+    PROCESS_RSS = Gauge(
+        'iris_process_resident_memory_bytes',
+        'Resident set size of each worker process',
+        multiprocess_mode='liveall',
+    )
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    # /proc gives the live RSS; ru_maxrss (peak, in KiB on Linux) is the fallback elsewhere
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def track_stage(stage, upload_type, model):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if metrics_enabled:
+            STAGE_LATENCY.labels(stage=stage, upload_type=upload_type, model=model).observe(
+                time.perf_counter() - start
+            )
+
+
+def record_model_load(model, seconds, loaded):
+    if metrics_enabled:
+        MODEL_LOAD_LATENCY.labels(model=model, outcome='loaded' if loaded else 'failed').observe(seconds)
+
+
+def record_model_ready(model, ready):
+    if metrics_enabled:
+        MODEL_READY.labels(model=model).set(1 if ready else 0)
+
+
+def record_coalesced(upload_type, shared):
+    if metrics_enabled:
+        COALESCED.labels(upload_type=upload_type, outcome=f'shared_{shared}' if shared else 'computed').inc()
+
+
+def record_queue_depth(upload_type, depth):
+    if metrics_enabled:
+        QUEUE_DEPTH.labels(upload_type=upload_type).set(depth)
+
+
+def record_queue_wait(upload_type, seconds):
+    if metrics_enabled:
+        QUEUE_WAIT.labels(upload_type=upload_type).observe(seconds)
+
+
+def record_tenant_queue_wait(upload_type, tenant, lane, seconds):
+    if metrics_enabled:
+        TENANT_QUEUE_WAIT.labels(upload_type=upload_type, tenant=tenant, lane=lane).observe(seconds)
+
+
+def record_queue_shed(upload_type, reason):
+    if metrics_enabled:
+        QUEUE_SHED.labels(upload_type=upload_type, reason=reason).inc()
+
+
+def record_cancelled(upload_type, reason):
+    if metrics_enabled:
+        CANCELLED.labels(upload_type=upload_type, reason=reason).inc()
+
+
+def record_tier(upload_type, tier):
+    if metrics_enabled:
+        TIER_REQUESTS.labels(upload_type=upload_type, tier=tier).inc()
+
+
+def record_cascade(upload_type, outcome):
+    if metrics_enabled:
+        CASCADE.labels(upload_type=upload_type, outcome=outcome).inc()
+
+
+def record_blocklist_hit(upload_type, match):
+    if metrics_enabled:
+        BLOCKLIST_HITS.labels(upload_type=upload_type, match=match).inc()
+
+
+def record_explanation_cache(upload_type, hit):
+    if metrics_enabled:
+        EXPLANATION_CACHE.labels(upload_type=upload_type, outcome='hit' if hit else 'miss').inc()
+
+
+def record_content_flush(rows, seconds, outcome):
+    if metrics_enabled:
+        CONTENT_ROWS.labels(outcome=outcome).inc(rows)
+        CONTENT_FLUSH_LATENCY.observe(seconds)
+
+
+def record_content_dropped(reason, rows=1):
+    if metrics_enabled:
+        CONTENT_ROWS.labels(outcome=f'dropped_{reason}').inc(rows)
+
+
+def record_blob_write(stored, size):
+    if metrics_enabled:
+        BLOB_WRITES.labels(outcome='stored' if stored else 'deduplicated').inc()
+        if stored:
+            BLOB_BYTES.labels(outcome='written').inc(size)
+
+
+def record_blob_collected(size):
+    if metrics_enabled:
+        BLOB_BYTES.labels(outcome='reclaimed').inc(size)
+
+
+def record_tier_switch(upload_type, tier):
+    if metrics_enabled:
+        TIER_SWITCHES.labels(upload_type=upload_type, tier=tier).inc()
+        DEGRADED.labels(upload_type=upload_type).set(1 if tier == 'reduced' else 0)
+
+
+def request_started(endpoint):
+    if metrics_enabled:
+        IN_FLIGHT.labels(endpoint=endpoint).inc()
+
+
+def request_finished(endpoint, method, status, seconds):
+    if metrics_enabled:
+        REQUEST_COUNT.labels(endpoint=endpoint, method=method, status=str(status)).inc()
+        REQUEST_LATENCY.labels(endpoint=endpoint, method=method).observe(seconds)
+
+
+def request_teardown(endpoint):
+    if metrics_enabled:
+        IN_FLIGHT.labels(endpoint=endpoint).dec()
+        PROCESS_RSS.set(current_rss_bytes())
+
+
+def render_metrics():
+    """Return (payload, content_type) for the Prometheus text exposition format."""
+    PROCESS_RSS.set(current_rss_bytes())
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,28 @@
+"""content.user_id nullable for anonymous analyses
+
+Revision ID: 5b8e2f41c7d9
+Revises: e0a3dc3febf7
+Create Date: 2026-10-19 18:50:04.118734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b8e2f41c7d9'
+down_revision = 'e0a3dc3febf7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite can't alter a column in place, so batch mode copies the table
+    with op.batch_alter_table('content', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade():
+    op.execute('DELETE FROM content WHERE user_id IS NULL')
+    with op.batch_alter_table('content', schema=None) as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=False)
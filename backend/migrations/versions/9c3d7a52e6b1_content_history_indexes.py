@@ -0,0 +1,32 @@
+"""content history indexes
+
+Revision ID: 9c3d7a52e6b1
+Revises: 5b8e2f41c7d9
+Create Date: 2026-10-19 19:12:47.530216
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c3d7a52e6b1'
+down_revision = '5b8e2f41c7d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('content', schema=None) as batch_op:
+        batch_op.create_index('ix_content_user_date', ['user_id', 'upload_date', 'id'], unique=False)
+        batch_op.create_index('ix_content_user_type_date', ['user_id', 'upload_type', 'upload_date', 'id'], unique=False)
+        batch_op.create_index('ix_content_user_model_date', ['user_id', 'model_applied', 'upload_date', 'id'], unique=False)
+        batch_op.create_index('ix_content_user_fake_date', ['user_id', 'is_deepfake', 'upload_date', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('content', schema=None) as batch_op:
+        batch_op.drop_index('ix_content_user_fake_date')
+        batch_op.drop_index('ix_content_user_model_date')
+        batch_op.drop_index('ix_content_user_type_date')
+        batch_op.drop_index('ix_content_user_date')
@@ -0,0 +1,164 @@
+# Model loaders, kept apart from app.py so benchmarks and offline tools can
+# load the same models without starting the Flask app.
+import copy
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from model_store import model_source, load_pretrained
+
+torch = None
+try:
+    import torch
+except ImportError:
+    print("WARNING: PyTorch import failed. AI features will be disabled.")
+
+try:
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+except ImportError:
+    print("WARNING: Transformers import failed. AI features will be disabled.")
+
+# Defer ML imports to prevent startup issues
+def load_ml_models():
+    if torch is None:
+        print("ERROR: Cannot load ML models because PyTorch is not available")
+        return None, None, None
+        
+    try:
+        from transformers import AutoImageProcessor, AutoModelForImageClassification
+        
+        source, options = model_source('dima')
+        processor = AutoImageProcessor.from_pretrained(source, **options)
+        model = load_pretrained('dima', AutoModelForImageClassification)
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+        return processor, model, device
+    except Exception as e:
+        print(f"Error loading ML models: {str(e)}")
+        return None, None, None
+
+def load_image_detector(name):
+    """Any image classifier in the model store, e.g. an extra ensemble member (ensemble.py)."""
+    if torch is None:
+        print("ERROR: Cannot load image detector because PyTorch is not available")
+        return None, None, None
+
+    try:
+        from transformers import AutoImageProcessor, AutoModelForImageClassification
+
+        source, options = model_source(name)
+        processor = AutoImageProcessor.from_pretrained(source, **options)
+        model = load_pretrained(name, AutoModelForImageClassification)
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model.to(device)
+        return processor, model, device
+    except Exception as e:
+        print(f"Error loading image detector {name}: {str(e)}")
+        return None, None, None
+
+def load_audio_model():
+    if torch is None:
+        print("ERROR: Cannot load audio model because PyTorch is not available")
+        return None, None, None
+        
+    try:
+        print("Initializing audio model...")
+        from transformers import AutoFeatureExtractor, AutoModelForAudioClassification
+        
+        source, options = model_source('melody')
+        processor = AutoFeatureExtractor.from_pretrained(
+            source,
+            trust_remote_code=True,
+            **options
+        )
+        model = load_pretrained('melody', AutoModelForAudioClassification, trust_remote_code=True)
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        print(f"Using device: {device}")
+        model.to(device)
+        print("Audio model loaded successfully")
+        return processor, model, device
+    except Exception as e:
+        print(f"Error loading audio model: {str(e)}")
+        return None, None, None
+
+def load_text_model():
+    if torch is None:
+        print("ERROR: Cannot load text model because PyTorch is not available")
+        return None, None, None
+        
+    try:
+        print("Initializing text analysis model...")
+        # Load tokenizer and model with proper error handling
+        try:
+            source, options = model_source('bert-base-cased')
+            tokenizer = AutoTokenizer.from_pretrained(source, **options)
+            model = load_pretrained('mosko', AutoModelForSequenceClassification)
+            
+            # Update label mapping
+            model.config.id2label = {
+                0: "Fake News",
+                1: "Real News",
+                2: "Undecided"
+            }
+            model.config.label2id = {v: k for k, v in model.config.id2label.items()}
+            
+            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+            model.to(device)
+            print("Text analysis model loaded successfully")
+            return tokenizer, model, device
+        except Exception as e:
+            print(f"Failed to load model or tokenizer: {str(e)}")
+            raise
+            
+    except Exception as e:
+        print(f"Error in load_text_model: {str(e)}")
+        return None, None, None
+
+# Warmup: push dummy inputs through a freshly loaded model so lazy kernel
+# selection, thread-pool start-up and allocator growth happen before the first
+# real request. Each returns the latency of the last pass in milliseconds.
+WARMUP_ITERATIONS = int(os.environ.get('WARMUP_ITERATIONS', '2'))
+
+def _timed_passes(model, inputs):
+    latency = None
+    with torch.no_grad():
+        for _ in range(max(WARMUP_ITERATIONS, 1)):
+            start = time.perf_counter()
+            model(**inputs)
+            latency = (time.perf_counter() - start) * 1000
+    return latency
+
+def warmup_image_model(processor, model, device):
+    pixels = np.random.default_rng(0).integers(0, 256, size=(224, 224, 3), dtype=np.uint8)
+    inputs = processor(images=Image.fromarray(pixels), return_tensors="pt").to(device)
+    return _timed_passes(model, inputs)
+
+def warmup_audio_model(processor, model, device):
+    waveform = np.random.default_rng(0).standard_normal(16000 * 4).astype(np.float32) * 0.1
+    inputs = processor(waveform, sampling_rate=16000, return_tensors="pt").to(device)
+    return _timed_passes(model, inputs)
+
+def warmup_text_model(tokenizer, model, device):
+    text = "Officials announced on Monday that the new policy would take effect next year. " * 20
+    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=512).to(device)
+    return _timed_passes(model, inputs)
+
+IMAGE_SIZE = 224
+
+def image_inputs(processor, images, size, device):
+    """Image model inputs at size x size; ViT interpolates its position embeddings below 224."""
+    inputs = processor(images=images, size={"height": size, "width": size}, return_tensors="pt").to(device)
+    if size != IMAGE_SIZE:
+        inputs["interpolate_pos_encoding"] = True
+    return inputs
+
+# Reduced tier (degradation.py): int8 dynamic quantization of the Linear
+# layers, which is where these transformer models spend most of their CPU time
+def build_reduced_model(model, device):
+    """Cheaper copy of a loaded model; the model itself where dynamic quantization doesn't apply (GPU)."""
+    if device.type != 'cpu':
+        return model
+    reduced = torch.ao.quantization.quantize_dynamic(copy.deepcopy(model), {torch.nn.Linear}, dtype=torch.qint8)
+    return reduced.eval()
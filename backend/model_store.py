@@ -0,0 +1,378 @@
+"""Local pinned store for the Hugging Face models the API serves.
+
+model_store.json names each model's hub repo and the revision to track;
+model_store.lock.json pins the commit and a SHA-256 per file for each of
+them. `python model_store.py sync` downloads exactly the locked commits into
+MODEL_STORE_DIR, converts pickled weights to safetensors and fails unless the
+result matches the lock file, so a build never picks up whatever the hub
+serves today. A model with no lock entry yet is pinned to the commit its
+manifest revision currently resolves to, and the entry is added to the lock
+file with a warning: commit it, or every fresh build pins afresh.
+`sync --update` re-resolves every revision in the manifest and rewrites the
+lock file, to be reviewed and committed.
+
+At runtime the loaders in ml_models.py read from the store with
+local_files_only, so startup needs no network. Weights are memory-mapped
+straight from the safetensors files instead of being copied into each
+process, so gunicorn workers share one page-cache copy of every model.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import sys
+from contextlib import contextmanager
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(BACKEND_DIR, 'model_store.json')
+LOCK_PATH = os.environ.get('MODEL_STORE_LOCK', os.path.join(BACKEND_DIR, 'model_store.lock.json'))
+STORE_DIR = os.environ.get('MODEL_STORE_DIR', os.path.join(BACKEND_DIR, 'model_files'))
+# once: hash each file the first time it is seen and trust it while size/mtime are unchanged
+# always: hash on every load; off: only check that the files exist with the right size
+VERIFY_MODE = os.environ.get('MODEL_STORE_VERIFY', 'once').lower()
+# Refuse to fall back to the hub when a model is missing from the store
+STORE_ONLY = os.environ.get('MODEL_STORE_ONLY', 'False').lower() in ('1', 'true', 'yes')
+
+STAMP_NAME = '.verified.json'
+
+# safetensors dtype names -> torch dtype attribute names
+SAFETENSORS_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'bfloat16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8', 'U8': 'uint8', 'BOOL': 'bool',
+}
+
+
+class ModelStoreError(Exception):
+    pass
+
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_path, path)
+
+
+def sha256_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _store_files(path):
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in names:
+            if not name.startswith('.'):
+                files.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(files)
+
+
+def _convert_to_safetensors(path):
+    """Replace a single pickled pytorch_model.bin with model.safetensors."""
+    bin_path = os.path.join(path, 'pytorch_model.bin')
+    target = os.path.join(path, 'model.safetensors')
+    if os.path.exists(target) or not os.path.exists(bin_path):
+        return
+    import torch
+    from safetensors.torch import save_file
+
+    print(f"Converting {bin_path} to safetensors")
+    state_dict = torch.load(bin_path, map_location='cpu', weights_only=True)
+    # safetensors refuses tensors that share storage (tied weights), so give each its own copy
+    state_dict = {key: tensor.contiguous().clone() for key, tensor in state_dict.items()}
+    save_file(state_dict, target, metadata={'format': 'pt'})
+    os.remove(bin_path)
+
+
+def sync(names=None, update=False):
+    """Download the locked models into the store, pinning any that aren't locked yet; update re-pins them all."""
+    from huggingface_hub import HfApi, snapshot_download
+
+    manifest = _read_json(MANIFEST_PATH, {})
+    lock = _read_json(LOCK_PATH, {})
+    names = names or list(manifest)
+    api = HfApi()
+
+    for name in names:
+        if name not in manifest:
+            raise ModelStoreError(f"'{name}' is not listed in {MANIFEST_PATH}")
+        entry = manifest[name]
+        pinned = None if update else lock.get(name)
+        if pinned is not None and pinned['repo_id'] != entry['repo_id']:
+            raise ModelStoreError(
+                f"{name} is locked to {pinned['repo_id']} but {MANIFEST_PATH} names {entry['repo_id']}. "
+                f"Run `python model_store.py sync --update {name}` and commit the lock file."
+            )
+        if pinned is None:
+            revision = api.model_info(entry['repo_id'], revision=entry['revision']).sha
+            if not update:
+                print(f"WARNING: {name} was not in {LOCK_PATH}; pinned it to {revision}. Commit the lock file.")
+        else:
+            revision = pinned['revision']
+
+        target = os.path.join(STORE_DIR, name, revision)
+        print(f"Syncing {name} ({entry['repo_id']}@{revision[:12]}) into {target}")
+        snapshot_download(
+            entry['repo_id'],
+            revision=revision,
+            local_dir=target,
+            local_dir_use_symlinks=False,
+            allow_patterns=entry.get('allow_patterns'),
+        )
+        _convert_to_safetensors(target)
+
+        files = {}
+        for rel_path in _store_files(target):
+            full_path = os.path.join(target, rel_path)
+            files[rel_path] = {'sha256': sha256_file(full_path), 'size': os.path.getsize(full_path)}
+
+        if pinned is not None:
+            for rel_path in sorted(set(files) | set(pinned['files'])):
+                expected = pinned['files'].get(rel_path)
+                actual = files.get(rel_path)
+                if expected is None or actual is None or actual['sha256'] != expected['sha256']:
+                    raise ModelStoreError(
+                        f"Checksum mismatch for {name}/{rel_path} at pinned revision {revision}. "
+                        f"Run with --update to accept new files."
+                    )
+
+        _write_stamp(target, files)
+        if pinned is None:
+            lock[name] = {'repo_id': entry['repo_id'], 'revision': revision, 'files': files}
+            _write_json_atomic(LOCK_PATH, lock)
+    return lock
+
+
+def _write_stamp(path, files):
+    stamp = {}
+    for rel_path, expected in files.items():
+        stat = os.stat(os.path.join(path, rel_path))
+        stamp[rel_path] = [stat.st_size, stat.st_mtime_ns, expected['sha256']]
+    try:
+        _write_json_atomic(os.path.join(path, STAMP_NAME), stamp)
+    except OSError:
+        pass  # read-only store: we simply re-hash next time
+
+
+def verify(name, entry, path):
+    """Check a store directory against its lock entry, hashing according to VERIFY_MODE."""
+    stamp = _read_json(os.path.join(path, STAMP_NAME), {}) if VERIFY_MODE == 'once' else {}
+    rehashed = False
+    for rel_path, expected in entry['files'].items():
+        full_path = os.path.join(path, rel_path)
+        try:
+            stat = os.stat(full_path)
+        except FileNotFoundError:
+            raise ModelStoreError(f"{name}: missing {rel_path} in {path}")
+        if stat.st_size != expected['size']:
+            raise ModelStoreError(f"{name}: {rel_path} is {stat.st_size} bytes, expected {expected['size']}")
+        if VERIFY_MODE == 'off':
+            continue
+        if stamp.get(rel_path) == [stat.st_size, stat.st_mtime_ns, expected['sha256']]:
+            continue
+        if sha256_file(full_path) != expected['sha256']:
+            raise ModelStoreError(f"{name}: checksum mismatch for {rel_path}")
+        rehashed = True
+    if rehashed and VERIFY_MODE == 'once':
+        _write_stamp(path, entry['files'])
+
+
+def store_path(name):
+    """Directory holding a verified copy of the model, or None if it is not in the store."""
+    entry = _read_json(LOCK_PATH, {}).get(name)
+    if entry is None:
+        return None
+    path = os.path.join(STORE_DIR, name, entry['revision'])
+    if not os.path.isdir(path):
+        return None
+    verify(name, entry, path)
+    return path
+
+
+def model_revision(name):
+    """Commit the model is served from: the locked one, else the manifest revision."""
+    entry = _read_json(LOCK_PATH, {}).get(name) or _read_json(MANIFEST_PATH, {}).get(name)
+    return entry['revision'] if entry else 'unknown'
+
+
+def model_source(name):
+    """Return (path_or_repo_id, from_pretrained kwargs) for a model in the manifest."""
+    path = store_path(name)
+    if path is not None:
+        return path, {'local_files_only': True}
+    if STORE_ONLY:
+        raise ModelStoreError(f"{name} is not in the model store; run `python model_store.py sync {name}`")
+    entry = _read_json(MANIFEST_PATH, {})[name]
+    # Even from the hub, a locked model is fetched at its pinned commit rather than the branch
+    return entry['repo_id'], {'revision': model_revision(name)}
+
+
+def load_safetensors_mmap(path):
+    """Map a safetensors file and return tensors that view the mapping directly.
+
+    The mapping is copy-on-write, so pages stay shared with every other process
+    mapping the same file unless someone writes to a tensor.
+    """
+    import torch
+
+    with open(path, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for key, info in header.items():
+        if key == '__metadata__':
+            continue
+        dtype = getattr(torch, SAFETENSORS_DTYPES[info['dtype']])
+        begin, end = info['data_offsets']
+        if end == begin:
+            tensors[key] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        count = (end - begin) // torch.tensor([], dtype=dtype).element_size()
+        tensor = torch.frombuffer(mapping, dtype=dtype, count=count, offset=data_start + begin)
+        tensors[key] = tensor.view(info['shape'])
+    return tensors
+
+
+def _weight_files(path):
+    index_path = os.path.join(path, 'model.safetensors.index.json')
+    if os.path.exists(index_path):
+        shards = sorted(set(_read_json(index_path, {})['weight_map'].values()))
+        return [os.path.join(path, shard) for shard in shards]
+    single = os.path.join(path, 'model.safetensors')
+    return [single] if os.path.exists(single) else []
+
+
+def _assign_weights(model, state_dict):
+    import torch
+
+    expected = dict(model.state_dict(keep_vars=True))
+    prefix = getattr(model, 'base_model_prefix', '')
+    resolved = {}
+    for key, tensor in state_dict.items():
+        if key not in expected and prefix:
+            if f'{prefix}.{key}' in expected:
+                key = f'{prefix}.{key}'
+            elif key.startswith(f'{prefix}.') and key[len(prefix) + 1:] in expected:
+                key = key[len(prefix) + 1:]
+        if key in expected:
+            resolved[key] = tensor
+
+    missing = [key for key, value in expected.items()
+               if key not in resolved and isinstance(value, torch.nn.Parameter)]
+    if missing:
+        raise ModelStoreError(f"checkpoint is missing {len(missing)} parameters, e.g. {missing[0]}")
+
+    for key, tensor in resolved.items():
+        if tensor.shape != expected[key].shape:
+            raise ModelStoreError(f"shape mismatch for {key}: {tuple(tensor.shape)} vs {tuple(expected[key].shape)}")
+        module_name, _, leaf = key.rpartition('.')
+        module = model.get_submodule(module_name)
+        if leaf in module._parameters:
+            module._parameters[leaf] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[leaf] = tensor
+
+
+@contextmanager
+def _skip_init():
+    """Build a model without spending time on random init that the checkpoint overwrites."""
+    import torch
+    from transformers.modeling_utils import no_init_weights
+
+    skipped = {}
+    for fn_name in ('uniform_', 'normal_', 'trunc_normal_', 'constant_', 'zeros_', 'ones_',
+                    'xavier_uniform_', 'xavier_normal_', 'kaiming_uniform_', 'kaiming_normal_'):
+        skipped[fn_name] = getattr(torch.nn.init, fn_name)
+        setattr(torch.nn.init, fn_name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        with no_init_weights():
+            yield
+    finally:
+        for fn_name, fn in skipped.items():
+            setattr(torch.nn.init, fn_name, fn)
+
+
+def load_pretrained(name, auto_cls, **kwargs):
+    """from_pretrained() for a manifest model, memory-mapping weights when it is in the store."""
+    source, options = model_source(name)
+    if 'local_files_only' not in options:
+        return auto_cls.from_pretrained(source, **options, **kwargs)
+
+    from transformers import AutoConfig
+
+    weight_files = _weight_files(source)
+    if weight_files:
+        try:
+            config = AutoConfig.from_pretrained(source, **options, **kwargs)
+            with _skip_init():
+                model = auto_cls.from_config(config, **kwargs)
+            state_dict = {}
+            for weight_file in weight_files:
+                state_dict.update(load_safetensors_mmap(weight_file))
+            _assign_weights(model, state_dict)
+            model.eval()
+            print(f"Loaded {name} from {source} (memory-mapped)")
+            return model
+        except ModelStoreError as e:
+            print(f"WARNING: Could not memory-map {name} ({str(e)}); loading a private copy instead")
+    return auto_cls.from_pretrained(source, **options, **kwargs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the local pinned model store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help='Download models into the store')
+    sync_parser.add_argument('names', nargs='*', help='Models to sync (default: all in model_store.json)')
+    sync_parser.add_argument('--update', action='store_true',
+                             help='Re-resolve manifest revisions and rewrite the lock file')
+    verify_parser = subparsers.add_parser('verify', help='Hash every stored file against the lock file')
+    verify_parser.add_argument('names', nargs='*')
+    args = parser.parse_args(argv)
+
+    if args.command == 'sync':
+        try:
+            sync(args.names, update=args.update)
+        except ModelStoreError as e:
+            print(f"❌ {str(e)}")
+            return 1
+        print("Model store is up to date.")
+        return 0
+
+    global VERIFY_MODE
+    VERIFY_MODE = 'always'
+    lock = _read_json(LOCK_PATH, {})
+    failed = False
+    for name in args.names or list(lock):
+        entry = lock.get(name)
+        if entry is None:
+            print(f"❌ {name}: not in {LOCK_PATH}")
+            failed = True
+            continue
+        try:
+            verify(name, entry, os.path.join(STORE_DIR, name, entry['revision']))
+            print(f"✅ {name}: {entry['repo_id']}@{entry['revision'][:12]}")
+        except ModelStoreError as e:
+            print(f"❌ {str(e)}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
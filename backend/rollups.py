@@ -0,0 +1,191 @@
+import bisect
+import os
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+# Daily rollups of the Content table for the ops dashboard (/api/stats).
+#
+# One rollup row counts the analyses of one day with a given upload type,
+# model, verdict and latency bucket, together with the sum of their latencies.
+# A day therefore holds at most types x models x 2 x buckets rows however many
+# analyses it saw, and every dashboard question - totals, per-type and
+# per-model breakdowns, fake rate, latency percentiles - is answered from
+# those rows alone: the cost follows the number of days asked for, not the
+# number of analyses.
+#
+# Rows are kept current by the content writer: each batch it inserts is
+# aggregated in memory and added to the rollups with one upsert in the same
+# transaction, so the counts can't drift from Content even when a batch is
+# retried. `flask rebuild-rollups` recomputes days from Content, for history
+# written before the rollups existed or after the buckets below change.
+
+# Upper bounds of the latency buckets in milliseconds; the last bucket is
+# everything slower. Changing them needs a rebuild.
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+# Bucket of analyses with no recorded latency (written before it was kept)
+UNTIMED = -1
+KEY_COLUMNS = ('day', 'upload_type', 'model_applied', 'is_deepfake', 'latency_bucket')
+PERCENTILES = (50, 95, 99)
+REBUILD_BATCH_ROWS = int(os.environ.get('ROLLUP_REBUILD_BATCH_ROWS', '5000'))
+
+
+def latency_bucket(latency_ms):
+    if latency_ms is None:
+        return UNTIMED
+    return bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+
+
+def aggregate(rows, counts=None):
+    """Folds Content rows (dicts) into {rollup key: [analyses, latency_ms_sum]}."""
+    counts = counts if counts is not None else defaultdict(lambda: [0, 0.0])
+    for row in rows:
+        if row.get('upload_date') is None:
+            continue
+        latency_ms = (row.get('analysis') or {}).get('latency_ms')
+        key = (row['upload_date'].date(), row['upload_type'], row['model_applied'],
+               bool(row['is_deepfake']), latency_bucket(latency_ms))
+        counts[key][0] += 1
+        counts[key][1] += latency_ms or 0.0
+    return counts
+
+
+def upsert(connection, table, counts):
+    """Adds aggregated counts to the rollup rows, creating the ones that don't exist yet."""
+    params = [dict(zip(KEY_COLUMNS, key), analyses=analyses, latency_ms_sum=latency_ms_sum)
+              for key, (analyses, latency_ms_sum) in counts.items()]
+    if not params:
+        return
+    insert = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}.get(connection.dialect.name)
+    if insert is None:
+        # No portable upsert: update in place, insert whatever wasn't there
+        for values in params:
+            key = and_(*(table.c[name] == values[name] for name in KEY_COLUMNS))
+            updated = connection.execute(table.update().where(key).values(
+                analyses=table.c.analyses + values['analyses'],
+                latency_ms_sum=table.c.latency_ms_sum + values['latency_ms_sum']))
+            if not updated.rowcount:
+                connection.execute(table.insert(), values)
+        return
+    statement = insert(table)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=list(KEY_COLUMNS),
+        set_={
+            'analyses': table.c.analyses + statement.excluded.analyses,
+            'latency_ms_sum': table.c.latency_ms_sum + statement.excluded.latency_ms_sum,
+        },
+    ), params)
+
+
+def add(table, connection, rows):
+    """Content writer hook (with the table bound): counts a batch of freshly inserted rows."""
+    upsert(connection, table, aggregate(rows))
+
+
+def rebuild(connection, content, table, since=None, batch_rows=REBUILD_BATCH_ROWS):
+    """Recomputes the rollups from `since` (a date; None for everything) out of Content.
+
+    Run it in one transaction: on SQLite that holds the write lock, so the
+    content writer waits (and retries) instead of counting rows twice.
+    """
+    columns = [content.c[name] for name in ('upload_date', 'upload_type', 'model_applied', 'is_deepfake', 'analysis')]
+    query = select(columns)
+    clear = delete(table)
+    if since is not None:
+        query = query.where(content.c.upload_date >= datetime.combine(since, datetime.min.time()))
+        clear = clear.where(table.c.day >= since)
+    connection.execute(clear)
+
+    counts = defaultdict(lambda: [0, 0.0])
+    total = 0
+    # Streamed in partitions so memory stays flat however large Content is
+    result = connection.execution_options(stream_results=True).execute(query)
+    for partition in result.partitions(batch_rows):
+        aggregate((row._mapping for row in partition), counts)
+        total += len(partition)
+    upsert(connection, table, counts)
+    return total, len(counts)
+
+
+def _percentile(buckets, timed, percentile):
+    # Linear interpolation inside the bucket, the way Prometheus' histogram_quantile does it
+    rank = timed * percentile / 100.0
+    seen = 0
+    for bucket in sorted(buckets):
+        count = buckets[bucket]
+        if seen + count >= rank and count:
+            if bucket >= len(LATENCY_BUCKETS_MS):
+                return float(LATENCY_BUCKETS_MS[-1])
+            lower = LATENCY_BUCKETS_MS[bucket - 1] if bucket else 0
+            return round(lower + (LATENCY_BUCKETS_MS[bucket] - lower) * (rank - seen) / count, 1)
+        seen += count
+    return None
+
+
+class _Summary:
+    def __init__(self):
+        self.analyses = 0
+        self.fake = 0
+        self.latency_ms_sum = 0.0
+        self.buckets = defaultdict(int)
+        self.by_type = defaultdict(lambda: {'analyses': 0, 'fake': 0})
+        self.by_model = defaultdict(lambda: {'analyses': 0, 'fake': 0})
+
+    def add_counts(self, upload_type, model_applied, is_deepfake, analyses):
+        fake = analyses if is_deepfake else 0
+        self.analyses += analyses
+        self.fake += fake
+        for breakdown, name in ((self.by_type, upload_type.value), (self.by_model, model_applied.value)):
+            breakdown[name]['analyses'] += analyses
+            breakdown[name]['fake'] += fake
+
+    def add_latency(self, bucket, analyses, latency_ms_sum):
+        self.buckets[bucket] += analyses
+        self.latency_ms_sum += latency_ms_sum
+
+    def to_dict(self):
+        timed = sum(self.buckets.values())
+        latency = {f'p{percentile}': _percentile(self.buckets, timed, percentile) for percentile in PERCENTILES}
+        latency['mean'] = round(self.latency_ms_sum / timed, 1) if timed else None
+        return {
+            'analyses': self.analyses,
+            'fake': self.fake,
+            'fake_rate': round(self.fake / self.analyses, 4) if self.analyses else None,
+            'by_type': dict(self.by_type),
+            'by_model': dict(self.by_model),
+            'latency_ms': latency,
+        }
+
+
+def stats(connection, table, start, end, upload_type=None, model_applied=None):
+    """Per-day and overall summaries for the days start..end (inclusive), read only from the rollups."""
+    conditions = [table.c.day >= start, table.c.day <= end]
+    if upload_type is not None:
+        conditions.append(table.c.upload_type == upload_type)
+    if model_applied is not None:
+        conditions.append(table.c.model_applied == model_applied)
+    analyses = func.sum(table.c.analyses)
+    # The database folds the latency buckets away for the counts and the
+    # type/model/verdict split away for the latencies, so only a few dozen
+    # rows per day come back to Python
+    counts = select([table.c.day, table.c.upload_type, table.c.model_applied, table.c.is_deepfake, analyses]) \
+        .where(*conditions).group_by(table.c.day, table.c.upload_type, table.c.model_applied, table.c.is_deepfake)
+    latencies = select([table.c.day, table.c.latency_bucket, analyses, func.sum(table.c.latency_ms_sum)]) \
+        .where(table.c.latency_bucket != UNTIMED, *conditions).group_by(table.c.day, table.c.latency_bucket)
+
+    total = _Summary()
+    days = defaultdict(_Summary)
+    for day, *values in connection.execute(counts):
+        total.add_counts(*values)
+        days[day].add_counts(*values)
+    for day, *values in connection.execute(latencies):
+        total.add_latency(*values)
+        days[day].add_latency(*values)
+    return {
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'totals': total.to_dict(),
+        'days': [dict(day=day.isoformat(), **days[day].to_dict()) for day in sorted(days)],
+    }
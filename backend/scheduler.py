@@ -0,0 +1,442 @@
+import heapq
+import itertools
+import json
+import math
+import os
+import select
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from metrics import record_queue_depth, record_queue_shed, record_queue_wait, record_tenant_queue_wait
+
+# Admission control in front of the models. Each upload type has its own
+# queue with a fixed number of concurrent model runs and a bounded number of
+# waiting requests. A request is turned away immediately (503 + Retry-After)
+# when the queue is full or when the estimated wait, based on a moving average
+# of recent service times, is longer than the client should be kept waiting.
+#
+# Waiting requests are kept per tenant (user, API key or client address) and
+# tenants take turns by deficit round-robin, so a tenant with weight 4 gets
+# four slots for every one a weight-1 tenant gets, however many requests either
+# has queued. Interactive requests have their own lane that is served before
+# the batch lane, except that every QUEUE_BATCH_EVERY-th grant goes to batch
+# work so it can't be starved outright.
+#
+# Within a tenant, requests are served earliest-deadline-first. Every request
+# carries a Deadline (X-Request-Deadline / X-Request-Timeout, or a default per
+# upload type); work whose deadline passes while it is queued is dropped before
+# it reaches a model, and long analyses call Deadline.check() between chunks
+# so they stop as soon as the deadline passes or the client hangs up.
+#
+# The queues are per worker process, so gunicorn needs threaded workers
+# (gunicorn.conf.py) for requests to reach them instead of piling up in the
+# listen backlog.
+
+UPLOAD_TYPES = ('image', 'audio', 'video', 'text')
+
+DEFAULT_CAPACITY = {'image': 32, 'audio': 8, 'video': 4, 'text': 32}
+# Rough first guesses until real service times have been observed
+DEFAULT_SERVICE_TIME = {'image': 0.5, 'audio': 2.0, 'video': 10.0, 'text': 0.3}
+SERVICE_TIME_ALPHA = 0.2
+# Seconds a request may take when the client doesn't say
+DEFAULT_DEADLINE = {'image': 30.0, 'audio': 120.0, 'video': 300.0, 'text': 30.0}
+# How often Deadline.check() looks at the client socket
+DISCONNECT_POLL_INTERVAL = 0.25
+
+INTERACTIVE = 'interactive'
+BATCH = 'batch'
+LANES = (INTERACTIVE, BATCH)
+DEFAULT_PLAN_WEIGHTS = {'free': 1.0, 'pro': 4.0, 'enterprise': 8.0}
+
+
+class QueueFull(Exception):
+    def __init__(self, queue_name, retry_after, reason):
+        super().__init__(f"{queue_name} queue is {reason}")
+        self.queue_name = queue_name
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class Cancelled(Exception):
+    """The request no longer needs an answer; stop working on it."""
+    reason = 'cancelled'
+
+
+class DeadlineExceeded(Cancelled):
+    reason = 'deadline'
+
+
+class ClientDisconnected(Cancelled):
+    reason = 'disconnected'
+
+
+def socket_disconnect_probe(environ):
+    """Returns a callable telling whether the client has closed its connection, or None.
+
+    Both gunicorn and the werkzeug dev server expose the connection socket in the
+    WSGI environ. The request body has already been read by the time we look, so
+    a readable socket with nothing to read means the peer sent FIN (or reset).
+    """
+    sock = environ.get('gunicorn.socket') or environ.get('werkzeug.socket')
+    if sock is None:
+        return None
+
+    def disconnected():
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except (OSError, ValueError):
+            return True
+
+    return disconnected
+
+
+class Deadline:
+    """When a request stops being worth answering, on the monotonic clock."""
+
+    def __init__(self, timeout, disconnect_probe=None):
+        self.expires_at = time.monotonic() + timeout
+        self._disconnect_probe = disconnect_probe
+        self._last_probe = 0.0
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def check(self):
+        """Raise if the work should stop: deadline passed or client gone."""
+        if self.expired():
+            raise DeadlineExceeded('Request deadline passed')
+        if self._disconnect_probe is None:
+            return
+        now = time.monotonic()
+        if now - self._last_probe < DISCONNECT_POLL_INTERVAL:
+            return
+        self._last_probe = now
+        if self._disconnect_probe():
+            raise ClientDisconnected('Client closed the connection')
+
+
+class Tenant(NamedTuple):
+    id: str
+    label: str  # Metric/stats name; client addresses all report as 'anonymous'
+    plan: str
+    weight: float
+
+
+def _env_json(name, default):
+    try:
+        return json.loads(os.environ[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def plan_weights():
+    """Weight per plan from IRIS_PLAN_WEIGHTS, e.g. '{"free": 1, "pro": 4}'."""
+    return {**DEFAULT_PLAN_WEIGHTS, **_env_json('IRIS_PLAN_WEIGHTS', {})}
+
+
+def tenant_plans():
+    """Plan per tenant id from IRIS_TENANT_PLANS, e.g. '{"user:12": "pro", "key:abc123": "enterprise"}'."""
+    return _env_json('IRIS_TENANT_PLANS', {})
+
+
+def make_tenant(tenant_id, label=None, plans=None, weights=None):
+    plans = tenant_plans() if plans is None else plans
+    weights = plan_weights() if weights is None else weights
+    plan = plans.get(tenant_id, 'free')
+    # A zero weight would never earn a turn
+    weight = max(float(weights.get(plan, 1.0)), 0.1)
+    return Tenant(tenant_id, label or tenant_id, plan, weight)
+
+
+ANONYMOUS = Tenant('anonymous', 'anonymous', 'free', 1.0)
+
+
+class _Ticket:
+    __slots__ = ('granted', 'cancelled', 'enqueued_at', 'expires_at', 'tenant', 'lane')
+
+    def __init__(self, expires_at, tenant, lane):
+        self.granted = threading.Event()
+        self.cancelled = False
+        self.enqueued_at = time.monotonic()
+        self.expires_at = expires_at
+        self.tenant = tenant
+        self.lane = lane
+
+
+class _TenantQueue:
+    """One tenant's waiting tickets, earliest deadline first."""
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.heap = []
+        self.depth = 0
+        self.deficit = 0.0
+
+    def peek(self, now, expired):
+        # Cancelled tickets were already taken off the depth by whoever cancelled them
+        while self.heap:
+            ticket = self.heap[0][2]
+            if ticket.cancelled:
+                heapq.heappop(self.heap)
+            elif ticket.expires_at <= now:
+                # Its waiter times out on its own; just make sure it never gets the slot
+                heapq.heappop(self.heap)
+                ticket.cancelled = True
+                self.depth -= 1
+                expired.append(ticket)
+            else:
+                return ticket
+        return None
+
+
+class _Lane:
+    """Deficit round-robin over the tenants that have work waiting."""
+
+    def __init__(self):
+        self.queues = {}
+        self.turns = deque()
+        self.depth = 0
+
+    def tenant_depth(self, tenant_id):
+        queue = self.queues.get(tenant_id)
+        return queue.depth if queue else 0
+
+    def push(self, ticket, seq):
+        queue = self.queues.get(ticket.tenant.id)
+        if queue is None:
+            queue = self.queues[ticket.tenant.id] = _TenantQueue(ticket.tenant)
+            self.turns.append(ticket.tenant.id)
+        heapq.heappush(queue.heap, (ticket.expires_at, seq, ticket))
+        queue.depth += 1
+        self.depth += 1
+
+    def forget(self, ticket):
+        self.queues[ticket.tenant.id].depth -= 1
+        self.depth -= 1
+
+    def pop(self, now, expired):
+        while self.turns:
+            queue = self.queues[self.turns[0]]
+            dropped = len(expired)
+            ticket = queue.peek(now, expired)
+            self.depth -= len(expired) - dropped
+            if ticket is None:
+                # Idle tenants don't bank credit
+                self.turns.popleft()
+                del self.queues[queue.tenant.id]
+                continue
+            if queue.deficit >= 1:
+                queue.deficit -= 1
+                heapq.heappop(queue.heap)
+                queue.depth -= 1
+                self.depth -= 1
+                return ticket
+            # Turn over: top up by the tenant's weight and go to the back
+            queue.deficit += queue.tenant.weight
+            self.turns.rotate(-1)
+        return None
+
+
+class InferenceQueue:
+    def __init__(self, name, concurrency, capacity, max_wait, initial_service_time,
+                 tenant_capacity=None, batch_every=8):
+        self.name = name
+        self.concurrency = concurrency
+        self.capacity = capacity
+        # Waiting requests a single tenant may hold, so one bulk job can't fill the queue
+        self.tenant_capacity = capacity if tenant_capacity is None else tenant_capacity
+        self.batch_every = batch_every
+        self.shed_count = 0
+        self.expired_count = 0
+        self.max_wait = max_wait
+        self._service_time = initial_service_time
+        self._wait_time = 0.0
+        self._active = 0
+        # Cancelled tickets are left in the heaps and skipped when they reach
+        # the top, so the lanes keep their own count of live waiting tickets
+        self._lanes = {lane: _Lane() for lane in LANES}
+        self._seq = itertools.count()
+        self._interactive_streak = 0
+        self._tenant_stats = {}
+        self._lock = threading.Lock()
+
+    def _depth(self):
+        return sum(lane.depth for lane in self._lanes.values())
+
+    def _estimated_wait(self, lane=BATCH):
+        # Everyone ahead of us plus our own turn, spread over the concurrent slots.
+        # Interactive requests only queue behind other interactive ones.
+        depth = self._depth()
+        if self._active < self.concurrency and not depth:
+            return 0.0
+        ahead = self._lanes[INTERACTIVE].depth if lane == INTERACTIVE else depth
+        return (ahead + 1) * self._service_time / self.concurrency
+
+    def _record_expired(self, tickets):
+        for _ in tickets:
+            self.expired_count += 1
+            record_queue_shed(self.name, 'expired')
+
+    def _next_ticket(self):
+        """Next ticket by lane priority, then tenant turn, then deadline; expired ones are dropped."""
+        batch_turn = self.batch_every and self._interactive_streak >= self.batch_every
+        order = (BATCH, INTERACTIVE) if batch_turn else LANES
+        now = time.monotonic()
+        expired = []
+        for lane in order:
+            ticket = self._lanes[lane].pop(now, expired)
+            if ticket is not None:
+                break
+        self._record_expired(expired)
+        if ticket is None:
+            return None
+        if lane == INTERACTIVE and self._lanes[BATCH].depth:
+            self._interactive_streak += 1
+        else:
+            self._interactive_streak = 0
+        return ticket
+
+    def acquire(self, deadline=None, tenant=ANONYMOUS, lane=INTERACTIVE):
+        """Take a model slot, waiting in line if needed. Returns seconds spent queued."""
+        expires_at = deadline.expires_at if deadline else math.inf
+        with self._lock:
+            depth = self._depth()
+            if self._active < self.concurrency and not depth:
+                self._active += 1
+                return 0.0
+
+            estimated_wait = self._estimated_wait(lane)
+            reason = None
+            if depth >= self.capacity:
+                reason = 'full'
+            elif self._lanes[lane].tenant_depth(tenant.id) >= self.tenant_capacity:
+                reason = 'tenant_full'
+            elif estimated_wait > self.max_wait:
+                reason = 'overloaded'
+            if reason:
+                self.shed_count += 1
+                record_queue_shed(self.name, reason)
+                raise QueueFull(self.name, max(1, math.ceil(estimated_wait)), reason)
+            if deadline and estimated_wait > deadline.remaining():
+                # Would only be answered after the client has given up
+                self.expired_count += 1
+                record_queue_shed(self.name, 'deadline')
+                raise DeadlineExceeded('Request deadline passed before it could be served')
+
+            ticket = _Ticket(expires_at, tenant, lane)
+            self._lanes[lane].push(ticket, next(self._seq))
+            record_queue_depth(self.name, depth + 1)
+
+        # release() hands its slot straight to us, so _active is already counted
+        timeout = max(0.0, deadline.remaining()) if deadline else None
+        if not ticket.granted.wait(timeout):
+            with self._lock:
+                if not ticket.granted.is_set():
+                    if not ticket.cancelled:
+                        ticket.cancelled = True
+                        self._lanes[lane].forget(ticket)
+                        self._record_expired([ticket])
+                        record_queue_depth(self.name, self._depth())
+                    raise DeadlineExceeded('Request deadline passed while queued')
+        return time.monotonic() - ticket.enqueued_at
+
+    def release(self, service_time):
+        with self._lock:
+            self._service_time += SERVICE_TIME_ALPHA * (service_time - self._service_time)
+            ticket = self._next_ticket()
+            if ticket is not None:
+                ticket.granted.set()
+            else:
+                self._active -= 1
+            record_queue_depth(self.name, self._depth())
+
+    def _record_tenant_wait(self, tenant, lane, waited):
+        record_queue_wait(self.name, waited)
+        record_tenant_queue_wait(self.name, tenant.label, lane, waited)
+        with self._lock:
+            self._wait_time += SERVICE_TIME_ALPHA * (waited - self._wait_time)
+            stats = self._tenant_stats.setdefault(tenant.label, {'served': 0, 'wait_total': 0.0, 'wait_max': 0.0})
+            stats['served'] += 1
+            stats['wait_total'] += waited
+            stats['wait_max'] = max(stats['wait_max'], waited)
+
+    @contextmanager
+    def slot(self, deadline=None, tenant=ANONYMOUS, lane=INTERACTIVE):
+        waited = self.acquire(deadline, tenant, lane)
+        self._record_tenant_wait(tenant, lane, waited)
+        start = time.monotonic()
+        try:
+            if deadline:
+                # Last chance to skip the model run for a request nobody is waiting on
+                deadline.check()
+            yield waited
+        finally:
+            self.release(time.monotonic() - start)
+
+    def load(self):
+        """(requests waiting, moving average of recent queue wait in seconds) for degradation.py."""
+        with self._lock:
+            return self._depth(), self._wait_time
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self._depth(),
+                'depth_by_lane': {name: lane.depth for name, lane in self._lanes.items()},
+                'active': self._active,
+                'concurrency': self.concurrency,
+                'capacity': self.capacity,
+                'shed': self.shed_count,
+                'expired': self.expired_count,
+                'service_time_ms': round(self._service_time * 1000, 1),
+                'wait_time_ms': round(self._wait_time * 1000, 1),
+                'estimated_wait_ms': round(self._estimated_wait() * 1000, 1),
+                'tenants': {
+                    label: {
+                        'served': stats['served'],
+                        'avg_wait_ms': round(stats['wait_total'] / stats['served'] * 1000, 1),
+                        'max_wait_ms': round(stats['wait_max'] * 1000, 1),
+                    }
+                    for label, stats in self._tenant_stats.items()
+                },
+            }
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def default_deadline(upload_type):
+    """Seconds allowed for an upload type, overridable with DEADLINE_<TYPE>_S."""
+    return float(os.environ.get(f'DEADLINE_{upload_type.upper()}_S', DEFAULT_DEADLINE.get(upload_type, 30.0)))
+
+
+def build_queues():
+    """One queue per upload type, sized from QUEUE_* environment variables."""
+    concurrency = _env_int('INFERENCE_CONCURRENCY', 1)
+    max_wait = float(os.environ.get('QUEUE_MAX_WAIT_S', '10'))
+    tenant_share = float(os.environ.get('QUEUE_TENANT_SHARE', '0.5'))
+    batch_every = _env_int('QUEUE_BATCH_EVERY', 8)
+    queues = {}
+    for upload_type in UPLOAD_TYPES:
+        capacity = _env_int(f'QUEUE_CAPACITY_{upload_type.upper()}', DEFAULT_CAPACITY[upload_type])
+        queues[upload_type] = InferenceQueue(
+            upload_type,
+            concurrency=concurrency,
+            capacity=capacity,
+            max_wait=max_wait,
+            initial_service_time=DEFAULT_SERVICE_TIME[upload_type],
+            tenant_capacity=max(1, math.ceil(capacity * tenant_share)),
+            batch_every=batch_every,
+        )
+    return queues
@@ -0,0 +1,180 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from scheduler import DeadlineExceeded
+
+# Collapses identical concurrent analyses into one model run.
+#
+# Inside a worker, the first thread to ask for a key runs the computation and
+# every other thread asking for the same key waits for its result. Across
+# gunicorn workers the same happens through a directory of lock files: the
+# worker holding the exclusive flock on <key>.lock computes and writes
+# <key>.json, and workers that find the lock taken wait on it and read the
+# result back. Results stay readable for RESULT_TTL seconds so requests that
+# arrive just after the leader finishes still share its answer. A waiter gives
+# up at its own request deadline, or after WAIT_TIMEOUT if that comes first,
+# however long the leader keeps going.
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process coalescing only
+    fcntl = None
+
+SINGLEFLIGHT_DIR = os.environ.get('SINGLEFLIGHT_DIR', os.path.join(tempfile.gettempdir(), 'iris-singleflight'))
+RESULT_TTL = float(os.environ.get('SINGLEFLIGHT_RESULT_TTL', '2'))
+WAIT_TIMEOUT = float(os.environ.get('SINGLEFLIGHT_WAIT_TIMEOUT', '120'))
+POLL_INTERVAL = 0.01
+
+
+def analysis_key(data, *parts):
+    """Key for an analysis: SHA-256 of the content plus everything that changes the answer."""
+    digest = hashlib.sha256(data).hexdigest()
+    return '-'.join([digest] + [str(part) for part in parts])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, directory=SINGLEFLIGHT_DIR, result_ttl=RESULT_TTL, wait_timeout=WAIT_TIMEOUT, retry_on=()):
+        self.directory = directory
+        self.result_ttl = result_ttl
+        self.wait_timeout = wait_timeout
+        # Leader errors that only concern the leader's own request (e.g. its
+        # client went away); waiters seeing one of these run fn themselves
+        self.retry_on = tuple(retry_on)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._last_prune = 0.0
+        self._shared_store = fcntl is not None and bool(directory)
+        if self._shared_store:
+            os.makedirs(directory, exist_ok=True)
+
+    def do(self, key, fn, deadline=None):
+        """Run fn() once per key among concurrent callers.
+
+        Returns (result, shared) where shared is None for the caller that ran
+        fn, 'local' for threads that waited in this process and 'remote' when
+        another worker's result was used. fn's result must be JSON-serialisable.
+        Waiting for another caller's result raises DeadlineExceeded once
+        deadline (a scheduler.Deadline) has passed.
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+
+            if leader:
+                break
+            if not call.done.wait(self._wait_time(deadline)):
+                self._timed_out(key, deadline)
+            if call.error is None:
+                return call.result, 'local'
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+
+        try:
+            if self._shared_store:
+                result, shared = self._do_shared(key, fn, deadline)
+            else:
+                result, shared = fn(), None
+            call.result = result
+            return result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _wait_time(self, deadline):
+        if deadline is None:
+            return self.wait_timeout
+        return max(0.0, min(self.wait_timeout, deadline.remaining()))
+
+    def _timed_out(self, key, deadline):
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceeded(f'Request deadline passed waiting for in-flight analysis {key}')
+        raise TimeoutError(f'Timed out waiting for in-flight analysis {key}')
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return f'{base}.lock', f'{base}.json'
+
+    def _read_fresh(self, result_path):
+        try:
+            if time.time() - os.path.getmtime(result_path) > self.result_ttl:
+                return None
+            with open(result_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _do_shared(self, key, fn, deadline=None):
+        lock_path, result_path = self._paths(key)
+        cached = self._read_fresh(result_path)
+        if cached is not None:
+            return cached, 'remote'
+
+        with open(lock_path, 'a+') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is computing this key: wait for it to let go of the lock
+                give_up_at = time.monotonic() + self._wait_time(deadline)
+                while True:
+                    try:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() > give_up_at:
+                            self._timed_out(key, deadline)
+                        time.sleep(POLL_INTERVAL)
+                cached = self._read_fresh(result_path)
+                if cached is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    return cached, 'remote'
+                # The other worker failed; fall through and compute it ourselves
+
+            try:
+                result = fn()
+                tmp_path = f'{result_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, result_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self._prune()
+        return result, None
+
+    def _prune(self):
+        # Housekeeping at most every 30s: drop results long past their TTL along with their lock files
+        now = time.time()
+        if now - self._last_prune < 30:
+            return
+        self._last_prune = now
+        cutoff = now - max(self.result_ttl * 10, 60)
+        try:
+            entries = os.scandir(self.directory)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                        os.remove(entry.path[:-len('.json')] + '.lock')
+                except OSError:
+                    pass
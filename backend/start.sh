@@ -35,7 +35,8 @@ pip install python-bcrypt
 # Install requirements
 pip install -r requirements.txt
 
-# Initialize database
+# Bring the database schema up to date, then initialize it
+flask --app app upgrade-db
 python init_db.py
 
 # Start the Flask application
@@ -1,6 +1,6 @@
 import unittest
 import json
-from app import app, db, User, Content, hash_password, check_password, check_password_strength, UploadType, ModelApplied
+from app import app, db, User, Content, hash_password, check_password, check_password_strength, UploadType, ModelApplied, AnalysisRollup
 import os
 import tempfile
 from datetime import datetime, timedelta
@@ -555,6 +555,1159 @@ class FlaskAppTestCase(unittest.TestCase):
 
         self.assertIn('error', data)
 
+    # @route: prometheus_metrics
+
+    # TEST #19: Metrics Endpoint
+    # PURPOSE: Tests that '/api/metrics' exposes request counters in Prometheus text format
+    # INPUT: GET request to /api/health followed by GET request to /api/metrics
+    # EXPECTED OUTPUT: 200 status code and an iris_requests_total sample for /api/health
+    def test_metrics_endpoint(self):
+        self.client.get('/api/health')
+        response = self.client.get('/api/metrics')
+
+        # Expect: 200, text exposition format
+        expected_status = 200
+        actual_status = response.status_code
+        self.assertEqual(actual_status, expected_status)
+
+        # Store the result
+        self.test_results.append(
+            ('test_metrics_endpoint', str(expected_status), str(actual_status), actual_status == expected_status)
+        )
+
+        body = response.data.decode('utf-8')
+        self.assertIn('text/plain', response.headers['Content-Type'])
+        self.assertIn('iris_requests_total{endpoint="/api/health"', body)
+        self.assertIn('iris_stage_duration_seconds', body)
+
+    # @route: liveness_check, @route: readiness_check
+
+    # TEST #20: Liveness Probe
+    # PURPOSE: Tests that '/api/health/live' answers regardless of model state
+    # INPUT: GET request to /api/health/live
+    # EXPECTED OUTPUT: 200 status code and status 'ok'
+    def test_liveness_probe(self):
+        response = self.client.get('/api/health/live')
+
+        # Load data from JSON to dictionary
+        data = json.loads(response.data)
+
+        # Expect: 200, ok
+        expected_status = 200
+        actual_status = response.status_code
+        self.assertEqual(actual_status, expected_status)
+
+        # Store the result
+        self.test_results.append(
+            ('test_liveness_probe', str(expected_status), str(actual_status), actual_status == expected_status)
+        )
+
+        self.assertEqual(data['status'], 'ok')
+
+    # TEST #21: Readiness Probe Reports Model Status
+    # PURPOSE: Tests that '/api/health/ready' is 503 while a required model is not warm
+    # INPUT: GET request to /api/health/ready with the image model marked as loading
+    # EXPECTED OUTPUT: 503 status code, 'dima' listed in waiting_for and per-model status
+    def test_readiness_probe_waits_for_models(self):
+        from app import MODEL_STATUS
+        original = dict(MODEL_STATUS['dima'])
+        MODEL_STATUS['dima']['status'] = 'loading'
+        try:
+            response = self.client.get('/api/health/ready')
+        finally:
+            MODEL_STATUS['dima'].update(original)
+
+        # Load data from JSON to dictionary
+        data = json.loads(response.data)
+
+        # Expect: 503, not_ready
+        expected_status = 503
+        actual_status = response.status_code
+        self.assertEqual(actual_status, expected_status)
+
+        # Store the result
+        self.test_results.append(
+            ('test_readiness_probe_waits_for_models', str(expected_status), str(actual_status), actual_status == expected_status)
+        )
+
+        self.assertEqual(data['status'], 'not_ready')
+        self.assertIn('dima', data['waiting_for'])
+        self.assertIn('warmup_ms', data['models']['dima'])
+
+    # @def: InferenceQueue (admission control)
+
+    # TEST #22: Queue Sheds Load When Full
+    # PURPOSE: Tests that a full inference queue rejects new work immediately with a retry hint
+    # INPUT: A queue with one busy slot and no waiting room, then a second acquire
+    # EXPECTED OUTPUT: QueueFull with reason 'full', retry_after >= 1 and the shed counted
+    def test_inference_queue_sheds_when_full(self):
+        from scheduler import InferenceQueue, QueueFull
+        queue = InferenceQueue('image', concurrency=1, capacity=0, max_wait=10, initial_service_time=0.5)
+
+        with queue.slot():
+            with self.assertRaises(QueueFull) as raised:
+                queue.acquire()
+
+        # Expect: shed, full
+        expected = 'full'
+        actual = raised.exception.reason
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_inference_queue_sheds_when_full', expected, actual, actual == expected)
+        )
+
+        self.assertGreaterEqual(raised.exception.retry_after, 1)
+        self.assertEqual(queue.stats()['shed'], 1)
+        self.assertEqual(queue.stats()['active'], 0)
+
+    # TEST #23: Queue Serves Earliest Deadline First
+    # PURPOSE: Tests that waiting work runs in deadline order and expired work never gets a slot
+    # INPUT: One busy slot, then waiters with 5s, 0.05s and 2s deadlines queued in that order
+    # EXPECTED OUTPUT: The 2s waiter runs before the 5s one; the 0.05s waiter gets DeadlineExceeded
+    def test_inference_queue_orders_by_deadline(self):
+        import threading
+        from scheduler import InferenceQueue, Deadline, DeadlineExceeded
+        queue = InferenceQueue('image', concurrency=1, capacity=10, max_wait=60, initial_service_time=0.01)
+        order = []
+
+        def wait_for_slot(name, timeout):
+            try:
+                with queue.slot(Deadline(timeout)):
+                    order.append(name)
+            except DeadlineExceeded:
+                order.append(f'{name}:expired')
+
+        with queue.slot():
+            waiters = [threading.Thread(target=wait_for_slot, args=args) for args in [('late', 5), ('dead', 0.05), ('soon', 2)]]
+            for waiter in waiters:
+                waiter.start()
+                time.sleep(0.01)
+            time.sleep(0.2)
+        for waiter in waiters:
+            waiter.join()
+
+        # Expect: expired first (it timed out while queued), then earliest deadline first
+        expected = str(['dead:expired', 'soon', 'late'])
+        actual = str(order)
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_inference_queue_orders_by_deadline', expected, actual, actual == expected)
+        )
+
+        self.assertEqual(queue.stats()['expired'], 1)
+        self.assertEqual(queue.stats()['depth'], 0)
+
+    # TEST #24: Queue Shares Slots Fairly Between Tenants
+    # PURPOSE: Tests weighted round-robin between tenants and the interactive lane's priority over batch
+    # INPUT: A weight-2 tenant with 6 waiting requests, a weight-1 tenant with 3, and one batch request
+    # EXPECTED OUTPUT: Slots alternate two-to-one between the tenants and the batch request runs last
+    def test_inference_queue_fair_share(self):
+        import threading
+        from scheduler import InferenceQueue, Tenant, BATCH, INTERACTIVE
+        queue = InferenceQueue('image', concurrency=1, capacity=20, max_wait=60, initial_service_time=0.01, batch_every=0)
+        heavy = Tenant('user:1', 'user:1', 'pro', 2.0)
+        light = Tenant('user:2', 'user:2', 'free', 1.0)
+        order = []
+
+        def wait_for_slot(tenant, lane):
+            with queue.slot(tenant=tenant, lane=lane):
+                order.append(tenant.id[-1] if lane == INTERACTIVE else 'b')
+
+        waiters = [(heavy, BATCH)] + [(heavy, INTERACTIVE)] * 6 + [(light, INTERACTIVE)] * 3
+        with queue.slot():
+            threads = [threading.Thread(target=wait_for_slot, args=args) for args in waiters]
+            for thread in threads:
+                thread.start()
+                time.sleep(0.01)
+        for thread in threads:
+            thread.join()
+
+        # Expect: heavy gets two turns for each of light's, batch waits for the interactive lane to drain
+        expected = '112112112b'
+        actual = ''.join(order)
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_inference_queue_fair_share', expected, actual, actual == expected)
+        )
+
+        self.assertEqual(queue.stats()['tenants']['user:1']['served'], 7)
+
+    # TEST #25: Degradation Controller Hysteresis
+    # PURPOSE: Tests that the tier only changes after load has stayed past a threshold for the hold time
+    # INPUT: A controller with depth thresholds 4 (enter) / 1 (exit) and short hold times, fed changing load
+    # EXPECTED OUTPUT: full until overload is sustained, reduced while load sits between thresholds, then full again
+    def test_degradation_controller_hysteresis(self):
+        from degradation import TierController
+        controller = TierController('image', enter_depth=4, exit_depth=1, enter_wait=10, exit_wait=10,
+                                    enter_after=0.05, exit_after=0.05)
+        tiers = [controller.update(depth=5, wait=0)]  # Overload starts
+        time.sleep(0.06)
+        tiers.append(controller.update(depth=5, wait=0))  # Overload sustained
+        tiers.append(controller.update(depth=2, wait=0))  # Below enter, above exit
+        time.sleep(0.06)
+        tiers.append(controller.update(depth=2, wait=0))
+        tiers.append(controller.update(depth=0, wait=0))  # Calm starts
+        time.sleep(0.06)
+        tiers.append(controller.update(depth=0, wait=0))  # Calm sustained
+
+        # Expect: switch down once, back up once
+        expected = 'full,reduced,reduced,reduced,reduced,full'
+        actual = ','.join(tiers)
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_degradation_controller_hysteresis', expected, actual, actual == expected)
+        )
+
+        self.assertEqual(controller.state()['switches'], 2)
+
+    # TEST #26: Cascade Escalates Only Uncertain Images
+    # PURPOSE: Tests that prefilter scores inside the uncertain band are escalated and the rate is reported
+    # INPUT: A cascade with band (0.1, 0.9) and prefilter fake probabilities 0.02, 0.5 and 0.97
+    # EXPECTED OUTPUT: Only 0.5 is escalated, giving an escalation rate of 1/3
+    def test_cascade_escalates_uncertain_band(self):
+        from cascade import Cascade
+        cascade = Cascade(enabled=True, low=0.1, high=0.9, prefilter_size=112)
+        for fake_confidence in (0.02, 0.5, 0.97):
+            cascade.record('image', escalated=not cascade.is_decisive(fake_confidence))
+
+        # Expect: one escalation out of three
+        expected = str(0.3333)
+        actual = str(cascade.stats()['escalation_rate'])
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_cascade_escalates_uncertain_band', expected, actual, actual == expected)
+        )
+
+        self.assertEqual(cascade.stats()['escalated'], 1)
+        with self.assertRaises(ValueError):
+            Cascade(enabled=True, low=0.9, high=0.1, prefilter_size=112)
+
+    # TEST #27: Ensemble Exits Early Once Decisive
+    # PURPOSE: Tests that the ensemble stops waiting once the outstanding members can't change the verdict
+    # INPUT: A weight-3 member answering 0.9 at once and a weight-1 member that takes 2 seconds
+    # EXPECTED OUTPUT: 'fake' well before the slow member finishes, with the slow member reported as cancelled
+    def test_ensemble_early_exit(self):
+        from ensemble import Ensemble, Member
+        ensemble = Ensemble([
+            Member('fast', 3.0, lambda image: 0.9),
+            Member('slow', 1.0, lambda image: time.sleep(2) or 0.0),
+        ])
+        start = time.perf_counter()
+        fake_confidence, details = ensemble.run(Image.new('RGB', (8, 8)))
+        elapsed = time.perf_counter() - start
+
+        # Expect: decided by the fast member alone
+        expected = 'fake'
+        actual = 'fake' if fake_confidence >= 0.5 else 'real'
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_ensemble_early_exit', expected, actual, actual == expected)
+        )
+
+        self.assertLess(elapsed, 1.0)
+        self.assertTrue(details['early_exit'])
+        statuses = {member['model']: member['status'] for member in details['members']}
+        self.assertEqual(statuses, {'fast': 'done', 'slow': 'cancelled'})
+
+    # TEST #28: Tiled Mode Stays Within Its Pixel Budget
+    # PURPOSE: Tests that a large image is scaled to the pixel budget and covered by overlapping edge-to-edge tiles
+    # INPUT: A 4000x3000 image with a 500,000 pixel budget and 25% tile overlap
+    # EXPECTED OUTPUT: A 4x5 grid of 224x224 tiles whose last tiles end exactly at the scaled image edges
+    def test_tiling_respects_pixel_budget(self):
+        from tiling import fit_to_budget, cut_tiles
+        fitted, scale = fit_to_budget(Image.new('RGB', (4000, 3000)), budget=500000)
+        tiles, ys, xs = cut_tiles(fitted, overlap=0.25)
+
+        # Expect: 4 rows x 5 columns
+        expected = '4x5'
+        actual = f'{len(ys)}x{len(xs)}'
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_tiling_respects_pixel_budget', expected, actual, actual == expected)
+        )
+
+        self.assertLessEqual(fitted.size[0] * fitted.size[1], 500000)
+        self.assertEqual(tiles.shape, (20, 224, 224, 3))
+        self.assertEqual(xs[-1] + 224, fitted.size[0])
+        self.assertEqual(ys[-1] + 224, fitted.size[1])
+
+        # A 20000x20 strip is padded to one tile high, not enlarged 11x past the budget
+        from tiling import TooManyTiles
+        strip, _ = fit_to_budget(Image.new('RGB', (20000, 20)), budget=500000)
+        strip_tiles, strip_ys, strip_xs = cut_tiles(strip, overlap=0.25)
+        self.assertLessEqual(strip.size[0] * strip.size[1], 500000)
+        self.assertEqual(strip.size[1], 224)
+        self.assertLessEqual(len(strip_tiles), 14)
+        with self.assertRaises(TooManyTiles):
+            cut_tiles(Image.new('RGB', (4000, 3000)), max_tiles=64)
+
+    # TEST #29: PRNU Check Flags A Spliced Region
+    # PURPOSE: Tests that the sensor-noise analysis finds a pasted region whose noise doesn't match the camera's
+    # INPUT: A synthetic demosaiced 1024x1024 photo, untouched and with a 384x384 noisier patch pasted in
+    # EXPECTED OUTPUT: The untouched photo passes; the spliced one is tampered with exactly the 9 pasted blocks flagged
+    def test_prnu_flags_spliced_region(self):
+        import prnu
+        from scipy.ndimage import convolve
+        rng = np.random.default_rng(7)
+        yy, xx = np.mgrid[0:1024, 0:1024]
+        scene = 128 + 50 * np.sin(xx / 200.0) * np.cos(yy / 150.0)
+        # Sensor with multiplicative PRNU and read noise, green plane of a Bayer mosaic bilinearly demosaiced
+        raw = scene * (1 + 0.02 * rng.standard_normal(scene.shape)) + 2 * rng.standard_normal(scene.shape)
+        kernel = np.array([[0, 1, 0], [1, 4, 1], [0, 1, 0]]) / 4.0
+        green = convolve(raw * ((yy + xx) % 2 == 0), kernel, mode='mirror')
+        photo = np.repeat(np.clip(green, 0, 255)[..., None], 3, axis=2).astype(np.uint8)
+        spliced = photo.copy()
+        patch = scene[256:640, 384:768] + 5 * rng.standard_normal((384, 384))
+        spliced[256:640, 384:768] = np.clip(patch, 0, 255).astype(np.uint8)[..., None]
+
+        clean, tampered = prnu.analyze(photo, block=128), prnu.analyze(spliced, block=128)
+
+        # Expect: untouched passes, spliced flags the 3x3 pasted blocks
+        expected = 'False/True/9'
+        actual = f"{clean['tampered']}/{tampered['tampered']}/{tampered['flagged_blocks']}"
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_prnu_flags_spliced_region', expected, actual, actual == expected)
+        )
+
+        self.assertGreater(tampered['map'][3][4], 1)
+
+        # A flat picture has no brightness range to fit noise against, and mustn't warn trying to
+        import warnings
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            flat = prnu.analyze(np.full((512, 512, 3), 128, dtype=np.uint8), block=128)
+        self.assertFalse(flat['tampered'])
+
+    # TEST #30: ELA Finds A Region With A Different Compression History
+    # PURPOSE: Tests that error level analysis picks out an uncompressed patch pasted into a JPEG
+    # INPUT: A 512x512 JPEG saved at quality 90, untouched and with a 128x128 uncompressed patch pasted in
+    # EXPECTED OUTPUT: No suspicious region in the untouched JPEG, exactly one for the patched one
+    def test_ela_flags_pasted_region(self):
+        import ela
+        rng = np.random.default_rng(3)
+        yy, xx = np.mgrid[0:512, 0:512]
+        scene = 128 + 50 * np.sin(xx / 80.0) * np.cos(yy / 60.0)
+        original = np.clip(scene[..., None] + rng.normal(0, 6, (512, 512, 3)), 0, 255).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(original).save(buffer, 'JPEG', quality=90)
+        photo = Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')
+        patched = np.array(photo)
+        patched[128:256, 256:384] = original[128:256, 256:384]
+
+        clean = ela.analyze(photo, quality=90, regions=4)
+        pasted = ela.analyze(Image.fromarray(patched), heatmap=True, quality=90, regions=4, heatmap_size=16)
+
+        # Expect: 0 suspicious regions untouched, 1 with the pasted patch
+        expected = '0/1'
+        actual = f"{clean['suspicious_regions']}/{pasted['suspicious_regions']}"
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_ela_flags_pasted_region', expected, actual, actual == expected)
+        )
+
+        self.assertEqual(max(max(row) for row in pasted['regions']), pasted['regions'][1][2])
+        self.assertEqual((len(pasted['heatmap']), len(pasted['heatmap'][0])), (16, 16))
+        self.assertNotIn('heatmap', clean)
+
+    # TEST #31: Attention Rollout Points At The Attended Patch And Is Cached
+    # PURPOSE: Tests that the rollout heatmap follows the CLS attention and that explained results are served from the cache
+    # INPUT: Two layers of attention over a 2x2 patch grid where CLS attends only to the bottom-left patch
+    # EXPECTED OUTPUT: The heatmap peaks at the bottom-left cell and the cached result comes back unchanged
+    def test_attention_rollout_heatmap(self):
+        import torch
+        from explain import explanation, ExplanationCache
+        layer = torch.eye(5).repeat(1, 1, 1, 1)
+        layer[0, 0, 0] = torch.tensor([0.0, 0.0, 0.0, 1.0, 0.0])
+        result = explanation((layer, layer.clone()), size=8)
+
+        grid = np.array(result['grid'])
+        expected = '(1, 0)'
+        actual = str(tuple(int(i) for i in np.unravel_index(grid.argmax(), grid.shape)))
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_attention_rollout_heatmap', expected, actual, actual == expected)
+        )
+
+        self.assertTrue(result['png'].startswith('data:image/png;base64,'))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ExplanationCache(directory)
+            self.assertIsNone(cache.get('key'))
+            cache.put('key', {'explanation': result})
+            self.assertEqual(cache.get('key'), {'explanation': result})
+
+    # TEST #32: Embedding Index Finds The Closest Known Fake
+    # PURPOSE: Tests that a variant of a stored fake is found through the IVF lists and real images are left out
+    # INPUT: 500 random 32-d embeddings (alternating fake/real), an IVF build, a query near fake #10, then a pointer to a deleted build
+    # EXPECTED OUTPUT: Fake #10 is the top match; a query near a real image returns no fakes above the threshold; the loaded build keeps serving
+    def test_embedding_index_nearest_fake(self):
+        from embedding_index import EmbeddingIndex, FAKE, REAL
+        rng = np.random.default_rng(5)
+        vectors = rng.standard_normal((500, 32))
+        with tempfile.TemporaryDirectory() as directory:
+            index = EmbeddingIndex(32, directory, nprobe=4, tail_limit=100)
+            for i, vector in enumerate(vectors):
+                index.add(vector, f'{i:064x}', 0.9 if i % 2 == 0 else 0.1, FAKE if i % 2 == 0 else REAL)
+            self.assertTrue(index.needs_rebuild())
+            index.rebuild(lists=8)
+            self.assertFalse(index.needs_rebuild())
+
+            matches = index.search(vectors[10] + 0.05 * rng.standard_normal(32), k=3)
+
+            # Expect: fake #10 first
+            expected = f'{10:064x}'
+            actual = matches[0]['sha256'] if matches else 'no match'
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_embedding_index_nearest_fake', expected[-8:], actual[-8:], actual == expected)
+            )
+
+            self.assertGreater(matches[0]['similarity'], 0.99)
+            self.assertEqual(index.search(vectors[11] + 0.05 * rng.standard_normal(32), min_similarity=0.9), [])
+            self.assertIsNone(index.add(vectors[10], f'{10:064x}', 0.9, FAKE))
+
+            # Another worker's rebuild swapped the pointer and deleted the build before it was opened here
+            with open(os.path.join(directory, 'ivf.json')) as f:
+                info = json.load(f)
+            with open(os.path.join(directory, 'ivf.json'), 'w') as f:
+                json.dump(dict(info, version='ivf-deleted'), f)
+            self.assertEqual(index.search(vectors[10], k=1)[0]['sha256'], expected)
+
+    # TEST #33: Blocklist Confirms Listed Hashes Only
+    # PURPOSE: Tests that a feed build answers listed SHA-256 and perceptual hashes and nothing else
+    # INPUT: A feed with one upload's SHA-256, one image's dHash, 1000 random SHA-256s and a malformed line
+    # EXPECTED OUTPUT: Both listed items match with the feed as source; 1000 unlisted uploads don't
+    def test_blocklist_lookup(self):
+        import hashlib
+        from blocklist import Blocklist
+        rng = np.random.default_rng(11)
+        listed_upload = b'known fake upload'
+        yy, xx = np.mgrid[0:120, 0:160]
+        listed_image = Image.fromarray(np.uint8(128 + 100 * np.sin(xx / 20.0) * np.cos(yy / 25.0)))
+        with tempfile.TemporaryDirectory() as directory:
+            feed = os.path.join(directory, 'partner.txt')
+            with open(feed, 'w') as f:
+                f.write('# partner feed\n')
+                f.write(f'sha256:{hashlib.sha256(listed_upload).hexdigest()}\n')
+                f.write('not a hash\n')
+                f.writelines(f'{rng.bytes(32).hex()}\n' for _ in range(1000))
+            blocklist = Blocklist(os.path.join(directory, 'build'), feeds=[feed])
+            from blocklist import dhash
+            with open(feed, 'a') as f:
+                f.write(f'dhash:{dhash(listed_image).hex()}\n')
+            blocklist.refresh()
+
+            # Expect: the upload and the re-encoded image match, random uploads don't
+            buffer = io.BytesIO()
+            listed_image.convert('RGB').save(buffer, 'JPEG', quality=95)
+            reencoded = Image.open(io.BytesIO(buffer.getvalue())).convert('RGB')
+            misses = sum(blocklist.check_bytes(rng.bytes(64)) is not None for _ in range(1000))
+            expected = 'sha256/dhash/0'
+            actual = f"{(blocklist.check_bytes(listed_upload) or {}).get('match')}/" \
+                     f"{(blocklist.check_image(reencoded) or {}).get('match')}/{misses}"
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_blocklist_lookup', expected, actual, actual == expected)
+            )
+
+            self.assertEqual(blocklist.stats()['entries'], 1002)
+            self.assertEqual(blocklist.check_bytes(listed_upload)['source'], 'partner.txt')
+            self.assertIsNone(blocklist.refresh())
+
+            # Hashing in small chunks sets exactly the same filter bits
+            from blocklist import build
+            version = blocklist.stats()['version']
+            chunked = build([feed], os.path.join(directory, 'chunked'), chunk=7)
+            self.assertEqual(np.fromfile(os.path.join(directory, 'build', version, 'bloom.bin'), dtype=np.uint8).tobytes(),
+                             np.fromfile(os.path.join(directory, 'chunked', chunked['version'], 'bloom.bin'), dtype=np.uint8).tobytes())
+            # Only one watcher per directory builds
+            other = Blocklist(os.path.join(directory, 'build'), feeds=[feed])
+            self.assertEqual((blocklist.claim_builder(), other.claim_builder()), (True, False))
+
+    # TEST #34: Bulk Scoring Resumes Without Rescoring
+    # PURPOSE: Tests that the offline scorer batches a directory and a rerun only scores files missing from the output
+    # INPUT: 5 images and 1 corrupt file, scored with a random ViT; then a torn row and 2 new images before a rerun
+    # EXPECTED OUTPUT: 6 rows, then 2 more scored with 6 skipped; the torn row is gone and the corrupt file has an error
+    def test_bulk_score_resumes(self):
+        import torch
+        from transformers import ViTConfig, ViTForImageClassification, ViTImageProcessor
+        from bulk_score import Models, score_files, walk
+        config = ViTConfig(hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64, num_labels=2)
+        loaded = (ViTImageProcessor(), ViTForImageClassification(config), torch.device('cpu'))
+        rng = np.random.default_rng(3)
+        with tempfile.TemporaryDirectory() as directory:
+            media = os.path.join(directory, 'media')
+            os.makedirs(media)
+            for i in range(5):
+                Image.fromarray(rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)).save(os.path.join(media, f'{i}.png'))
+            with open(os.path.join(media, 'broken.jpg'), 'wb') as f:
+                f.write(b'not an image')
+            output = os.path.join(directory, 'scores.jsonl')
+            models = Models({'image': lambda: loaded})
+            first = score_files(walk(media), output, models, workers=1, batch_size=2, progress_s=0)
+
+            # Interrupted mid-write, then more files arrive
+            with open(output, 'a') as f:
+                f.write('{"path": "torn')
+            for i in range(5, 7):
+                Image.fromarray(rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)).save(os.path.join(media, f'{i}.png'))
+            second = score_files(walk(media), output, models, workers=0, batch_size=2, progress_s=0)
+
+            expected = '(6, 0) (2, 6)'
+            actual = f'{first} {second}'
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_bulk_score_resumes', expected, actual, actual == expected)
+            )
+
+            with open(output) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(len({row['path'] for row in rows}), 8)
+            errors = [row for row in rows if 'error' in row]
+            self.assertEqual([os.path.basename(row['path']) for row in errors], ['broken.jpg'])
+            scored = [row for row in rows if 'error' not in row]
+            self.assertTrue(all(abs(row['fake_confidence'] + row['real_confidence'] - 1) < 1e-6 for row in scored))
+
+            # Once the broken file is fixed, a retry replaces its error row rather than adding a second row
+            Image.fromarray(rng.integers(0, 256, (64, 96, 3), dtype=np.uint8)).save(os.path.join(media, 'broken.jpg'), 'JPEG')
+            self.assertEqual(score_files(walk(media), output, models, workers=0, retry_errors=True, progress_s=0), (1, 7))
+            with open(output) as f:
+                rows = [json.loads(line) for line in f]
+            self.assertEqual(len(rows), 8)
+            self.assertEqual([row for row in rows if 'error' in row], [])
+
+            # Outputs from before that still list the path twice convert with only its last row
+            from bulk_score import _last_rows
+            with open(output, 'a') as f:
+                f.write(json.dumps(dict(rows[0], result='duplicate')) + '\n')
+            self.assertEqual(sorted(_last_rows(output)), list(range(1, 9)))
+
+    # TEST #35: Evaluation Reuses Cached Logits
+    # PURPOSE: Tests that a second evaluation of the same files runs no model and that the metrics match hand counts
+    # INPUT: 4 real and 4 fake images scored by a random ViT, then evaluated again with a loader that must not be called
+    # EXPECTED OUTPUT: 8 inferred then 8 cached with identical logits; a known logit set gives AUC 0.75 and its confusion matrix
+    def test_eval_uses_cached_logits(self):
+        import torch
+        from transformers import ViTConfig, ViTForImageClassification, ViTImageProcessor
+        from bulk_score import Models
+        from benchmarks.model_eval import collect, evaluate, find_items, read_manifest
+        config = ViTConfig(hidden_size=32, num_hidden_layers=1, num_attention_heads=2, intermediate_size=64, num_labels=2)
+        loaded = (ViTImageProcessor(), ViTForImageClassification(config), torch.device('cpu'))
+        rng = np.random.default_rng(4)
+        with tempfile.TemporaryDirectory() as directory:
+            for label in ('real', 'fake'):
+                os.makedirs(os.path.join(directory, 'data', label))
+                for i in range(4):
+                    Image.fromarray(rng.integers(0, 256, (48, 48, 3), dtype=np.uint8)).save(
+                        os.path.join(directory, 'data', label, f'{i}.png'))
+            items = find_items(os.path.join(directory, 'data'), 'image')
+            # The same dataset as a CSV manifest with a header row lists the same items
+            manifest = os.path.join(directory, 'data', 'manifest.csv')
+            with open(manifest, 'w') as f:
+                f.write('path,label\n# generated\n')
+                f.writelines(f"{os.path.relpath(path, os.path.dirname(manifest))},{'fake' if label else 'real'}\n"
+                             for path, label in items)
+            self.assertEqual(read_manifest(manifest), items)
+            cache_dir = os.path.join(directory, 'cache')
+            first = collect('image', items, Models({'image': lambda: loaded}), cache_dir, workers=0, batch_size=3)
+
+            def no_model():
+                raise AssertionError('the model should not run on cached files')
+            second = collect('image', items, Models({'image': no_model}), cache_dir, workers=0)
+
+            expected = '8/0 0/8 True'
+            actual = f"{first[3]['inferred']}/{first[3]['cached']} {second[3]['inferred']}/{second[3]['cached']} " \
+                     f"{bool(np.array_equal(first[0], second[0]))}"
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_eval_uses_cached_logits', expected, actual, actual == expected)
+            )
+
+        # Fake probabilities 0.1, 0.4 (real) and 0.35, 0.8 (fake): 3 of 4 real/fake pairs ranked right
+        probabilities = np.array([0.1, 0.4, 0.35, 0.8])
+        logits = np.stack([np.zeros(4), np.log(probabilities / (1 - probabilities))], axis=1)
+        report = evaluate(logits, np.array([0, 0, 1, 1]), 1, threshold=0.38, thresholds=[0.38])
+        self.assertAlmostEqual(report['roc']['auc'], 0.75)
+        self.assertEqual(report['confusion_matrix'], [[1, 1], [1, 1]])
+        self.assertEqual(report['threshold_sweep'][0]['accuracy'], 0.5)
+        self.assertAlmostEqual(report['pr']['average_precision'], 0.5 * 1.0 + 0.5 * 2 / 3)
+
+    # TEST #36: Content Writer Batches Inserts Off The Request Path
+    # PURPOSE: Tests that queued analysis rows reach the Content table in a few executemany batches
+    # INPUT: 250 rows submitted to a writer with 100-row batches over a SQLite file database
+    # EXPECTED OUTPUT: All 250 rows stored by 3 executemany statements; anonymous rows keep a null user_id
+    def test_content_writer_batches(self):
+        from sqlalchemy import create_engine, event as sa_event
+        from content_writer import ContentWriter
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'content.db')}")
+            db.metadata.create_all(engine)
+            statements = []
+            sa_event.listen(engine, 'before_cursor_execute',
+                            lambda conn, cursor, sql, params, context, executemany: statements.append(executemany))
+            writer = ContentWriter(Content.__table__, lambda: engine, batch_rows=100, flush_ms=50)
+            start = time.perf_counter()
+            for i in range(250):
+                writer.submit({
+                    'user_id': None, 'file_path': f'{i}.png', 'file_name': f'{i}.png', 'file_size': i,
+                    'is_deepfake': i % 2 == 0, 'analysis': {'fake_confidence': 0.5}, 'upload_date': datetime.utcnow(),
+                    'upload_type': UploadType.image, 'upload_category': 'image', 'model_applied': ModelApplied.dima,
+                })
+            submit_ms = (time.perf_counter() - start) * 1000
+            for _ in range(100):
+                if not writer.pending():
+                    break
+                time.sleep(0.05)
+            writer.close()
+
+            with engine.connect() as connection:
+                stored = connection.execute(Content.__table__.select()).fetchall()
+            expected = '250 rows in 3 batches'
+            actual = f'{len(stored)} rows in {sum(statements)} batches'
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_content_writer_batches', expected, actual, actual == expected)
+            )
+
+            self.assertTrue(all(row.user_id is None for row in stored))
+            self.assertEqual(stored[0].analysis, {'fake_confidence': 0.5})
+            self.assertLess(submit_ms, 250)
+
+            # A database without the table fails the same way every time: the batch is dropped, not retried forever
+            unmigrated = create_engine(f"sqlite:///{os.path.join(directory, 'empty.db')}")
+            broken = ContentWriter(Content.__table__, lambda: unmigrated, batch_rows=10)
+            broken.submit(dict(stored[0]._mapping, id=None))
+            self.assertTrue(broken.flush())
+            self.assertEqual(broken.pending(), 0)
+
+            # A locked database is worth waiting out: the batch goes back in the buffer
+            locked = create_engine(f"sqlite:///{os.path.join(directory, 'content.db')}")
+            sa_event.listen(locked, 'connect', lambda connection, record: connection.execute('PRAGMA busy_timeout = 50'))
+            holder = engine.connect()
+            holder.exec_driver_sql('BEGIN EXCLUSIVE')
+            waiting = ContentWriter(Content.__table__, lambda: locked, batch_rows=10)
+            waiting.submit(dict(stored[0]._mapping, id=None))
+            self.assertFalse(waiting.flush())
+            self.assertEqual(waiting.pending(), 1)
+            holder.exec_driver_sql('ROLLBACK')
+            holder.close()
+            self.assertTrue(waiting.flush())
+
+            # Rows arriving while before_insert is busy are still prepared before they are inserted
+            def prepare(batch):
+                time.sleep(0.02)
+                for row in batch:
+                    if row.pop('upload', None):
+                        row['file_hash'] = 'stored'
+            hooked = ContentWriter(Content.__table__, lambda: engine, batch_rows=5, flush_ms=10, before_insert=prepare)
+            template = {name: value for name, value in stored[0]._mapping.items() if name != 'id'}
+            for i in range(50):
+                hooked.submit(dict(template, file_name=f'hooked-{i}', upload=b'media'))
+                time.sleep(0.002)
+            hooked.close()
+            with engine.connect() as connection:
+                hashes = [row.file_hash for row in connection.execute(
+                    Content.__table__.select().where(Content.__table__.c.file_name.like('hooked-%')))]
+            self.assertEqual((len(hashes), set(hashes)), (50, {'stored'}))
+
+    # TEST #37: History Pages Through Every Analysis Once
+    # PURPOSE: Tests that /api/history keyset pagination returns a user's analyses newest first, without gaps or repeats
+    # INPUT: 250 analyses for one user (pairs share a timestamp) and 50 for another, read 40 at a time, then filtered
+    # EXPECTED OUTPUT: All 250 ids in (upload_date, id) descending order; the fake filter only returns fakes; the page seeks an index;
+    #                  requests without a valid X-API-Key get 403
+    def test_history_keyset_pagination(self):
+        import sys
+        from unittest.mock import patch
+        with self.app.app_context():
+            owner = User(username='history_owner', email='history_owner@example.com', password_hash='x')
+            other = User(username='history_other', email='history_other@example.com', password_hash='x')
+            db.session.add_all([owner, other])
+            db.session.commit()
+            start = datetime(2025, 1, 1)
+            db.session.execute(Content.__table__.insert(), [{
+                'user_id': owner.id if i < 250 else other.id, 'file_path': f'{i}.png', 'file_name': f'{i}.png',
+                'file_size': i, 'is_deepfake': i % 3 == 0, 'analysis': {'fake_confidence': 0.9 if i % 3 == 0 else 0.1},
+                'upload_date': start + timedelta(minutes=i // 2), 'upload_type': UploadType.image,
+                'upload_category': 'image', 'model_applied': ModelApplied.dima,
+            } for i in range(300)])
+            db.session.commit()
+            plan = db.session.execute(db.text(
+                "EXPLAIN QUERY PLAN SELECT * FROM content WHERE user_id = 1 AND upload_date <= '2025-01-02' "
+                "ORDER BY upload_date DESC, id DESC LIMIT 41")).fetchall()
+
+        headers = {'X-API-Key': 'history-secret'}
+        with patch.dict(sys.modules['app'].API_KEYS, {'history-secret': 'support'}):
+            ids, cursor, pages = [], None, 0
+            while True:
+                query = {'username': 'history_owner', 'limit': 40}
+                if cursor:
+                    query['cursor'] = cursor
+                page = self.client.get('/api/history', query_string=query, headers=headers).get_json()
+                ids += [item['id'] for item in page['items']]
+                pages += 1
+                cursor = page['next_cursor']
+                if not cursor:
+                    break
+
+            # Expect: newest first, ids descending within a timestamp, every row exactly once
+            expected = '250 ids, 7 pages, ordered'
+            actual = f"{len(set(ids))} ids, {pages} pages, {'ordered' if ids == sorted(ids, reverse=True) else 'unordered'}"
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_history_keyset_pagination', expected, actual, actual == expected)
+            )
+
+            fakes = self.client.get('/api/history', query_string={'username': 'history_owner', 'is_deepfake': 'true', 'limit': 100},
+                                    headers=headers)
+            self.assertTrue(all(item['is_deepfake'] for item in fakes.get_json()['items']))
+            self.assertEqual(len(fakes.get_json()['items']), 84)
+            self.assertIn('ix_content_user_date', plan[0][-1])
+            self.assertEqual(self.client.get('/api/history', query_string={'username': 'history_owner', 'cursor': '!!'},
+                                             headers=headers).status_code, 400)
+            self.assertEqual(self.client.get('/api/history', headers=headers).status_code, 400)
+            # Naming a user is not enough to read their history
+            self.assertEqual(self.client.get('/api/history', query_string={'username': 'history_owner'}).status_code, 403)
+            self.assertEqual(self.client.get('/api/history', headers={'X-Username': 'history_owner', 'X-API-Key': 'guess'}).status_code, 403)
+
+    # TEST #38: Stats Come From The Daily Rollups
+    # PURPOSE: Tests that rows counted into analysis_rollup as they are written give the same /api/stats as a rebuild from Content
+    # INPUT: 4 fast fake images and 6 slower real audio files on one day, one untimed text analysis the next
+    # EXPECTED OUTPUT: 11 analyses, 4 fake, p50 interpolated inside the 250-500ms bucket, two days, and an identical rebuild
+    def test_stats_from_rollups(self):
+        import rollups
+        day = datetime(2025, 3, 1, 12)
+        rows = [{
+            'user_id': None, 'file_path': 'a', 'file_name': 'a', 'file_size': 1, 'is_deepfake': i < 4,
+            'analysis': {'latency_ms': 40.0 if i < 4 else 300.0}, 'upload_date': day,
+            'upload_type': UploadType.image if i < 4 else UploadType.audio, 'upload_category': 'upload',
+            'model_applied': ModelApplied.dima if i < 4 else ModelApplied.melody,
+        } for i in range(10)]
+        rows.append(dict(rows[-1], analysis={}, upload_date=day + timedelta(days=1),
+                         upload_type=UploadType.text, model_applied=ModelApplied.mosko))
+        query = {'from': '2025-03-01', 'to': '2025-03-02'}
+        with self.app.app_context():
+            connection = db.session.connection()
+            connection.execute(Content.__table__.insert(), rows)
+            rollups.add(AnalysisRollup.__table__, connection, rows)
+            db.session.commit()
+        incremental = self.client.get('/api/stats', query_string=query).get_json()
+
+        # Expect: p50 is the 5th of 10 timed analyses, 1/6 of the way into the (250, 500] bucket
+        totals = incremental['totals']
+        expected = '11 analyses, 4 fake, p50 291.7ms, 2 days'
+        actual = f"{totals['analyses']} analyses, {totals['fake']} fake, p50 {totals['latency_ms']['p50']}ms, {len(incremental['days'])} days"
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_stats_from_rollups', expected, actual, actual == expected)
+        )
+
+        with self.app.app_context():
+            connection = db.session.connection()
+            self.assertEqual(rollups.rebuild(connection, Content.__table__, AnalysisRollup.__table__), (11, 3))
+            db.session.commit()
+        self.assertEqual(self.client.get('/api/stats', query_string=query).get_json(), incremental)
+        self.assertEqual(totals['by_type']['audio'], {'analyses': 6, 'fake': 0})
+        self.assertIsNone(incremental['days'][1]['latency_ms']['p50'])
+        self.assertEqual(self.client.get('/api/stats', query_string={'upload_type': 'gif'}).status_code, 400)
+
+    # TEST #39: Export Streams Every Row In Chunks
+    # PURPOSE: Tests that exports read Content a chunk at a time without losing or repeating rows, as NDJSON, CSV and gzip
+    # INPUT: 50 analyses for one user (pairs share a timestamp) and 10 for another, exported in chunks of 7
+    # EXPECTED OUTPUT: The user's 50 ids oldest first, the same rows as gzipped CSV through /api/export, and 403 without a key
+    def test_export_streams_chunks(self):
+        import gzip
+        import csv
+        import sys
+        from unittest.mock import patch
+        import content_export
+        with self.app.app_context():
+            owner = User(username='export_owner', email='export_owner@example.com', password_hash='x')
+            db.session.add(owner)
+            db.session.commit()
+            db.session.execute(Content.__table__.insert(), [{
+                'user_id': owner.id if i < 50 else None, 'file_path': f'{i}.png', 'file_name': f'{i}.png', 'file_size': i,
+                'is_deepfake': i % 2 == 0, 'analysis': {'fake_confidence': i / 100}, 'upload_date': datetime(2025, 1, 1) + timedelta(minutes=i // 2),
+                'upload_type': UploadType.image, 'upload_category': 'image', 'model_applied': ModelApplied.dima,
+            } for i in range(60)])
+            db.session.commit()
+            chunks = list(content_export.export(db.engine, Content.__table__, user_id=owner.id, chunk_rows=7))
+        records = [json.loads(line) for line in b''.join(chunks).decode().splitlines()]
+
+        # Expect: 8 chunks (7 x 7 + 1), ids ascending because they follow the upload dates
+        expected = '50 rows in 8 chunks, oldest first'
+        ids = [record['id'] for record in records]
+        actual = f"{len(set(ids))} rows in {len(chunks)} chunks, {'oldest first' if ids == sorted(ids) else 'unordered'}"
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_export_streams_chunks', expected, actual, actual == expected)
+        )
+
+        self.assertEqual(records[3]['analysis'], {'fake_confidence': 0.03})
+        query = {'username': 'export_owner', 'format': 'csv', 'gzip': 'true'}
+        with patch.dict(sys.modules['app'].API_KEYS, {'export-secret': 'reporting'}):
+            response = self.client.get('/api/export', query_string=query, headers={'X-API-Key': 'export-secret'})
+            self.assertEqual(response.mimetype, 'application/gzip')
+            rows = list(csv.DictReader(io.StringIO(gzip.decompress(response.data).decode())))
+            self.assertEqual([int(row['id']) for row in rows], ids)
+            self.assertEqual(json.loads(rows[3]['analysis']), {'fake_confidence': 0.03})
+            # Naming a user, by parameter or header, doesn't stand in for the key
+            self.assertEqual(self.client.get('/api/export', query_string=query).status_code, 403)
+            self.assertEqual(self.client.get('/api/export', headers={'X-Username': 'export_owner'}).status_code, 403)
+            self.assertEqual(self.client.get('/api/export', headers={'X-API-Key': 'wrong'}).status_code, 403)
+            self.assertEqual(self.client.get('/api/export').status_code, 403)
+
+    # TEST #40: Blob Store Keeps One Copy Per Upload
+    # PURPOSE: Tests that repeated uploads share one content-addressed blob and that only unreferenced blobs are collected
+    # INPUT: The same bytes stored three times and referenced by a Content row, plus an unreferenced blob, both older than the grace period
+    # EXPECTED OUTPUT: One file for the repeated upload, read back through mmap; the collector deletes just the unreferenced blob
+    def test_blob_store_dedupes_and_collects(self):
+        import blob_store
+        with tempfile.TemporaryDirectory() as directory:
+            store = blob_store.BlobStore(directory, fsync=False)
+            media = b'\x89PNG' + bytes(range(256)) * 40
+            digests = {store.put(media) for _ in range(3)}
+            orphan = store.put(b'nobody kept this one')
+            kept = digests.pop()
+            with self.app.app_context():
+                db.session.execute(Content.__table__.insert(), [{
+                    'user_id': None, 'file_path': store.relative_path(kept), 'file_name': 'a.png', 'file_size': len(media),
+                    'is_deepfake': False, 'analysis': {}, 'upload_date': datetime.utcnow(), 'upload_type': UploadType.image,
+                    'upload_category': 'image', 'model_applied': ModelApplied.dima, 'file_hash': kept,
+                }] * 2)
+                db.session.commit()
+                for digest in (kept, orphan):
+                    os.utime(store.path(digest), (time.time() - 7200,) * 2)
+                with db.engine.connect() as connection:
+                    references = blob_store.references(connection, Content.__table__, [kept, orphan])
+                collected = blob_store.collect(store, db.engine, Content.__table__, grace_s=3600)
+            with store.mapped(kept) as data:
+                same_bytes = data[:] == media
+
+            # Expect: 2 blobs seen, the orphan's 20 bytes reclaimed, the shared blob intact
+            expected = '1 file left, 2 refs, (2, 1, 20), intact'
+            files = sum(len(names) for _, _, names in os.walk(directory))
+            actual = f"{files} file left, {references[kept]} refs, {collected}, {'intact' if same_bytes and kept in store else 'lost'}"
+            self.assertEqual(actual, expected)
+
+            # Store the result
+            self.test_results.append(
+                ('test_blob_store_dedupes_and_collects', expected, actual, actual == expected)
+            )
+
+            self.assertNotIn(orphan, store)
+            self.assertEqual(store.relative_path(kept), os.path.join(kept[:2], kept[2:4], kept))
+
+            # An analysed upload is stored by the content writer, before its row is inserted, not by the request
+            import sys
+            import hashlib
+            from unittest.mock import patch
+            app_module = sys.modules['app']
+            upload = b'\x89PNG analysed upload'
+            digest = hashlib.sha256(upload).hexdigest()
+            with patch.object(app_module, 'blobs', store), self.app.test_request_context('/api/analyze'):
+                app_module.record_analysis(upload, 'image', 'dima', 'image', {'filename': 'b.png', 'result': 'real'})
+                stored_by_request = digest in store
+                self.assertTrue(app_module.analysis_writer.flush())
+            with self.app.app_context():
+                row = Content.query.filter_by(file_name='b.png').one()
+            self.assertEqual((stored_by_request, digest in store, row.file_hash, row.file_path),
+                             (False, True, digest, store.relative_path(digest)))
+
+    # TEST #41: Analyze Rejects Unknown Upload Types
+    # PURPOSE: Tests that '/api/analyze' answers an unknown type with 400 instead of failing on a missing queue
+    # INPUT: POST requests with type 'foo' and 'TEXT'
+    # EXPECTED OUTPUT: 400 for both
+    def test_analyze_unknown_type(self):
+        statuses = [
+            self.client.post('/api/analyze', data={'type': upload_type, 'text': 'headline',
+                                                   'file': (io.BytesIO(b'x'), 'x.bin')}).status_code
+            for upload_type in ('foo', 'TEXT')
+        ]
+
+        # Expect: 400, 400
+        expected = '400 400'
+        actual = ' '.join(str(status) for status in statuses)
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_analyze_unknown_type', expected, actual, actual == expected)
+        )
+
+
+    # TEST #42: Model Store Rejects Files That Don't Match The Lock
+    # PURPOSE: Tests that sync pins an unlocked model, and that verify, load_pretrained and sync then refuse
+    #          model files whose checksums differ from the lock file
+    # INPUT: A first sync with no lock, the stored weights tampered with, then a hub serving different weights
+    # EXPECTED OUTPUT: The first sync pins the resolved commit; verify, load_pretrained and the second sync all fail
+    def test_model_store_rejects_tampering(self):
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        import huggingface_hub
+        import model_store
+        from model_store import ModelStoreError
+        revision = 'a' * 40
+        hub = {'weights': b'original weights'}
+        with tempfile.TemporaryDirectory() as directory:
+            manifest_path = os.path.join(directory, 'model_store.json')
+            lock_path = os.path.join(directory, 'model_store.lock.json')
+            store_dir = os.path.join(directory, 'model_files')
+            path = os.path.join(store_dir, 'tiny', revision)
+            with open(manifest_path, 'w') as f:
+                json.dump({'tiny': {'repo_id': 'org/tiny', 'revision': 'main'}}, f)
+
+            def download(repo_id, revision, local_dir, **kwargs):
+                os.makedirs(local_dir, exist_ok=True)
+                with open(os.path.join(local_dir, 'model.safetensors'), 'wb') as f:
+                    f.write(hub['weights'])
+
+            def rejects(call):
+                try:
+                    call()
+                except ModelStoreError:
+                    return 'rejected'
+                return 'accepted'
+
+            with patch.object(model_store, 'MANIFEST_PATH', manifest_path), \
+                    patch.object(model_store, 'LOCK_PATH', lock_path), \
+                    patch.object(model_store, 'STORE_DIR', store_dir), \
+                    patch.object(model_store, 'VERIFY_MODE', 'once'), \
+                    patch.object(huggingface_hub, 'snapshot_download', download), \
+                    patch.object(huggingface_hub.HfApi, 'model_info', lambda self, repo_id, revision: SimpleNamespace(sha='a' * 40)):
+                lock = model_store.sync(['tiny'])
+                pinned = 'pinned' if model_store.model_revision('tiny') == revision else 'unpinned'
+                model_store.verify('tiny', lock['tiny'], path)
+                # Same size, different bytes: the stamp from the first verify must not vouch for them
+                with open(os.path.join(path, 'model.safetensors'), 'wb') as f:
+                    f.write(b'tampered weights')
+                hub['weights'] = b'modified weights'
+                results = [
+                    pinned,
+                    rejects(lambda: model_store.verify('tiny', lock['tiny'], path)),
+                    rejects(lambda: model_store.load_pretrained('tiny', None)),
+                    rejects(lambda: model_store.sync(['tiny'])),
+                ]
+                with open(lock_path) as f:
+                    lock_after = json.load(f)
+
+        # Expect: the first sync pins, then every path refuses the files and the lock file is left as it was
+        expected = 'pinned rejected rejected rejected'
+        actual = ' '.join(results)
+        self.assertEqual(actual, expected)
+        self.assertEqual(lock_after, lock)
+
+        # Store the result
+        self.test_results.append(
+            ('test_model_store_rejects_tampering', expected, actual, actual == expected)
+        )
+
+    # TEST #43: Client-Chosen Models Map To A Fixed Set Of Metric Labels
+    # PURPOSE: Tests that the model named in an analyze request is reduced to a known model, 'ensemble' or 'other'
+    # INPUT: Known models, ensemble spellings and 1000 random model names
+    # EXPECTED OUTPUT: Known names kept, ensembles folded together, every random name reported as 'other'
+    def test_model_label_cardinality(self):
+        from app import known_model
+        rng = np.random.default_rng(43)
+        labels = {known_model(rng.bytes(8).hex()) for _ in range(1000)}
+
+        # Expect: dima mosko ensemble ensemble and a single label for the random names
+        expected = 'dima mosko ensemble ensemble other'
+        actual = ' '.join([known_model('dima'), known_model('mosko'), known_model('ensemble'),
+                           known_model('Ensemble-v2'), *sorted(labels)])
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_model_label_cardinality', expected, actual, actual == expected)
+        )
+
+    # TEST #44: Concurrent Identical Analyses Share One Model Run
+    # PURPOSE: Tests that identical analyze requests arriving together run the model once, and that a waiting
+    #          request gives up at its own deadline rather than waiting out the leader
+    # INPUT: 4 concurrent text analyses of the same headline against a slow stand-in model; a waiter with a
+    #        0.1s deadline behind a 1s computation
+    # EXPECTED OUTPUT: 1 model run, 4 identical 200 answers, 3 of them coalesced; the waiter raises
+    #                  DeadlineExceeded well before the computation ends
+    def test_analysis_singleflight(self):
+        import sys
+        import threading
+        from unittest.mock import patch
+        from scheduler import Deadline, DeadlineExceeded
+        from singleflight import SingleFlight
+        app_module = sys.modules['app']
+        runs = []
+        started = threading.Barrier(4)
+
+        def slow_model(text_bytes, upload_type, model_type, deadline=None, tier=None):
+            runs.append(text_bytes)
+            time.sleep(0.5)
+            return {'result': 'fake', 'fake_confidence': float(np.random.random())}
+
+        def analyze(responses):
+            started.wait()
+            response = app.test_client().post('/api/analyze', data={'type': 'text', 'text': headline})
+            responses.append((response.status_code, response.get_json(), response.headers.get('X-Iris-Coalesced')))
+
+        headline = f'Singleflight headline {time.time()}'
+        responses = []
+        loaded = object()
+        with patch.multiple(app_module, analyze_text=slow_model, tokenizer_text=loaded, model_text=loaded,
+                            processor_dima=loaded, model=loaded):
+            threads = [threading.Thread(target=analyze, args=(responses,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        flight = SingleFlight(directory=None)
+        leader = threading.Thread(target=flight.do, args=('slow', lambda: time.sleep(1) or 'done'))
+        leader.start()
+        time.sleep(0.05)
+        start = time.monotonic()
+        try:
+            flight.do('slow', lambda: 'follower ran', Deadline(0.1))
+            waited = 'returned'
+        except DeadlineExceeded:
+            waited = 'deadline' if time.monotonic() - start < 0.5 else 'late'
+        leader.join()
+
+        # Expect: one run, four identical answers, three of them shared, and the waiter stopped at its deadline
+        expected = '1 200x4 1 3 deadline'
+        actual = f"{len(runs)} {'x'.join(sorted(set(str(status) for status, _, _ in responses)))}x{len(responses)} " \
+                 f"{len(set(json.dumps(body, sort_keys=True) for _, body, _ in responses))} " \
+                 f"{sum(shared == 'local' for _, _, shared in responses)} {waited}"
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_analysis_singleflight', expected, actual, actual == expected)
+        )
+
+    # TEST #45: Image Features Are Computed Before Queueing For The Model
+    # PURPOSE: Tests that decoding, PRNU and ELA run before an image analysis takes an inference slot,
+    #          and that the analyzer receives their results instead of recomputing them
+    # INPUT: One image analysis with PRNU enabled and a stand-in analyzer and queue that note when they run
+    # EXPECTED OUTPUT: PRNU and ELA both run outside the slot; the analyzer gets the decoded image and both features
+    def test_image_features_outside_queue(self):
+        import sys
+        from unittest.mock import patch
+        app_module = sys.modules['app']
+        calls = []
+        real_run_queued, real_prnu, real_ela = app_module.run_queued, app_module.prnu.analyze, app_module.ela.analyze
+
+        def run_queued(*args, **kwargs):
+            calls.append('slot')
+            return real_run_queued(*args, **kwargs)
+
+        def stand_in(file_bytes, upload_type, model_type, deadline=None, tier=None, image=None, features=None):
+            calls.append(f"model {image.size[0]}x{image.size[1]} {sorted(features)}")
+            return {'result': 'real', 'fake_confidence': 0.1}
+
+        buffer = io.BytesIO()
+        rng = np.random.default_rng(45)
+        Image.fromarray(rng.integers(0, 255, (300, 400, 3), dtype=np.uint8)).save(buffer, 'PNG')
+        loaded = object()
+        with patch.multiple(app_module, analyze_image=stand_in, run_queued=run_queued, processor_dima=loaded, model=loaded,
+                            blobs=None), \
+                patch.object(app_module.prnu, 'ENABLED', True), \
+                patch.object(app_module.prnu, 'analyze', lambda *args, **kwargs: calls.append('prnu') or real_prnu(*args, **kwargs)), \
+                patch.object(app_module.ela, 'analyze', lambda *args, **kwargs: calls.append('ela') or real_ela(*args, **kwargs)):
+            response = self.client.post('/api/analyze', data={'type': 'image',
+                                                              'file': (io.BytesIO(buffer.getvalue()), 'noise.png')})
+            app_module.analysis_writer.flush()
+
+        # Expect: both features before the slot, then the model with the decoded image and both features
+        expected = "200 prnu, ela, slot, model 400x300 ['ela', 'prnu']"
+        actual = f"{response.status_code} {', '.join(calls)}"
+        self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_image_features_outside_queue', expected, actual, actual == expected)
+        )
+
+    # TEST #46: Prefilter-Decided Fakes Still Reach The Embedding Index
+    # PURPOSE: Tests that with the cascade and the embedding index both on, a clear fake is embedded by the
+    #          full model while a clear real is still answered by the prefilter alone
+    # INPUT: Stand-in prefilter and full models scoring 0.99 fake, then 0.01 fake; a fresh 8-d index
+    # EXPECTED OUTPUT: The fake goes to the full stage and is stored; the real stops at the prefilter
+    def test_cascade_fakes_reach_embedding_index(self):
+        import sys
+        import torch
+        from types import SimpleNamespace
+        from unittest.mock import patch
+        from cascade import Cascade
+        from degradation import FULL
+        from embedding_index import EmbeddingIndex
+        app_module = sys.modules['app']
+        scores = {'fake': 0.99}
+
+        class StandIn:
+            config = SimpleNamespace(id2label={0: 'LABEL_0', 1: 'LABEL_1'})
+            vit = SimpleNamespace(layernorm=lambda hidden: hidden)
+
+            def __call__(self, output_attentions=False, output_hidden_states=False):
+                fake = scores['fake']
+                return SimpleNamespace(logits=torch.log(torch.tensor([[1 - fake, fake]])), attentions=None,
+                                       hidden_states=[torch.ones(1, 2, 8)] if output_hidden_states else None)
+
+        features = {'prnu': None}
+        with tempfile.TemporaryDirectory() as directory:
+            index = EmbeddingIndex(8, directory)
+            with patch.multiple(app_module, model=StandIn(), model_reduced=StandIn(), embedding_index=index,
+                                image_cascade=Cascade(True, 0.05, 0.95, 112),
+                                image_inputs=lambda *args: {}, _image_inputs=lambda *args: {}):
+                fake = app_module.analyze_image(b'clear fake', 'image', 'dima', tier=FULL,
+                                                image=Image.new('RGB', (64, 64)), features=features)
+                scores['fake'] = 0.01
+                real = app_module.analyze_image(b'clear real', 'image', 'dima', tier=FULL,
+                                                image=Image.new('RGB', (64, 64)), features=features)
+
+            # Expect: the fake is embedded by the full model, the real never leaves the prefilter
+            expected = 'fake full 1, real prefilter 1'
+            actual = f"{fake['result']} {fake['stage']} {len(index)}, {real['result']} {real['stage']} {len(index)}"
+            self.assertEqual(actual, expected)
+
+        # Store the result
+        self.test_results.append(
+            ('test_cascade_fakes_reach_embedding_index', expected, actual, actual == expected)
+        )
 
     # Add this method to run after all tests
     @classmethod
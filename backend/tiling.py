@@ -0,0 +1,70 @@
+import math
+import os
+
+import numpy as np
+from PIL import Image
+
+# High-resolution tiled inference for the image model. Instead of squeezing
+# the whole picture into 224x224, it is cut into overlapping 224x224 tiles at
+# (close to) native resolution, so local blending and upsampling artefacts
+# survive. The image is first scaled down to TILED_PIXEL_BUDGET pixels when it
+# is larger, which caps the number of tiles and so the worst-case latency of
+# the single batched forward pass. A side shorter than a tile is padded up to
+# one rather than the whole image being enlarged, and the long side is kept
+# to budget / tile, so thin panoramas stay within the budget too; TILED_MAX_TILES
+# is the hard limit behind that.
+
+TILE_SIZE = 224
+PIXEL_BUDGET = int(os.environ.get('TILED_PIXEL_BUDGET', str(512 * 1024)))
+OVERLAP = float(os.environ.get('TILED_OVERLAP', '0.25'))
+# The verdict blends the global view with the mean of the most suspicious tiles
+TOP_K = int(os.environ.get('TILED_TOP_K', '3'))
+GLOBAL_WEIGHT = float(os.environ.get('TILED_GLOBAL_WEIGHT', '0.5'))
+MAX_TILES = int(os.environ.get('TILED_MAX_TILES', '64'))
+
+
+class TooManyTiles(Exception):
+    """The image would need more tiles than one forward pass is allowed."""
+
+
+def fit_to_budget(image, budget=PIXEL_BUDGET, tile=TILE_SIZE):
+    """Scale so the image, padded to at least one tile each way, fits in budget pixels. Returns (image, scale)."""
+    width, height = image.size
+    scale = 1.0
+    if width * height > budget:
+        scale = math.sqrt(budget / (width * height))
+    # Once the short side is padded to a tile, the long side alone has to fit the budget
+    scale = min(scale, budget / tile / max(width, height))
+    if scale != 1.0:
+        image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+    if min(image.size) < tile:
+        pixels = np.asarray(image)
+        padding = ((0, max(0, tile - pixels.shape[0])), (0, max(0, tile - pixels.shape[1])), (0, 0))
+        image = Image.fromarray(np.pad(pixels, padding, mode='edge'))
+    return image, scale
+
+
+def tile_positions(length, tile=TILE_SIZE, overlap=OVERLAP):
+    """Evenly spaced tile offsets along one axis, first and last flush with the edges."""
+    if length <= tile:
+        return [0]
+    stride = max(1, int(tile * (1 - overlap)))
+    count = math.ceil((length - tile) / stride) + 1
+    return [int(round(offset)) for offset in np.linspace(0, length - tile, count)]
+
+
+def cut_tiles(image, tile=TILE_SIZE, overlap=OVERLAP, max_tiles=MAX_TILES):
+    """(tiles as an (N, tile, tile, 3) uint8 array, row offsets, column offsets), row-major."""
+    pixels = np.asarray(image)
+    ys = tile_positions(pixels.shape[0], tile, overlap)
+    xs = tile_positions(pixels.shape[1], tile, overlap)
+    if len(ys) * len(xs) > max_tiles:
+        raise TooManyTiles(f'{len(ys) * len(xs)} tiles needed, at most {max_tiles} allowed')
+    tiles = np.stack([pixels[y:y + tile, x:x + tile] for y in ys for x in xs])
+    return tiles, ys, xs
+
+
+def aggregate(global_fake, tile_fakes, top_k=TOP_K, global_weight=GLOBAL_WEIGHT):
+    """Blend the global view with the mean of the top_k most suspicious tiles."""
+    suspicious = np.sort(np.asarray(tile_fakes))[-top_k:]
+    return float(global_weight * global_fake + (1 - global_weight) * suspicious.mean())
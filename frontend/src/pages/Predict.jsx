@@ -136,6 +136,9 @@ const Predict = () => {
     }
   };
 
+  // Give up on an analysis after this long; the server is told too so it can drop the work
+  const ANALYZE_TIMEOUT_MS = 120000;
+
   const analyzeFile = async () => {
     if (selectedType === 'Text') {
       if (!newsTitle || !newsText || !newsSubject || !newsDate) {
@@ -165,16 +168,34 @@ const Predict = () => {
       } else {
         formData.append('file', file);
         formData.append('type', selectedType ? selectedType.toLowerCase() : 'image');
+        if (selectedType === 'Image') {
+          // Attention heatmap from the same forward pass; repeat views are served from the cache
+          formData.append('explain', 'true');
+        }
       }
       formData.append('model', selectedModel);
 
       setLoadingStatus('Processing...');
       setLoadingProgress(30);
 
-      const response = await fetch('http://localhost:5000/api/analyze', {
-        method: 'POST',
-        body: formData,
-      });
+      const controller = new AbortController();
+      const timer = setTimeout(() => controller.abort(), ANALYZE_TIMEOUT_MS);
+      let response;
+      try {
+        response = await fetch('http://localhost:5000/api/analyze', {
+          method: 'POST',
+          body: formData,
+          headers: { 'X-Request-Timeout': String(ANALYZE_TIMEOUT_MS / 1000) },
+          signal: controller.signal,
+        });
+      } catch (fetchError) {
+        if (fetchError.name === 'AbortError') {
+          throw new Error('Analysis timed out');
+        }
+        throw fetchError;
+      } finally {
+        clearTimeout(timer);
+      }
 
       setLoadingProgress(60);
 
@@ -210,7 +231,7 @@ const Predict = () => {
       case 'Video':
         return ['ASL Video Model'];
       case 'Image':
-        return ['Dima Image Model', 'Dima++ Image Model', 'Medical Image Model', 'ASL Sign Model'];
+        return ['Dima Image Model', 'Dima++ Image Model', 'Ensemble Image Model', 'Medical Image Model', 'ASL Sign Model'];
       default:
         return [];
     }
@@ -480,6 +501,16 @@ const Predict = () => {
               <p className="text-gray-600">{result.reason}</p>
             </div>
           )}
+          {result.explanation && (
+            <div className="mt-4">
+              <h4 className="text-lg font-medium mb-2">Model Attention:</h4>
+              <img
+                src={result.explanation.png}
+                alt="Regions the model focused on"
+                className="w-56 h-56 rounded-lg border"
+              />
+            </div>
+          )}
         </div>
       </div>
     );